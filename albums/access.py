@@ -0,0 +1,117 @@
+"""
+Access decisions for album pages and files.
+
+The owner is recognised by ``album.owner_id`` (the User row is never
+loaded) and public albums without a password need nothing else.  For
+everyone else the answer depends on the ``album_view_<id>`` key in the
+session; that answer is cached per ``(album, access version, session
+key)`` for ``ALBUM_ACCESS_CACHE_TIMEOUT`` seconds, so a burst of media
+requests from one visitor reads the session data once.
+
+The access version of an album is bumped whenever the rules behind a
+cached answer may have changed: on every save of the album (so
+``edit_album`` changing the password or visibility, and admin edits)
+and after ``invalidate_album_sessions`` has revoked the grants.
+"""
+from django.conf import settings
+
+from .cache import new_version, get_cache
+
+
+def _version_key(album_id):
+    return f'albums:access-version:{album_id}'
+
+
+def _decision_key(album_id, version, session_key):
+    return f'albums:access:{album_id}:{version}:{session_key}'
+
+
+def _timeout():
+    return getattr(settings, 'ALBUM_ACCESS_CACHE_TIMEOUT', 60)
+
+
+def _session_grant_key(album):
+    return f'album_view_{album.id}'
+
+
+def get_access_version(album_id):
+    cache = get_cache()
+    key = _version_key(album_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_access_version(album_id):
+    cache = get_cache()
+    key = _version_key(album_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, new_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_access_version(album_id):
+    """Forget every cached decision for the album."""
+    cache = get_cache()
+    key = _version_key(album_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), timeout=None)
+
+
+def _decide_without_session(request, album, user):
+    """``True``/``False`` when the answer is known without the session, else ``None``."""
+    if user.is_authenticated and album.owner_id == user.pk:
+        return True
+    if album.is_public and not album.view_password:
+        return True
+    if not request.session.session_key:
+        # Нет сессии — нет и выданного по паролю доступа
+        return False
+    return None
+
+
+def check_album_access(request, album, user=None):
+    """Whether the request may view ``album``."""
+    decision = _decide_without_session(request, album, user or request.user)
+    if decision is not None:
+        return decision
+
+    cache = get_cache()
+    key = _decision_key(album.id, get_access_version(album.id), request.session.session_key)
+    decision = cache.get(key)
+    if decision is None:
+        decision = bool(request.session.get(_session_grant_key(album)))
+        cache.set(key, decision, _timeout())
+    return decision
+
+
+async def acheck_album_access(request, album, user=None):
+    """``check_album_access`` for async views; pass the already resolved ``user``."""
+    decision = _decide_without_session(request, album, user or await request.auser())
+    if decision is not None:
+        return decision
+
+    cache = get_cache()
+    key = _decision_key(album.id, await aget_access_version(album.id), request.session.session_key)
+    decision = await cache.aget(key)
+    if decision is None:
+        decision = bool(await request.session.aget(_session_grant_key(album)))
+        await cache.aset(key, decision, _timeout())
+    return decision
+
+
+def remember_access(request, album):
+    """Record a fresh grant so a cached denial for this session does not linger."""
+    key = _decision_key(album.id, get_access_version(album.id), request.session.session_key)
+    get_cache().set(key, True, _timeout())
+
+
+async def aremember_access(request, album):
+    key = _decision_key(album.id, await aget_access_version(album.id), request.session.session_key)
+    await get_cache().aset(key, True, _timeout())
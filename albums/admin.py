@@ -1,14 +1,35 @@
+from django.conf import settings
 from django.contrib import admin
-from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.utils.html import format_html
-from .models import Album, MediaFile, ActivityLog, UserProfile
+from .models import Album, AlbumDailyStats, MediaFile, MediaJob, ActivityLog, UserProfile, UserAgent
+from .export import FORMATS, export_filename, export_stream
+from .search import EstimatedCountPaginator, search_activity
+
+def _user_agent_field(name, description, sortable=False):
+    """Read-only column showing a parsed field of the entry's UserAgent."""
+    @admin.display(description=description, ordering=f'user_agent__{name}' if sortable else None)
+    def column(self, obj):
+        return getattr(obj.user_agent, name) if obj.user_agent else ''
+    return column
 
 class ActivityLogAdmin(admin.ModelAdmin):
     list_display = ['user', 'action', 'timestamp', 'ip_address', 'album', 'content_url_link', 'browser_family', 'os_family']
-    list_filter = ['action', 'timestamp', 'browser_family', 'os_family', 'device_family']
-    search_fields = ['user__username', 'ip_address', 'user_agent', 'album__title', 'content_url']
-    readonly_fields = ['timestamp', 'ip_address', 'user_agent', 'referrer', 'object_id', 'content_url_readonly']
+    # Фильтры по устройству читают значения из небольшой таблицы UserAgent
+    list_filter = ['action', 'timestamp', 'user_agent__browser_family', 'user_agent__os_family', 'user_agent__device_family']
+    list_select_related = ['user', 'album', 'user_agent']
+    # Поиск выполняет albums.search; список нужен, чтобы админка показала поле поиска
+    search_fields = ['user__username', 'ip_address', 'user_agent__string', 'album__title', 'content_url']
+    search_help_text = 'IP-адрес или имя пользователя ищутся точно, остальное — по полнотекстовому индексу'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [
+        'timestamp', 'ip_address', 'user_agent_string', 'referrer', 'object_id', 'content_url_readonly',
+        'browser_family', 'browser_version', 'os_family', 'os_version',
+        'device_family', 'device_brand', 'device_model',
+    ]
     date_hierarchy = 'timestamp'
+    actions = ['export_csv', 'export_jsonl']
     
     fieldsets = (
         ('Основная информация', {
@@ -19,7 +40,7 @@ class ActivityLogAdmin(admin.ModelAdmin):
             'description': 'Информация о контенте (альбом или файл), над которым выполнено действие'
         }),
         ('Техническая информация', {
-            'fields': ('ip_address', 'user_agent', 'referrer')
+            'fields': ('ip_address', 'user_agent_string', 'referrer')
         }),
         ('Информация об устройстве', {
             'fields': (
@@ -30,6 +51,18 @@ class ActivityLogAdmin(admin.ModelAdmin):
         }),
     )
     
+    def user_agent_string(self, obj):
+        return obj.user_agent.string if obj.user_agent else '-'
+    user_agent_string.short_description = 'User agent'
+    
+    browser_family = _user_agent_field('browser_family', 'Browser family', sortable=True)
+    browser_version = _user_agent_field('browser_version', 'Browser version')
+    os_family = _user_agent_field('os_family', 'OS family', sortable=True)
+    os_version = _user_agent_field('os_version', 'OS version')
+    device_family = _user_agent_field('device_family', 'Device family')
+    device_brand = _user_agent_field('device_brand', 'Device brand')
+    device_model = _user_agent_field('device_model', 'Device model')
+    
     def content_url_link(self, obj):
         """Отображение content_url как кликабельной ссылки."""
         if obj.content_url:
@@ -52,22 +85,26 @@ class ActivityLogAdmin(admin.ModelAdmin):
         return '-'
     content_url_readonly.short_description = 'Content URL'
     
+    def _export(self, queryset, fmt):
+        compress = getattr(settings, 'ACTIVITY_LOG_EXPORT_GZIP', True)
+        response = StreamingHttpResponse(
+            export_stream(queryset, fmt, compress=compress),
+            content_type='application/gzip' if compress else FORMATS[fmt][0],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(fmt, compress)}"'
+        return response
+    
+    @admin.action(description='Выгрузить в CSV')
+    def export_csv(self, request, queryset):
+        return self._export(queryset, 'csv')
+    
+    @admin.action(description='Выгрузить в JSON Lines')
+    def export_jsonl(self, request, queryset):
+        return self._export(queryset, 'jsonl')
+    
     def get_search_results(self, request, queryset, search_term):
-        queryset, use_distinct = super().get_search_results(request, queryset, search_term)
-        
-        # Поиск по различным техническим параметрам
-        if search_term:
-            queryset |= self.model.objects.filter(
-                Q(ip_address__icontains=search_term) |
-                Q(user_agent__icontains=search_term) |
-                Q(browser_family__icontains=search_term) |
-                Q(os_family__icontains=search_term) |
-                Q(device_family__icontains=search_term) |
-                Q(device_brand__icontains=search_term) |
-                Q(device_model__icontains=search_term)
-            )
-        
-        return queryset, use_distinct
+        # Полнотекстовый индекс вместо LIKE '%...%' по всем полям; DISTINCT не нужен
+        return search_activity(queryset, search_term), False
 
 class AlbumAdmin(admin.ModelAdmin):
     list_display = ['title', 'owner', 'created_at', 'is_public', 'is_deleted', 'deleted_at']
@@ -92,10 +129,13 @@ class AlbumAdmin(admin.ModelAdmin):
     )
 
 class MediaFileAdmin(admin.ModelAdmin):
-    list_display = ['file', 'album', 'file_type', 'uploaded_at', 'is_deleted', 'deleted_at']
-    list_filter = ['file_type', 'is_deleted', 'uploaded_at']
+    list_display = ['file', 'album', 'file_type', 'processing_status', 'uploaded_at', 'is_deleted', 'deleted_at']
+    list_filter = ['file_type', 'processing_status', 'is_deleted', 'uploaded_at']
     search_fields = ['album__title', 'file']
-    readonly_fields = ['uploaded_at']
+    readonly_fields = [
+        'uploaded_at', 'processing_status', 'mime_type', 'file_size',
+        'width', 'height', 'duration', 'taken_at',
+    ]
     
     fieldsets = (
         ('Основная информация', {
@@ -105,12 +145,35 @@ class MediaFileAdmin(admin.ModelAdmin):
             'fields': ('is_deleted', 'deleted_at')
         }),
         ('Метаданные', {
-            'fields': ('uploaded_at',),
+            'fields': (
+                'uploaded_at', 'processing_status', 'mime_type', 'file_size',
+                'width', 'height', 'duration', 'taken_at',
+            ),
             'classes': ('collapse',)
         }),
     )
 
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'media_file', 'status', 'attempts', 'run_after', 'updated_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['created_at', 'updated_at', 'locked_at', 'last_error']
+
+class UserAgentAdmin(admin.ModelAdmin):
+    list_display = ['browser_family', 'browser_version', 'os_family', 'device_family', 'created_at']
+    list_filter = ['browser_family', 'os_family', 'device_family']
+    search_fields = ['string']
+    readonly_fields = ['hash', 'created_at']
+
+class AlbumDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ['date', 'album', 'media_file', 'views', 'media_views', 'unique_ips', 'uploads']
+    list_filter = ['date']
+    list_select_related = ['album', 'media_file']
+    date_hierarchy = 'date'
+
 admin.site.register(Album, AlbumAdmin)
 admin.site.register(MediaFile, MediaFileAdmin)
+admin.site.register(MediaJob, MediaJobAdmin)
 admin.site.register(ActivityLog, ActivityLogAdmin)
-admin.site.register(UserProfile)
\ No newline at end of file
+admin.site.register(UserProfile)
+admin.site.register(UserAgent, UserAgentAdmin)
+admin.site.register(AlbumDailyStats, AlbumDailyStatsAdmin)
\ No newline at end of file
@@ -0,0 +1,330 @@
+"""
+Query-count and latency benchmark of every URL in ``photogallery.urls``.
+
+``run_scale`` seeds an empty (throwaway) database with synthetic data at
+the requested scales, requests each scenario through the test client and
+records, per scenario: the query count on a cold cache and in steady
+state, the median wall time and the peak Python memory (``tracemalloc``)
+of one request.  ``find_regressions`` compares a run against a previous
+JSON report.  The ``benchmark_views`` management command ties it
+together.
+"""
+import io
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .cache import get_cache
+from .feed import refresh_ranking
+from .models import (
+    ActivityLog, Album, AlbumAccessGrant, ChunkedUpload, MediaFile, MediaRendition, UserAgent,
+)
+
+SCALES = {
+    'small': {'media': 10, 'albums': 5, 'sessions': 100, 'logs': 1_000},
+    'medium': {'media': 1_000, 'albums': 50, 'sessions': 10_000, 'logs': 100_000},
+    'large': {'media': 100_000, 'albums': 500, 'sessions': 100_000, 'logs': 1_000_000},
+}
+
+SEED_BATCH_SIZE = 5_000
+PASSWORD = 'benchmark-password'
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0'
+
+
+@dataclass
+class Scenario:
+    name: str
+    path: str
+    method: str = 'get'
+    client: str = 'owner'
+    # Словарь полей формы или готовое тело (вместе с content_type)
+    data: object = field(default_factory=dict)
+    content_type: str = None
+    headers: dict = field(default_factory=dict)
+    # Выполнить вход перед каждым запросом (для logout)
+    fresh_login: bool = False
+
+
+@dataclass
+class Result:
+    scale: str
+    name: str
+    method: str
+    path: str
+    status: int
+    queries_cold: int
+    queries: int
+    time_ms: float
+    peak_kb: float
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 120, 40)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def _batches(objects, model, **kwargs):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= SEED_BATCH_SIZE:
+            model.objects.bulk_create(batch, **kwargs)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch, **kwargs)
+
+
+def seed(scale):
+    """Fill the (empty) database; returns the objects the scenarios refer to."""
+    sizes = SCALES[scale]
+    owner = User.objects.create_user('bench-owner', password=PASSWORD, is_staff=True, is_superuser=True)
+    visitor = User.objects.create_user('bench-visitor', password=PASSWORD)
+
+    albums = [
+        Album(title=f'Album {i}', owner=owner, is_public=(i % 2 == 0),
+              view_password='secret' if i % 3 == 0 else None)
+        for i in range(sizes['albums'])
+    ]
+    Album.objects.bulk_create(albums)
+    main_album = Album.objects.create(title='Main album', owner=owner, is_public=True)
+    private_album = Album.objects.create(title='Private album', owner=owner, view_password='secret')
+
+    # Все записи ссылаются на один реальный файл — раздача тоже измеряется
+    file_name = default_storage.save('media/benchmark.jpg', ContentFile(_jpeg()))
+    now = timezone.now()
+    _batches(
+        (MediaFile(album=main_album, file=file_name, file_type='image', mime_type='image/jpeg',
+                   file_size=1024, width=64, height=48, taken_at=now - timedelta(minutes=i))
+         for i in range(sizes['media'])),
+        MediaFile,
+    )
+    media_file = MediaFile.objects.filter(album=main_album).first()
+    rendition = MediaRendition.objects.create(
+        media_file=media_file, width=64, height=48, format='jpeg', file=file_name,
+    )
+    upload = ChunkedUpload.objects.create(
+        album=main_album, owner=owner, filename='clip.mp4', file_name=default_storage.save(
+            'media/chunked/benchmark.part', ContentFile(b'')),
+        total_size=1024,
+    )
+
+    # Сессии посетителей; каждая десятая имеет доступ к закрытому альбому
+    expire = now + timedelta(days=14)
+    store = SessionStore()
+    keys = [uuid.uuid4().hex for _ in range(sizes['sessions'])]
+    _batches(
+        (Session(session_key=key,
+                 session_data=store.encode({f'album_view_{private_album.id}': True} if i % 10 == 0 else {}),
+                 expire_date=expire)
+         for i, key in enumerate(keys)),
+        Session,
+    )
+    _batches(
+        (AlbumAccessGrant(album=private_album, session_key=key) for key in keys[::10]),
+        AlbumAccessGrant,
+    )
+
+    user_agent = UserAgent.objects.create(hash=uuid.uuid4().hex, string=USER_AGENT, browser_family='Firefox')
+    actions = ['album_view', 'media_view', 'login', 'media_upload']
+    _batches(
+        (ActivityLog(user=owner if i % 2 else None, action=actions[i % 4], timestamp=now - timedelta(seconds=i),
+                     ip_address=f'10.0.{i // 256 % 256}.{i % 256}', user_agent=user_agent,
+                     album=main_album, media_file=media_file if i % 4 == 1 else None)
+         for i in range(sizes['logs'])),
+        ActivityLog,
+    )
+    refresh_ranking()
+    return {
+        'owner': owner,
+        'visitor': visitor,
+        'album': main_album,
+        'private_album': private_album,
+        'media_file': media_file,
+        'rendition': rendition,
+        'upload': upload,
+    }
+
+
+def build_scenarios(ctx):
+    album_id = ctx['album'].id
+    media_id = ctx['media_file'].id
+    media_args = [album_id, media_id]
+    upload_args = [album_id, ctx['upload'].id]
+    return [
+        Scenario('home', reverse('home')),
+        Scenario('album_list', reverse('album_list')),
+        Scenario('public_feed', reverse('public_feed'), client='anon'),
+        Scenario('public_feed_search', reverse('public_feed') + '?q=Album+1', client='anon'),
+        Scenario('create_album', reverse('create_album')),
+        Scenario('album_detail', reverse('album_detail', args=[album_id])),
+        Scenario('album_detail_taken', reverse('album_detail', args=[album_id]) + '?sort=taken'),
+        Scenario('album_detail_anon', reverse('album_detail', args=[album_id]), client='anon'),
+        Scenario('album_media_page', reverse('album_media_page', args=[album_id])),
+        Scenario('album_access', reverse('album_access', args=[ctx['private_album'].id]), client='anon'),
+        Scenario('album_access_post', reverse('album_access', args=[ctx['private_album'].id]),
+                 method='post', client='anon', data={'password': 'wrong'}),
+        Scenario('upload_media', reverse('upload_media', args=[album_id])),
+        Scenario('upload_media_batch', reverse('upload_media_batch', args=[album_id])),
+        Scenario('chunked_upload_start', reverse('chunked_upload_start', args=[album_id]), method='post',
+                 data=json.dumps({'filename': 'clip.mp4', 'size': 1024}), content_type='application/json'),
+        Scenario('chunked_upload_detail', reverse('chunked_upload_detail', args=upload_args)),
+        Scenario('chunked_upload_finalize', reverse('chunked_upload_finalize', args=upload_args), method='post'),
+        Scenario('edit_album', reverse('edit_album', args=[album_id])),
+        Scenario('edit_album_password', reverse('edit_album', args=[ctx['private_album'].id]), method='post',
+                 data={'title': 'Private album', 'description': '', 'view_password': 'changed'}),
+        Scenario('delete_album', reverse('delete_album', args=[album_id])),
+        Scenario('delete_media', reverse('delete_media', args=media_args)),
+        Scenario('view_media', reverse('view_media', args=media_args)),
+        Scenario('media_file_content', reverse('media_file_content', args=media_args)),
+        Scenario('media_file_range', reverse('media_file_content', args=media_args),
+                 headers={'Range': 'bytes=0-99'}),
+        Scenario('media_rendition_content',
+                 reverse('media_rendition_content', args=[*media_args, ctx['rendition'].id])),
+        Scenario('register', reverse('register'), client='anon'),
+        Scenario('login', reverse('login'), client='anon'),
+        Scenario('logout', reverse('logout'), fresh_login=True),
+        Scenario('admin_activitylog', reverse('admin:albums_activitylog_changelist')),
+        Scenario('admin_activitylog_search', reverse('admin:albums_activitylog_changelist') + '?q=firefox'),
+        Scenario('admin_activitylog_ip', reverse('admin:albums_activitylog_changelist') + '?q=10.0.0.1'),
+    ]
+
+
+def _client(kind, ctx):
+    client = Client(HTTP_USER_AGENT=USER_AGENT)
+    if kind != 'anon':
+        username = ctx[kind].username
+        client.post(reverse('login'), {'username': username, 'password': PASSWORD})
+    return client
+
+
+def _request(client, scenario):
+    kwargs = {'headers': scenario.headers}
+    if scenario.content_type:
+        kwargs['content_type'] = scenario.content_type
+    return getattr(client, scenario.method)(scenario.path, scenario.data, **kwargs)
+
+
+def _consume(response):
+    # Потоковые ответы (файлы) читаются целиком, иначе время не учитывает отдачу
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+        response.close()
+
+
+def _capture():
+    # Журнал запросов ограничен по длине: заполненный (после миграций) не растёт
+    reset_queries()
+    return CaptureQueriesContext(connection)
+
+
+def measure(scenario, ctx, scale, repeat=5):
+    clients = {}
+
+    def client_for(kind):
+        if scenario.fresh_login or kind not in clients:
+            clients[kind] = _client(kind, ctx)
+        return clients[kind]
+
+    get_cache().clear()
+    client = client_for(scenario.client)
+    with _capture() as captured:
+        response = _request(client, scenario)
+        _consume(response)
+    queries_cold = queries = len(captured)
+
+    timings = []
+    for _ in range(repeat):
+        client = client_for(scenario.client)
+        with _capture() as captured:
+            started = time.perf_counter()
+            response = _request(client, scenario)
+            _consume(response)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(captured)
+
+    client = client_for(scenario.client)
+    tracemalloc.start()
+    try:
+        _consume(_request(client, scenario))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(
+        scale=scale,
+        name=scenario.name,
+        method=scenario.method.upper(),
+        path=scenario.path,
+        status=response.status_code,
+        queries_cold=queries_cold,
+        queries=queries,
+        time_ms=round(statistics.median(timings), 3) if timings else 0.0,
+        peak_kb=round(peak / 1024, 1),
+    )
+
+
+def run_scale(scale, repeat=5, only=None, log=None):
+    """Seed the current (empty) database and measure every scenario."""
+    started = time.perf_counter()
+    ctx = seed(scale)
+    if log:
+        log(f'[{scale}] seeded in {time.perf_counter() - started:.1f}s')
+    results = []
+    for scenario in build_scenarios(ctx):
+        if only and scenario.name not in only:
+            continue
+        result = measure(scenario, ctx, scale, repeat=repeat)
+        if log:
+            log(f'[{scale}] {result.name}: {result.status} {result.queries} queries '
+                f'({result.queries_cold} cold), {result.time_ms} ms, {result.peak_kb} KiB')
+        results.append(result)
+    return results
+
+
+def report(results):
+    return {
+        'created_at': timezone.now().isoformat(),
+        'results': [asdict(result) for result in results],
+    }
+
+
+def find_regressions(current, baseline, max_query_increase=0, max_time_ratio=1.5, min_time_delta_ms=5.0):
+    """
+    Compare two reports (as returned by ``report``) and describe every
+    scenario whose query count or median time got worse than allowed.
+    Time only counts as a regression when it grows both by
+    ``max_time_ratio`` and by ``min_time_delta_ms``, to ignore noise on
+    very fast views.
+    """
+    previous = {(row['scale'], row['name']): row for row in baseline['results']}
+    regressions = []
+    for row in current['results']:
+        old = previous.get((row['scale'], row['name']))
+        if old is None:
+            continue
+        label = f"[{row['scale']}] {row['name']}"
+        for key in ('queries', 'queries_cold'):
+            if row[key] > old[key] + max_query_increase:
+                regressions.append(f'{label}: {key} {old[key]} -> {row[key]}')
+        if (row['time_ms'] > old['time_ms'] * max_time_ratio
+                and row['time_ms'] - old['time_ms'] > min_time_delta_ms):
+            regressions.append(f"{label}: time {old['time_ms']} ms -> {row['time_ms']} ms")
+    return regressions
@@ -0,0 +1,211 @@
+"""
+Content-addressed storage of uploaded media.
+
+The upload handlers below compute the SHA-256 of every file while Django
+streams it into memory or into a temporary file, so the hash is known
+without reading the upload again.  The bytes are stored once under
+``blobs/<aa>/<bb>/<sha256>`` and described by a ``Blob`` row; every
+MediaFile with the same contents points at that blob (``MediaFile.file``
+holds the blob path, so serving and renditions work unchanged).  Storing
+a file that is already there writes nothing.
+
+References are taken in the transaction that creates the MediaFile rows
+(bytes written in it are deleted again if it fails, ``removing_on_error``)
+and released when a MediaFile row is deleted (``signals``).  Soft-deleted
+files keep their reference until ``purge_deleted_media`` removes their
+rows; only then are blobs without references deleted from storage.
+"""
+import hashlib
+import os
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F, Q
+
+from .chunked import file_checksum
+from .models import Blob, MediaFile, MediaRendition
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class HashingUploadHandlerMixin:
+    """Hash the chunks this handler stores and put the hex digest on the file as ``sha256``."""
+
+    def new_file(self, *args, **kwargs):
+        # До super(): MemoryFileUploadHandler.new_file завершается StopFutureHandlers
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # Кусок принят этим обработчиком, следующим он не передаётся
+            self.sha256.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.sha256.hexdigest()
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def blob_name(digest):
+    return f'blobs/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def uploaded_digest(uploaded_file):
+    """SHA-256 of an upload; the file is read only if no hashing handler saw it."""
+    digest = getattr(uploaded_file, 'sha256', None)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for chunk in uploaded_file.chunks(HASH_BLOCK_SIZE):
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+    return digest
+
+
+def acquire_blobs(items):
+    """
+    Take one reference per ``(digest, size)`` item, creating missing Blob
+    rows, and return ``{digest: Blob}``.  Call it in the transaction that
+    creates the MediaFile rows.
+    """
+    counts = Counter(digest for digest, _ in items)
+    sizes = dict(items)
+    Blob.objects.bulk_create(
+        [Blob(hash=digest, size=sizes[digest], file=blob_name(digest)) for digest in counts],
+        ignore_conflicts=True,
+    )
+    # Обычно у всех хэшей одна ссылка — тогда это один UPDATE
+    by_count = defaultdict(list)
+    for digest, count in counts.items():
+        by_count[count].append(digest)
+    for count, digests in by_count.items():
+        Blob.objects.filter(hash__in=digests).update(ref_count=F('ref_count') + count)
+    return Blob.objects.in_bulk(list(counts), field_name='hash')
+
+
+def release_blob(blob_id):
+    Blob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+
+
+def write_blob(content, digest):
+    """Store ``content`` under its hash; returns the name if written, ``None`` if already stored."""
+    name = blob_name(digest)
+    if default_storage.exists(name):
+        return None
+    saved = default_storage.save(name, content)
+    if saved != name:
+        # То же содержимое параллельно сохранила другая загрузка
+        default_storage.delete(saved)
+        return None
+    return name
+
+
+@contextmanager
+def removing_on_error(names):
+    """
+    Delete the stored files listed in ``names`` (filled inside the block)
+    if the block raises.  Enter it before ``transaction.atomic()`` so a
+    failed commit is covered too.
+    """
+    try:
+        yield names
+    except BaseException:
+        for name in names:
+            default_storage.delete(name)
+        raise
+
+
+def adopt_file(file_name, digest):
+    """Move an already stored file (an assembled chunked upload) into its blob."""
+    name = blob_name(digest)
+    if default_storage.exists(name):
+        default_storage.delete(file_name)
+    else:
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(default_storage.path(file_name), path)
+    return name
+
+
+def attach_blob(media_file, uploaded_file):
+    """
+    Point ``media_file`` at the blob with the contents of ``uploaded_file``,
+    storing the bytes if they are new.  Returns the name written, if any,
+    for ``removing_on_error``.
+    """
+    digest = uploaded_digest(uploaded_file)
+    blob = acquire_blobs([(digest, uploaded_file.size)])[digest]
+    written = write_blob(uploaded_file, digest)
+    media_file.blob = blob
+    media_file.file = blob.file.name
+    media_file.original_name = os.path.basename(uploaded_file.name)
+    return written
+
+
+def move_to_blob(media_file):
+    """Move a file stored before blobs existed into the blob of its contents."""
+    digest = file_checksum(media_file.file.name)
+    with transaction.atomic():
+        blob = acquire_blobs([(digest, default_storage.size(media_file.file.name))])[digest]
+        MediaFile.objects.filter(pk=media_file.pk).update(
+            blob=blob,
+            file=blob.file.name,
+            original_name=media_file.original_name or os.path.basename(media_file.file.name),
+        )
+        adopt_file(media_file.file.name, digest)
+    return blob
+
+
+def purge_deleted_media(before, batch_size=500):
+    """
+    Delete the rows (and renditions) of media deleted, or in albums deleted,
+    before ``before``; returns the number of files purged.
+    """
+    stale = MediaFile.objects.filter(
+        Q(is_deleted=True, deleted_at__lt=before) | Q(album__is_deleted=True, album__deleted_at__lt=before)
+    )
+    purged = 0
+    while True:
+        batch = list(stale.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return purged
+        names = list(MediaRendition.objects.filter(media_file__in=batch).values_list('file', flat=True))
+        # Файлы, загруженные до появления Blob, принадлежат только своей записи
+        names += MediaFile.objects.filter(pk__in=batch, blob__isnull=True).values_list('file', flat=True)
+        with transaction.atomic():
+            MediaFile.objects.filter(pk__in=batch).delete()
+        for name in names:
+            if name:
+                default_storage.delete(name)
+        purged += len(batch)
+
+
+def delete_unreferenced_blobs():
+    """Delete blobs no MediaFile points at; returns ``(blobs, bytes)`` freed."""
+    deleted = freed = 0
+    for blob in Blob.objects.filter(ref_count=0).iterator():
+        with transaction.atomic():
+            # Ссылку могли взять после выборки — проверяем ещё раз при удалении
+            removed, _ = Blob.objects.filter(pk=blob.pk, ref_count=0, media_files__isnull=True).delete()
+            if not removed:
+                continue
+            # Байты удаляются до фиксации: загрузка того же содержимого ждёт
+            # освобождения хэша и затем записывает файл заново
+            default_storage.delete(blob.file.name)
+        deleted += 1
+        freed += blob.size
+    return deleted, freed
@@ -0,0 +1,90 @@
+"""
+Versioned cache of rendered album media grids.
+
+Every album has a version number in the cache; fragment keys include it,
+so bumping the version (on any change to the album, its media or their
+renditions) makes all cached pages of that album unreachable at once.
+Only visitor-independent markup is cached: owner controls are not part
+of the fragment and are added per request from the cached media ids.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_cache():
+    return caches[getattr(settings, 'ALBUMS_CACHE_ALIAS', 'default')]
+
+
+def _version_key(album_id):
+    return f'albums:version:{album_id}'
+
+
+def new_version():
+    # Версия от времени: после вытеснения ключа новая версия не совпадёт со старыми
+    return int(time.time() * 1000)
+
+
+def get_album_version(album_id):
+    cache = get_cache()
+    key = _version_key(album_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_album_version(album_id):
+    cache = get_cache()
+    key = _version_key(album_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, new_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_album_version(album_id):
+    cache = get_cache()
+    key = _version_key(album_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = new_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def grid_cache_key(album_id, version, sort, cursor):
+    cursor_hash = hashlib.md5((cursor or '').encode()).hexdigest()
+    return f'albums:media-grid:{album_id}:{version}:{sort}:{cursor_hash}'
+
+
+def get_or_render_grid(album_id, sort, cursor, render):
+    """
+    Return the cached ``{'html', 'next_cursor', 'count', 'media_ids'}`` for a
+    grid page, calling ``render()`` to build it on a miss. ``media_ids`` lists
+    the page's media in display order, so owner controls can be built for
+    them without caching anything visitor-specific.
+    """
+    cache = get_cache()
+    key = grid_cache_key(album_id, get_album_version(album_id), sort, cursor)
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = render()
+        cache.set(key, fragment, timeout=getattr(settings, 'ALBUMS_GRID_CACHE_TIMEOUT', 3600))
+    return fragment
+
+
+async def aget_or_render_grid(album_id, sort, cursor, render):
+    """Async ``get_or_render_grid``; ``render`` is a coroutine function."""
+    cache = get_cache()
+    key = grid_cache_key(album_id, await aget_album_version(album_id), sort, cursor)
+    fragment = await cache.aget(key)
+    if fragment is None:
+        fragment = await render()
+        await cache.aset(key, fragment, timeout=getattr(settings, 'ALBUMS_GRID_CACHE_TIMEOUT', 3600))
+    return fragment
@@ -0,0 +1,128 @@
+"""
+Resumable chunked uploads.
+
+The client creates a ``ChunkedUpload``, then sends the file in ordered
+chunks, each tagged with its byte offset.  Chunks are streamed from the
+request straight into a file in ``default_storage``, so memory use does
+not depend on the file size.  If the connection drops, the client asks
+for the current offset and continues from there.  On finalize the file
+is hashed once and moved into its blob (``albums.blobs``).
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import ChunkedUpload
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ChunkError(Exception):
+    """Chunk cannot be applied; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def get_max_chunk_size():
+    return getattr(settings, 'CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 16 * 1024 * 1024)
+
+
+def start_upload(album, owner, filename, total_size, checksum='', description=''):
+    """Reserve the final file name and create the upload record."""
+    filename = os.path.basename(filename)
+    # Пустой файл занимает имя, чтобы get_available_name не выдал его повторно
+    file_name = default_storage.save(f'media/{filename}', ContentFile(b''))
+    return ChunkedUpload.objects.create(
+        album=album,
+        owner=owner,
+        filename=filename,
+        description=description,
+        file_name=file_name,
+        total_size=total_size,
+        checksum=checksum.lower(),
+    )
+
+
+def append_chunk(upload, offset, stream, length):
+    """
+    Write ``length`` bytes from ``stream`` at ``offset`` and return the new offset.
+
+    The offset must match what the server already has; otherwise the
+    client is told the current offset and must resume from there.
+    """
+    if upload.status != 'uploading':
+        raise ChunkError('Upload is not in progress', status=409)
+    if offset != upload.offset:
+        raise ChunkError(f'Expected offset {upload.offset}', status=409)
+    if length <= 0 or length > get_max_chunk_size():
+        raise ChunkError('Invalid chunk size')
+    if offset + length > upload.total_size:
+        raise ChunkError('Chunk exceeds declared file size')
+
+    written = 0
+    with open(default_storage.path(upload.file_name), 'r+b') as destination:
+        destination.seek(offset)
+        while written < length:
+            block = stream.read(min(READ_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            destination.write(block)
+            written += len(block)
+        # Обрезаем хвост прерванной ранее попытки записи этого же чанка
+        destination.truncate(offset + written)
+
+    # Условное обновление: параллельный запрос с тем же смещением проиграет
+    updated = ChunkedUpload.objects.filter(id=upload.id, offset=offset).update(offset=offset + written)
+    if not updated:
+        raise ChunkError('Concurrent chunk for the same offset', status=409)
+    upload.offset = offset + written
+    if written < length:
+        raise ChunkError(f'Chunk truncated after {written} bytes')
+    return upload.offset
+
+
+def file_checksum(file_name):
+    """SHA-256 of a stored file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with default_storage.open(file_name, 'rb') as stored:
+        for block in iter(lambda: stored.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify_upload(upload, checksum=''):
+    """
+    Check that the upload is complete and matches the expected checksum;
+    returns the SHA-256 of the assembled file.
+    """
+    if upload.offset != upload.total_size:
+        raise ChunkError(f'Upload incomplete: {upload.offset} of {upload.total_size} bytes', status=409)
+    # Хэш нужен и без контрольной суммы клиента — по нему файл попадает в Blob
+    digest = file_checksum(upload.file_name)
+    expected = (checksum or upload.checksum).lower()
+    if expected and digest != expected:
+        upload.status = 'failed'
+        upload.save(update_fields=['status', 'updated_at'])
+        default_storage.delete(upload.file_name)
+        raise ChunkError('Checksum mismatch')
+    return digest
+
+
+def release_upload(upload):
+    """Return an upload claimed for finalizing to ``uploading``, so finalize can be retried."""
+    ChunkedUpload.objects.filter(id=upload.id, status='finalizing').update(
+        status='uploading', updated_at=timezone.now(),
+    )
+    upload.status = 'uploading'
+
+
+def discard_upload(upload):
+    default_storage.delete(upload.file_name)
+    upload.status = 'failed'
+    upload.save(update_fields=['status', 'updated_at'])
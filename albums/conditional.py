@@ -0,0 +1,111 @@
+"""
+Validators (ETag / Last-Modified) for album pages.
+
+Each validator is computed from one aggregate query plus the cached
+album version, so a revalidation request never renders a template.  The
+viewer and the full request path are part of the ETag because pages
+differ per user (owner controls, navigation) and per cursor/sort.
+View counters change on every visit and are not part of the validators;
+pages refresh them from ``album_stats``.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+from .cache import aget_album_version, get_album_version
+from .models import MediaFile
+
+
+def _make_etag(request, *parts):
+    viewer = request.user.pk if request.user.is_authenticated else 'anon'
+    raw = '|'.join(str(part) for part in (viewer, request.get_full_path(), *parts))
+    return quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+
+
+def _latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+ALBUM_AGGREGATES = {
+    'last_upload': Max('uploaded_at'),
+    'last_delete': Max('deleted_at'),
+    'media_count': Count('id'),
+}
+
+ALBUM_LIST_AGGREGATES = {
+    'last_update': Max('updated_at'),
+    'album_count': Count('id', distinct=True),
+    'last_upload': Max('media_files__uploaded_at'),
+    'last_delete': Max('media_files__deleted_at'),
+    'media_count': Count('media_files', distinct=True),
+}
+
+
+def _album_validators(request, album, stats, version):
+    last_modified = _latest(album.updated_at, stats['last_upload'], stats['last_delete'])
+    etag = _make_etag(
+        request,
+        album.id,
+        version,
+        last_modified.isoformat() if last_modified else '',
+        stats['media_count'],
+    )
+    return etag, last_modified
+
+
+def album_validators(request, album):
+    """Return ``(etag, last_modified)`` for an album page."""
+    stats = MediaFile.objects.filter(album=album).aggregate(**ALBUM_AGGREGATES)
+    return _album_validators(request, album, stats, get_album_version(album.id))
+
+
+async def aalbum_validators(request, album):
+    stats = await MediaFile.objects.filter(album=album).aaggregate(**ALBUM_AGGREGATES)
+    return _album_validators(request, album, stats, await aget_album_version(album.id))
+
+
+def _album_list_validators(request, stats):
+    last_modified = _latest(stats['last_update'], stats['last_upload'], stats['last_delete'])
+    etag = _make_etag(
+        request,
+        last_modified.isoformat() if last_modified else '',
+        stats['album_count'],
+        stats['media_count'],
+    )
+    return etag, last_modified
+
+
+def album_list_validators(request, albums):
+    """Return ``(etag, last_modified)`` for a list of albums (a queryset)."""
+    return _album_list_validators(request, albums.aggregate(**ALBUM_LIST_AGGREGATES))
+
+
+async def aalbum_list_validators(request, albums):
+    return _album_list_validators(request, await albums.aaggregate(**ALBUM_LIST_AGGREGATES))
+
+
+def not_modified_response(request, etag, last_modified):
+    """Return a 304/412 response if the client's copy is still valid, else ``None``."""
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def set_validators(response, etag, last_modified, public=False):
+    """
+    Attach validators and require revalidation on every use, so each view
+    still reaches the server (and the activity log) even when cached.
+    """
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if public:
+        patch_cache_control(response, public=True, no_cache=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
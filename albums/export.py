@@ -0,0 +1,127 @@
+"""
+Streaming export of ActivityLog rows as CSV or JSON lines.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` and
+encoded one at a time, so memory use does not depend on the size of the
+range.  Optional gzip compression happens on the fly with a single
+``zlib`` stream.  JSON lines use the archive serialization from
+``albums.retention``, so an export can also be loaded back with
+``import_activity_archive``.
+"""
+import csv
+import zlib
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ActivityLog
+from .retention import ARCHIVE_EXTRA, ARCHIVE_FIELDS, serialize_entry
+
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'jsonl': ('application/x-ndjson', '.jsonl'),
+}
+
+# Поля для аналитики сверх колонок таблицы: имя пользователя и разбор UA
+EXPORT_EXTRA = {
+    **ARCHIVE_EXTRA,
+    'username': F('user__username'),
+    'browser_family': F('user_agent__browser_family'),
+    'os_family': F('user_agent__os_family'),
+    'device_family': F('user_agent__device_family'),
+}
+EXPORT_COLUMNS = [*ARCHIVE_FIELDS, *EXPORT_EXTRA]
+
+GZIP_FLUSH_SIZE = 64 * 1024
+
+
+def get_chunk_size():
+    return getattr(settings, 'ACTIVITY_LOG_EXPORT_CHUNK_SIZE', 2000)
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a ``--since``/``--until`` value: a date (the whole day is
+    included for ``end``) or an ISO datetime.  Returns an aware datetime.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value!r}')
+        moment = datetime.combine(day, time.max if end else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_logs(queryset=None, actions=None, since=None, until=None, album=None):
+    queryset = ActivityLog.objects.all() if queryset is None else queryset
+    if actions:
+        queryset = queryset.filter(action__in=actions)
+    if since:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until:
+        queryset = queryset.filter(timestamp__lte=until)
+    if album:
+        queryset = queryset.filter(album_id=album)
+    return queryset
+
+
+def iter_rows(queryset, chunk_size=None):
+    """Yield tuples in ``EXPORT_COLUMNS`` order, oldest first."""
+    rows = queryset.order_by('timestamp', 'id').values_list(*ARCHIVE_FIELDS, *EXPORT_EXTRA.values())
+    return rows.iterator(chunk_size=chunk_size or get_chunk_size())
+
+
+class _Echo:
+    """File-like object for ``csv.writer`` that returns what it is given."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS).encode()
+    for row in rows:
+        yield writer.writerow(row).encode()
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield (serialize_entry(dict(zip(EXPORT_COLUMNS, row))) + '\n').encode()
+
+
+def gzip_stream(chunks):
+    """Compress an iterable of bytes into a gzip stream without buffering it all."""
+    compressor = zlib.compressobj(wbits=31)
+    pending = []
+    size = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            pending.append(data)
+            size += len(data)
+        if size >= GZIP_FLUSH_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+def export_stream(queryset, fmt='csv', compress=False, chunk_size=None):
+    """Iterable of bytes with the exported rows of ``queryset``."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format: {fmt!r}')
+    rows = iter_rows(queryset, chunk_size)
+    chunks = iter_csv(rows) if fmt == 'csv' else iter_jsonl(rows)
+    return gzip_stream(chunks) if compress else chunks
+
+
+def export_filename(fmt, compress=False):
+    suffix = FORMATS[fmt][1] + ('.gz' if compress else '')
+    return f'activity-{timezone.localtime():%Y%m%d-%H%M%S}{suffix}'
@@ -0,0 +1,142 @@
+"""
+Discovery feed of public albums, ranked by recent activity.
+
+The ranking is not computed per request.  ``refresh_ranking`` (run
+periodically by the ``refresh_album_feed`` command) reads the album
+rows of the ``AlbumDailyStats`` rollup for the last
+``FEED_RANKING_DAYS`` days, weighs every day's views with an exponential
+decay of half-life ``FEED_RANKING_HALF_LIFE_DAYS`` and stores the order
+in ``AlbumRanking``.  Albums without views follow, newest first.
+
+A feed page is one keyset query over ``AlbumRanking.rank`` and is cached
+for ``FEED_CACHE_TIMEOUT`` seconds under the feed version, which every
+refresh and every change of an album bumps.  Visibility is checked again
+at read time, so an album made private leaves the feed immediately.
+"""
+import hashlib
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import get_cache, new_version
+from .listing import annotate_album_cards, get_cover_url
+from .models import Album, AlbumDailyStats, AlbumRanking
+from .pagination import apaginate_ranked
+
+VERSION_KEY = 'albums:feed-version'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def public_albums():
+    """Albums anyone may open: public, not deleted and without a password."""
+    return Album.objects.filter(is_public=True, is_deleted=False).filter(
+        Q(view_password__isnull=True) | Q(view_password='')
+    )
+
+
+def compute_scores(today=None):
+    """Return ``{album_id: (score, recent_views)}`` for public albums with views."""
+    today = today or timezone.localdate()
+    days = _setting('FEED_RANKING_DAYS', 14)
+    half_life = _setting('FEED_RANKING_HALF_LIFE_DAYS', 3)
+    rows = AlbumDailyStats.objects.filter(
+        media_file__isnull=True,
+        date__gt=today - timedelta(days=days),
+        album__in=public_albums(),
+    ).values_list('album_id', 'date', 'views', 'media_views')
+
+    scores, views = Counter(), Counter()
+    for album_id, day, album_views, media_views in rows.iterator():
+        hits = album_views + media_views
+        scores[album_id] += hits * 0.5 ** ((today - day).days / half_life)
+        views[album_id] += hits
+    return {album_id: (scores[album_id], views[album_id]) for album_id in scores}
+
+
+def refresh_ranking(today=None, batch_size=1000):
+    """Rebuild ``AlbumRanking`` for all public albums; returns the number of rows."""
+    scores = compute_scores(today)
+    album_ids = list(public_albums().order_by('-created_at', '-id').values_list('id', flat=True))
+    # Сортировка устойчивая: при равном счёте остаётся порядок «новые первыми»
+    album_ids.sort(key=lambda album_id: -scores.get(album_id, (0, 0))[0])
+
+    now = timezone.now()
+    with transaction.atomic():
+        AlbumRanking.objects.all().delete()
+        AlbumRanking.objects.bulk_create(
+            [
+                AlbumRanking(
+                    album_id=album_id, rank=rank, computed_at=now,
+                    score=scores.get(album_id, (0, 0))[0],
+                    recent_views=scores.get(album_id, (0, 0))[1],
+                )
+                for rank, album_id in enumerate(album_ids, start=1)
+            ],
+            batch_size=batch_size,
+        )
+    bump_feed_version()
+    return len(album_ids)
+
+
+def bump_feed_version():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, new_version(), timeout=None)
+
+
+async def aget_feed_version():
+    cache = get_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, new_version(), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def _page_key(version, query, cursor):
+    digest = hashlib.md5(f'{query}\0{cursor or ""}'.encode()).hexdigest()
+    return f'albums:feed:{version}:{digest}'
+
+
+def _feed_queryset(query):
+    albums = public_albums().filter(ranking__isnull=False)
+    if query:
+        albums = albums.filter(Q(title__icontains=query) | Q(description__icontains=query))
+    return annotate_album_cards(albums.select_related('owner', 'ranking'))
+
+
+def _card(album):
+    return {
+        'id': album.id,
+        'title': album.title,
+        'description': album.description,
+        'owner': album.owner.username,
+        'cover_url': get_cover_url(album),
+        'media_count': album.media_count,
+        'last_upload': album.last_upload,
+        'recent_views': album.ranking.recent_views,
+    }
+
+
+async def aget_feed_page(query='', cursor=None):
+    """
+    Return ``{'albums': [card dicts], 'next_cursor': ...}`` for a feed page,
+    from the cache when possible.  Raises ``ValueError`` for a bad cursor.
+    """
+    cache = get_cache()
+    key = _page_key(await aget_feed_version(), query, cursor)
+    page = await cache.aget(key)
+    if page is None:
+        albums, next_cursor = await apaginate_ranked(_feed_queryset(query), cursor=cursor)
+        page = {'albums': [_card(album) for album in albums], 'next_cursor': next_cursor}
+        await cache.aset(key, page, timeout=_setting('FEED_CACHE_TIMEOUT', 60))
+    return page
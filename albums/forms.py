@@ -1,5 +1,7 @@
 from django import forms
+from django.conf import settings
 from .models import Album, MediaFile
+from .probe import probe_file
 
 
 class AlbumForm(forms.ModelForm):
@@ -32,7 +34,23 @@ class AlbumForm(forms.ModelForm):
             self.fields['view_password'].help_text = 'Пароль недоступен для публичных альбомов'
 
 
+def probe_upload(uploaded_file):
+    """Sniff an upload; raise ValidationError if it is not a supported image/video."""
+    result = probe_file(uploaded_file)
+    if not result['file_type']:
+        raise forms.ValidationError(
+            'Файл %(name)s не является поддерживаемым изображением или видео',
+            params={'name': uploaded_file.name},
+        )
+    return result
+
+
 class MediaUploadForm(forms.ModelForm):
+    def clean_file(self):
+        uploaded_file = self.cleaned_data['file']
+        self.probe = probe_upload(uploaded_file)
+        return uploaded_file
+
     class Meta:
         model = MediaFile
         fields = ['file', 'description']
@@ -46,6 +64,47 @@ class MediaUploadForm(forms.ModelForm):
         }
 
 
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput(attrs={'class': 'form-control'}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(item, initial) for item in data]
+        return [single_file_clean(data, initial)]
+
+
+class MediaBatchUploadForm(forms.Form):
+    files = MultipleFileField(label='Файлы')
+    description = forms.CharField(
+        widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 2}),
+        required=False,
+        label='Описание (для всех файлов)'
+    )
+
+    def clean_files(self):
+        files = self.cleaned_data['files']
+        limit = getattr(settings, 'BATCH_UPLOAD_MAX_FILES', 100)
+        if len(files) > limit:
+            raise forms.ValidationError(f'Можно загрузить не более {limit} файлов за раз')
+
+        self.probes, errors = [], []
+        for uploaded_file in files:
+            try:
+                self.probes.append(probe_upload(uploaded_file))
+            except forms.ValidationError as error:
+                errors.append(error)
+        if errors:
+            raise forms.ValidationError(errors)
+        return files
+
+
 class AlbumAccessForm(forms.Form):
     password = forms.CharField(
         widget=forms.PasswordInput(attrs={'class': 'form-control'}),
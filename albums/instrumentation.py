@@ -0,0 +1,309 @@
+"""
+Per-request performance metrics.
+
+``ActivityLoggingMiddleware`` opens a ``RequestMetrics`` for every request
+(kept in a context variable, so it follows the request into threads
+started with ``contextvars``-aware helpers).  Three sources add to it:
+
+* database time and query count — a wrapper installed with the
+  ``execute_wrapper`` mechanism on every connection;
+* template render time — ``InstrumentedTemplates``, a drop-in
+  replacement for the ``DjangoTemplates`` backend;
+* activity logging time — ``log_activity`` runs under ``timed('log')``
+  (it includes the queries of the synchronous sink, which are counted
+  as database time as well).
+
+Finished requests go into in-memory histograms keyed by URL name.  Every
+process publishes its histograms to the albums cache now and then, so
+``request_metrics`` and the staff JSON endpoint can merge the numbers of
+all workers when the cache is shared.
+"""
+import copy
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+from .cache import get_cache
+
+# Верхние границы корзин гистограмм, мс; последняя корзина — всё, что больше
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+TIMINGS = ('total', 'db', 'template', 'log')
+
+INDEX_KEY = 'albums:metrics:index'
+SNAPSHOT_KEY = 'albums:metrics:{}'
+
+_current = ContextVar('albums_request_metrics', default=None)
+
+
+def metrics_enabled():
+    return getattr(settings, 'REQUEST_METRICS_ENABLED', True)
+
+
+class RequestMetrics:
+    """Timings (seconds) and counters of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = dict.fromkeys(TIMINGS[1:], 0.0)
+        self.queries = 0
+        self._active = set()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_metrics():
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    """Collect metrics of everything run inside the block."""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to timing ``name`` of the current
+    request.  Nested blocks of the same name count once.  Works as a
+    decorator too.
+    """
+    metrics = _current.get()
+    if metrics is None or name in metrics._active:
+        yield
+        return
+    metrics._active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] = metrics.timings.get(name, 0.0) + time.perf_counter() - started
+        metrics._active.discard(name)
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    metrics.queries += 1
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+def install_db_wrapper(connection):
+    # Обёртка постоянная: вне запроса она сразу передаёт вызов дальше
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+def install_db_wrappers():
+    for connection in connections.all():
+        install_db_wrapper(connection)
+
+
+@receiver(connection_created)
+def _install_on_connect(sender, connection, **kwargs):
+    install_db_wrapper(connection)
+
+
+class _TimedTemplate:
+    """Backend template whose ``render`` counts as template time."""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return self._template.render(context, request)
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """``DjangoTemplates`` that reports render time to the request metrics."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+def server_timing(metrics):
+    """Value of the ``Server-Timing`` header for ``metrics``."""
+    parts = [f'{name};dur={metrics.timings[name] * 1000:.1f}' for name in TIMINGS[1:]]
+    parts[0] += f';desc="{metrics.queries} queries"'
+    parts.append(f'total;dur={metrics.elapsed() * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def _new_histogram():
+    return {'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(BUCKETS_MS) + 1)}
+
+
+def _new_view_stats():
+    return {
+        'count': 0,
+        'errors': 0,
+        **{name: _new_histogram() for name in TIMINGS},
+        'queries': {'sum': 0, 'max': 0},
+        'bytes': {'sum': 0, 'max': 0},
+    }
+
+
+def _bucket(value_ms):
+    for index, bound in enumerate(BUCKETS_MS):
+        if value_ms <= bound:
+            return index
+    return len(BUCKETS_MS)
+
+
+class MetricsRegistry:
+    """Histograms of finished requests per URL name, for one process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.views = {}
+        self.published_at = 0.0
+        self.key = SNAPSHOT_KEY.format(f'{socket.gethostname()}:{os.getpid()}')
+
+    def record(self, view_name, total, timings, queries, size, status):
+        with self.lock:
+            stats = self.views.get(view_name)
+            if stats is None:
+                stats = self.views[view_name] = _new_view_stats()
+            stats['count'] += 1
+            if status >= 500:
+                stats['errors'] += 1
+            for name, seconds in (('total', total), *timings.items()):
+                value_ms = seconds * 1000
+                histogram = stats[name]
+                histogram['sum'] += value_ms
+                histogram['max'] = max(histogram['max'], value_ms)
+                histogram['buckets'][_bucket(value_ms)] += 1
+            for name, value in (('queries', queries), ('bytes', size)):
+                stats[name]['sum'] += value
+                stats[name]['max'] = max(stats[name]['max'], value)
+
+    def snapshot(self):
+        with self.lock:
+            views = copy.deepcopy(self.views)
+        return {
+            'process': self.key,
+            'started_at': self.started_at,
+            'updated_at': time.time(),
+            'buckets_ms': list(BUCKETS_MS),
+            'views': views,
+        }
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.started_at = time.time()
+
+    def maybe_publish(self):
+        interval = getattr(settings, 'REQUEST_METRICS_PUBLISH_INTERVAL', 30)
+        now = time.monotonic()
+        if now - self.published_at < interval:
+            return
+        self.published_at = now
+        self.publish()
+
+    def publish(self):
+        """Store this process's snapshot in the cache and list it in the index."""
+        timeout = getattr(settings, 'REQUEST_METRICS_TTL', 3600)
+        cache = get_cache()
+        cache.set(self.key, self.snapshot(), timeout)
+        # Индекс обновляется без блокировки: потерянный ключ вернётся при следующей публикации
+        keys = set(cache.get(INDEX_KEY) or ())
+        if self.key not in keys:
+            keys.add(self.key)
+            cache.set(INDEX_KEY, sorted(keys), timeout)
+
+
+registry = MetricsRegistry()
+
+
+def _merge_histogram(target, source):
+    target['sum'] += source['sum']
+    target['max'] = max(target['max'], source['max'])
+    if 'buckets' in target:
+        target['buckets'] = [a + b for a, b in zip(target['buckets'], source['buckets'])]
+
+
+def merge_snapshots(snapshots):
+    """Add up the per-view statistics of several process snapshots."""
+    views = {}
+    for snapshot in snapshots:
+        for name, stats in snapshot['views'].items():
+            merged = views.setdefault(name, _new_view_stats())
+            merged['count'] += stats['count']
+            merged['errors'] += stats['errors']
+            for key in (*TIMINGS, 'queries', 'bytes'):
+                _merge_histogram(merged[key], stats[key])
+    return {
+        'processes': [snapshot['process'] for snapshot in snapshots],
+        'buckets_ms': list(BUCKETS_MS),
+        'views': views,
+    }
+
+
+def collect_snapshots(include_current=True):
+    """Published snapshots of all processes (this one taken live)."""
+    cache = get_cache()
+    keys = [key for key in cache.get(INDEX_KEY) or () if not (include_current and key == registry.key)]
+    snapshots = [snapshot for snapshot in cache.get_many(keys).values()]
+    if include_current:
+        snapshots.append(registry.snapshot())
+    return snapshots
+
+
+def percentile(histogram, fraction):
+    """Upper bound (ms) of the bucket holding the given fraction of requests."""
+    total = sum(histogram['buckets'])
+    if not total:
+        return 0.0
+    seen = 0
+    for index, count in enumerate(histogram['buckets']):
+        seen += count
+        if seen >= total * fraction:
+            return float(BUCKETS_MS[index]) if index < len(BUCKETS_MS) else histogram['max']
+    return histogram['max']
+
+
+def summarize(merged):
+    """One row per view, the views that took the most time in total first."""
+    rows = []
+    for name, stats in merged['views'].items():
+        count = stats['count'] or 1
+        rows.append({
+            'view': name,
+            'count': stats['count'],
+            'errors': stats['errors'],
+            **{f'{timing}_avg_ms': round(stats[timing]['sum'] / count, 2) for timing in TIMINGS},
+            'total_p50_ms': percentile(stats['total'], 0.5),
+            'total_p95_ms': percentile(stats['total'], 0.95),
+            'total_max_ms': round(stats['total']['max'], 2),
+            'queries_avg': round(stats['queries']['sum'] / count, 2),
+            'queries_max': stats['queries']['max'],
+            'bytes_avg': round(stats['bytes']['sum'] / count),
+        })
+    rows.sort(key=lambda row: row['total_avg_ms'] * row['count'], reverse=True)
+    return rows
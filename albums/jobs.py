@@ -0,0 +1,221 @@
+"""
+Database-backed queue of media-processing jobs.
+
+Views enqueue ``MediaJob`` rows; the ``run_media_worker`` management
+command claims due jobs and executes their handlers in a process pool.
+Only the database and local disk are needed, so this works on a single
+box with SQLite.  Handlers must be idempotent: a job may run more than
+once after a crash or a retry.  A handler that cannot succeed on a
+retry (the file is not an image Pillow can decode) fails the job at once.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .models import MediaFile, MediaJob
+from .probe import apply_probe, pillow_can_decode, probe_file
+from .thumbnails import generate_renditions
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when running the job again cannot help."""
+
+
+# Повтор не поможет: содержимое файла не изменится
+PERMANENT_ERRORS = (PermanentJobError, UnidentifiedImageError, Image.DecompressionBombError)
+
+
+def register(kind):
+    """Register ``func(media_file)`` as the handler for jobs of ``kind``."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+@register('renditions')
+def make_renditions(media_file):
+    generate_renditions(media_file)
+
+
+@register('metadata')
+def extract_metadata(media_file):
+    """Re-read type and header metadata of an already stored file."""
+    with media_file.file.open('rb') as stored:
+        result = probe_file(stored)
+    if not result['file_type']:
+        # Неизвестная сигнатура — оставляем тип, определённый ранее
+        result['file_type'] = media_file.file_type
+    apply_probe(media_file, result)
+    media_file.save(update_fields=[
+        'file_type', 'mime_type', 'file_size', 'width', 'height', 'duration', 'taken_at',
+    ])
+    if 'renditions' in jobs_for(media_file) and not media_file.renditions.exists():
+        enqueue(media_file, 'renditions')
+
+
+def jobs_for(media_file):
+    """Job kinds a freshly uploaded file needs."""
+    kinds = []
+    # HEIC и т.п. без плагина Pillow не открыть: копии не создаются, оригинал отдаётся как есть
+    if media_file.file_type == 'image' and (not media_file.mime_type or pillow_can_decode(media_file.mime_type)):
+        kinds.append('renditions')
+    return kinds
+
+
+def enqueue(media_file, kind):
+    """Create a pending job unless one of the same kind is already active."""
+    try:
+        with transaction.atomic():
+            job = MediaJob.objects.create(
+                media_file=media_file,
+                kind=kind,
+                max_attempts=getattr(settings, 'MEDIA_JOB_MAX_ATTEMPTS', 5),
+            )
+    except IntegrityError:
+        return None
+    MediaFile.objects.filter(id=media_file.id).update(processing_status='pending')
+    return job
+
+
+def enqueue_media_processing(media_file):
+    """Enqueue every job the file needs and return the created jobs."""
+    return [job for job in (enqueue(media_file, kind) for kind in jobs_for(media_file)) if job]
+
+
+def enqueue_bulk(media_files):
+    """
+    Enqueue processing for many freshly created files with one INSERT.
+
+    The files' ``processing_status`` should already be set with
+    ``initial_processing_status`` before they were saved.
+    """
+    jobs = [
+        MediaJob(media_file=media_file, kind=kind, max_attempts=getattr(settings, 'MEDIA_JOB_MAX_ATTEMPTS', 5))
+        for media_file in media_files
+        for kind in jobs_for(media_file)
+    ]
+    return MediaJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def initial_processing_status(media_file):
+    return 'pending' if jobs_for(media_file) else 'ready'
+
+
+def release_stale_jobs():
+    """Return jobs left ``running`` by a crashed worker to the queue."""
+    timeout = getattr(settings, 'MEDIA_JOB_STALE_TIMEOUT', 600)
+    return MediaJob.objects.filter(
+        status='running',
+        locked_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status='pending', locked_at=None)
+
+
+def claim_jobs(limit):
+    """
+    Atomically move up to ``limit`` due jobs to ``running``.
+
+    Each job is claimed with a conditional UPDATE, so several workers can
+    poll the same table without taking the same job twice.
+    """
+    now = timezone.now()
+    candidates = MediaJob.objects.filter(
+        status='pending', run_after__lte=now,
+    ).order_by('run_after').values_list('id', flat=True)[:limit]
+
+    claimed = []
+    for job_id in candidates:
+        updated = MediaJob.objects.filter(id=job_id, status='pending').update(
+            status='running', locked_at=now, attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(job_id)
+    if claimed:
+        MediaFile.objects.filter(jobs__id__in=claimed).update(processing_status='processing')
+    return claimed
+
+
+def run_job(job_id):
+    """
+    Execute a claimed job; runs inside a worker process.
+
+    Returns ``None`` on success or ``(traceback, permanent)`` on failure.
+    """
+    try:
+        job = MediaJob.objects.select_related('media_file').get(id=job_id)
+        handler = HANDLERS.get(job.kind)
+        if handler is None:
+            return f'No handler registered for job kind {job.kind!r}', True
+        handler(job.media_file)
+        return None
+    except PERMANENT_ERRORS:
+        return traceback.format_exc(), True
+    except Exception:
+        return traceback.format_exc(), False
+    finally:
+        connections.close_all()
+
+
+def get_retry_delay(attempts):
+    base = getattr(settings, 'MEDIA_JOB_RETRY_BACKOFF', 30)
+    return min(base * 2 ** max(attempts - 1, 0), getattr(settings, 'MEDIA_JOB_RETRY_MAX_DELAY', 3600))
+
+
+def complete_job(job_id, error=None, permanent=False):
+    """
+    Record the outcome of ``run_job`` and reschedule failed attempts
+    (unless the error is ``permanent``).
+    Returns ``None`` if the job is gone (its media file was deleted while
+    the worker ran): there is nothing left to record.
+    """
+    job = MediaJob.objects.filter(id=job_id).first()
+    if job is None:
+        return None
+    if error is None:
+        job.status = 'done'
+        job.last_error = ''
+    elif permanent or job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        job.last_error = error
+        logger.error('Media job %s (%s) failed permanently: %s', job.id, job.kind, error)
+    else:
+        job.status = 'pending'
+        job.last_error = error
+        job.run_after = timezone.now() + timedelta(seconds=get_retry_delay(job.attempts))
+    job.locked_at = None
+    # update() вместо save(): строка могла исчезнуть и после чтения
+    updated = MediaJob.objects.filter(id=job_id).update(
+        status=job.status, last_error=job.last_error, run_after=job.run_after,
+        locked_at=None, updated_at=timezone.now(),
+    )
+    if not updated:
+        return None
+    update_processing_status(job.media_file_id)
+    return job
+
+
+def update_processing_status(media_file_id):
+    """Derive ``MediaFile.processing_status`` from the latest job of each kind."""
+    latest = {}
+    jobs = MediaJob.objects.filter(media_file_id=media_file_id).order_by('created_at')
+    for kind, status in jobs.values_list('kind', 'status'):
+        latest[kind] = status
+
+    statuses = set(latest.values())
+    if statuses & {'pending', 'running'}:
+        status = 'processing'
+    elif 'failed' in statuses:
+        status = 'failed'
+    else:
+        status = 'ready'
+    MediaFile.objects.filter(id=media_file_id).update(processing_status=status)
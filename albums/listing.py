@@ -0,0 +1,54 @@
+"""
+Annotations for the album list.
+
+Every figure on an album card is a correlated subquery, so a page of
+albums — with live media count, total size, last upload, a cover image
+and the view counters — comes from a single query however many albums
+or files the owner has.  The subqueries run per album on the
+``(album, is_deleted, uploaded_at)`` index of MediaFile.
+"""
+from django.db.models import BigIntegerField, Count, DateTimeField, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+
+from .models import MediaFile, MediaRendition
+from .stats import album_totals_subquery
+
+
+def _visible_media():
+    return MediaFile.objects.filter(album=OuterRef('pk'), is_deleted=False)
+
+
+def _per_album(aggregate, output_field):
+    rows = _visible_media().order_by().values('album').annotate(value=aggregate).values('value')
+    return Subquery(rows, output_field=output_field)
+
+
+def annotate_album_cards(queryset):
+    """
+    Add ``media_count``, ``total_bytes``, ``last_upload``, ``cover_id``,
+    ``cover_rendition_id``, ``total_views`` and ``total_media_views``.
+    """
+    # Обложка — последнее загруженное изображение, превью — его наименьший JPEG
+    cover = _visible_media().filter(file_type='image').order_by('-uploaded_at', '-id').values('id')[:1]
+    cover_rendition = MediaRendition.objects.filter(
+        media_file=OuterRef('cover_id'), format='jpeg',
+    ).order_by('width').values('id')[:1]
+    return queryset.annotate(
+        media_count=Coalesce(_per_album(Count('id'), IntegerField()), 0),
+        total_bytes=Coalesce(_per_album(Sum('file_size'), BigIntegerField()), 0),
+        last_upload=_per_album(Max('uploaded_at'), DateTimeField()),
+        cover_id=Subquery(cover),
+        cover_rendition_id=Subquery(cover_rendition),
+        total_views=album_totals_subquery('views'),
+        total_media_views=album_totals_subquery('media_views'),
+    )
+
+
+def get_cover_url(album):
+    """Preview URL of an annotated album's cover, or ``None`` without images."""
+    if album.cover_id is None:
+        return None
+    if album.cover_rendition_id is not None:
+        return reverse('media_rendition_content', args=[album.id, album.cover_id, album.cover_rendition_id])
+    return reverse('media_file_content', args=[album.id, album.cover_id])
@@ -0,0 +1,248 @@
+"""
+Sinks that persist ActivityLog entries produced by ``log_activity``.
+
+``SyncLogSink`` writes each entry on the calling thread (used in tests and
+for debugging).  ``QueuedLogSink`` puts entries into a bounded in-process
+queue that a background thread drains with ``bulk_create`` every
+``ACTIVITY_LOG_BATCH_SIZE`` entries or ``ACTIVITY_LOG_FLUSH_INTERVAL_MS``
+milliseconds, whichever comes first.  Written entries are also applied to
+the per-album daily statistics (``albums.stats``).
+
+Async views call ``awrite``: the queued sink enqueues on the event loop
+without blocking it, the synchronous sink saves in a worker thread.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connection
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+SINK_SETTINGS = (
+    'ACTIVITY_LOG_SINK',
+    'ACTIVITY_LOG_QUEUE_SIZE',
+    'ACTIVITY_LOG_BATCH_SIZE',
+    'ACTIVITY_LOG_FLUSH_INTERVAL_MS',
+    'ACTIVITY_LOG_OVERFLOW',
+)
+
+
+class SyncLogSink:
+    """Save every entry immediately on the request thread."""
+
+    def __init__(self):
+        self.stats = {'written': 0, 'errors': 0}
+
+    def write(self, entry):
+        from .stats import safe_record_entries
+
+        entry.save()
+        self.stats['written'] += 1
+        safe_record_entries([entry])
+
+    async def awrite(self, entry):
+        await sync_to_async(self.write)(entry)
+
+    def flush(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class QueuedLogSink:
+    """
+    Bounded queue drained by a background worker with ``bulk_create``.
+
+    When the queue is full the ``overflow`` policy decides what happens:
+    ``'drop'`` discards the new entry (counted in ``stats['dropped']``),
+    ``'block'`` waits for the worker to free a slot.
+    """
+
+    def __init__(self, queue_size=10000, batch_size=100, flush_interval_ms=500, overflow='drop'):
+        if overflow not in ('drop', 'block'):
+            raise ValueError(f'Unknown ACTIVITY_LOG_OVERFLOW policy: {overflow!r}')
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.overflow = overflow
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'blocked': 0,
+            'flushes': 0,
+            'errors': 0,
+        }
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._flush_requested = threading.Event()
+        self._idle = threading.Condition()
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+        self._thread.start()
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def write(self, entry):
+        if self._stopping.is_set():
+            # Воркер уже остановлен (завершение процесса) — пишем напрямую.
+            from .stats import safe_record_entries
+
+            entry.save()
+            self._count('written')
+            safe_record_entries([entry])
+            return
+        if not self._offer(entry):
+            self.queue.put(entry)
+            self._count('enqueued')
+
+    async def awrite(self, entry):
+        if self._stopping.is_set():
+            await sync_to_async(self.write)(entry)
+            return
+        if not self._offer(entry):
+            # Ожидание свободного места — в отдельном потоке, не в цикле событий
+            await sync_to_async(self.queue.put, thread_sensitive=False)(entry)
+            self._count('enqueued')
+
+    def _offer(self, entry):
+        """
+        Enqueue without waiting.  Returns ``False`` when the queue is full
+        under the ``'block'`` policy and the caller has to wait for a slot.
+        """
+        with self._idle:
+            self._pending += 1
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            if self.overflow == 'drop':
+                self._done(1)
+                self._count('dropped')
+                return True
+            self._count('blocked')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _done(self, amount):
+        with self._idle:
+            self._pending -= amount
+            if self._pending <= 0:
+                self._idle.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every entry enqueued so far has been written."""
+        self._flush_requested.set()
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending <= 0, timeout=timeout)
+
+    def shutdown(self, timeout=10):
+        """Stop the worker after writing whatever is still queued."""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._flush_requested.set()
+        self._thread.join(timeout=timeout)
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if self._flush_requested.is_set() and self.queue.empty():
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(remaining, 0.05)))
+            except queue.Empty:
+                if self._stopping.is_set():
+                    break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                self._write_batch(batch)
+            elif self._flush_requested.is_set():
+                self._flush_requested.clear()
+            if self._stopping.is_set() and self.queue.empty():
+                break
+        connection.close()
+
+    def _write_batch(self, batch):
+        from .models import ActivityLog
+        from .stats import safe_record_entries
+
+        close_old_connections()
+        try:
+            ActivityLog.objects.bulk_create(batch)
+        except Exception:
+            logger.exception('Failed to write %d activity log entries', len(batch))
+            self._count('errors', len(batch))
+        else:
+            self._count('written', len(batch))
+            safe_record_entries(batch)
+        finally:
+            self._count('flushes')
+            self._done(len(batch))
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def create_log_sink():
+    mode = getattr(settings, 'ACTIVITY_LOG_SINK', 'sync')
+    if mode == 'sync':
+        return SyncLogSink()
+    if mode == 'queued':
+        return QueuedLogSink(
+            queue_size=getattr(settings, 'ACTIVITY_LOG_QUEUE_SIZE', 10000),
+            batch_size=getattr(settings, 'ACTIVITY_LOG_BATCH_SIZE', 100),
+            flush_interval_ms=getattr(settings, 'ACTIVITY_LOG_FLUSH_INTERVAL_MS', 500),
+            overflow=getattr(settings, 'ACTIVITY_LOG_OVERFLOW', 'drop'),
+        )
+    raise ValueError(f'Unknown ACTIVITY_LOG_SINK: {mode!r}')
+
+
+def get_log_sink():
+    """Return the process-wide sink, creating it on first use."""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = create_log_sink()
+    return _sink
+
+
+def reset_log_sink():
+    """Flush and drop the current sink so the next call re-reads settings."""
+    global _sink
+    with _sink_lock:
+        if _sink is not None:
+            _sink.shutdown()
+        _sink = None
+
+
+@atexit.register
+def _shutdown_log_sink():
+    if _sink is not None:
+        _sink.shutdown()
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in SINK_SETTINGS:
+        reset_log_sink()
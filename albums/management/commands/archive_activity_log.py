@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from albums.retention import COMPRESSIONS, archive_expired
+
+
+class Command(BaseCommand):
+    help = 'Move activity log entries past their retention period into compressed archives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--compression', choices=list(COMPRESSIONS),
+                            help='Defaults to ACTIVITY_LOG_ARCHIVE_COMPRESSION.')
+        parser.add_argument('--dir', help='Defaults to ACTIVITY_LOG_ARCHIVE_DIR.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the expired entries.')
+
+    def handle(self, *args, **options):
+        count, paths = archive_expired(
+            batch_size=options['batch_size'],
+            compression=options['compression'],
+            directory=options['dir'],
+            dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{count} entries are past their retention period.')
+            return
+        for path in paths:
+            self.stdout.write(str(path))
+        self.stdout.write(self.style.SUCCESS(f'Archived {count} entries into {len(paths)} files.'))
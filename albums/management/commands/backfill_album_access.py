@@ -0,0 +1,33 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from albums.models import AlbumAccessGrant
+from albums.utils import register_session_grants
+
+
+class Command(BaseCommand):
+    help = 'Populate AlbumAccessGrant from album access keys stored in existing sessions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='Also delete grants whose session no longer exists or has expired.',
+        )
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.filter(expire_date__gt=timezone.now())
+        scanned = granted = 0
+        for session in sessions.iterator(chunk_size=options['chunk_size']):
+            scanned += 1
+            granted += register_session_grants(session.session_key, session.get_decoded())
+        self.stdout.write(f'Scanned {scanned} sessions, recorded {granted} grants.')
+
+        if options['prune']:
+            live = Session.objects.filter(expire_date__gt=timezone.now()).values('session_key')
+            deleted, _ = AlbumAccessGrant.objects.exclude(session_key__in=live).delete()
+            self.stdout.write(f'Pruned {deleted} stale grants.')
+
+        self.stdout.write(self.style.SUCCESS('Done.'))
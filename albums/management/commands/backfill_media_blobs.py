@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from albums.blobs import move_to_blob
+from albums.models import MediaFile
+
+
+class Command(BaseCommand):
+    help = 'Move media files uploaded before content-addressed storage into blobs, merging duplicates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        legacy = MediaFile.objects.filter(blob__isnull=True).exclude(file='').only('id', 'file', 'original_name')
+        moved = failed = 0
+        for media_file in legacy.iterator(chunk_size=options['chunk_size']):
+            try:
+                move_to_blob(media_file)
+            except OSError as exc:
+                failed += 1
+                self.stderr.write(f'{media_file.id}: {exc}')
+            else:
+                moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} files into blobs, {failed} failed.'))
@@ -0,0 +1,73 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from albums.benchmark import SCALES, find_regressions, report, run_scale
+from albums.uacache import get_user_agent_cache
+from albums.utils import clear_content_type_ids
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database at the given scales, request every URL and record query '
+        'counts, median time and peak memory; optionally compare with a previous report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', dest='scales', choices=list(SCALES),
+                            help='Repeat to run several scales (default: small).')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Only run the named scenario; repeat for several.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed requests per scenario.')
+        parser.add_argument('--output', '-o', help='Write the JSON report to this file.')
+        parser.add_argument('--baseline', help='JSON report of a previous run to compare with.')
+        parser.add_argument('--max-query-increase', type=int, default=0)
+        parser.add_argument('--max-time-ratio', type=float, default=1.5)
+        parser.add_argument('--min-time-delta-ms', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)
+
+        results = []
+        for scale in options['scales'] or ['small']:
+            results.extend(self.run(scale, options))
+
+        data = report(results)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(data, fh, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}.')
+
+        if baseline is not None:
+            regressions = find_regressions(
+                data, baseline,
+                max_query_increase=options['max_query_increase'],
+                max_time_ratio=options['max_time_ratio'],
+                min_time_delta_ms=options['min_time_delta_ms'],
+            )
+            if regressions:
+                raise CommandError('Regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def run(self, scale, options):
+        # Каждый масштаб — в своей пустой тестовой базе; рабочая база не трогается
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Кэши id переживают пересоздание базы
+            get_user_agent_cache().clear()
+            clear_content_type_ids()
+            with override_settings(ACTIVITY_LOG_SINK='sync', MEDIA_ROOT=media_root, DEBUG=False):
+                return run_scale(scale, repeat=options['repeat'], only=options['scenarios'], log=self.stdout.write)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
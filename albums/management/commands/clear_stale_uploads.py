@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from albums.chunked import discard_upload
+from albums.models import ChunkedUpload
+
+
+class Command(BaseCommand):
+    help = 'Discard chunked uploads that have not received data for a while.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        # «finalizing» остаётся после падения процесса во время завершения
+        stale = ChunkedUpload.objects.filter(status__in=['uploading', 'finalizing'], updated_at__lt=cutoff)
+        count = 0
+        for upload in stale.iterator():
+            discard_upload(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Discarded {count} stale uploads.'))
@@ -0,0 +1,62 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from albums.export import FORMATS, export_stream, filter_logs, parse_bound
+from albums.models import ActivityLog
+
+
+class Command(BaseCommand):
+    help = 'Stream activity log entries to a CSV or JSON-lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--action', action='append', dest='actions',
+                            choices=[action for action, _ in ActivityLog.ACTION_TYPES],
+                            help='Repeat to export several actions.')
+        parser.add_argument('--since', help='Date or ISO datetime (inclusive).')
+        parser.add_argument('--until', help='Date or ISO datetime (inclusive).')
+        parser.add_argument('--album', help='Album UUID.')
+        parser.add_argument('--output', '-o', default='-', help='File path, or - for stdout.')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since']) if options['since'] else None
+            until = parse_bound(options['until'], end=True) if options['until'] else None
+        except ValueError as exc:
+            raise CommandError(exc)
+        try:
+            album = uuid.UUID(options['album']) if options['album'] else None
+        except ValueError:
+            raise CommandError(f'Invalid album UUID: {options["album"]!r}')
+
+        queryset = filter_logs(actions=options['actions'], since=since, until=until, album=album)
+        chunks = export_stream(queryset, options['format'], compress=options['gzip'], chunk_size=options['chunk_size'])
+
+        if options['output'] == '-':
+            self.write_stdout(chunks, binary=options['gzip'])
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Wrote {written} bytes to {options["output"]}.'))
+
+    def write_stdout(self, chunks, binary):
+        # Байты пишем в буфер потока, если он есть (sys.stdout); иначе
+        # (call_command(stdout=StringIO())) — текстом через self.stdout
+        buffer = getattr(self.stdout, 'buffer', None)
+        if buffer is not None:
+            self.stdout.flush()
+            for chunk in chunks:
+                buffer.write(chunk)
+            buffer.flush()
+            return
+        if binary:
+            raise CommandError('This output stream only accepts text; use --output for --gzip.')
+        for chunk in chunks:
+            self.stdout.write(chunk.decode(), ending='')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from albums.jobs import enqueue
+from albums.models import MediaFile
+
+
+class Command(BaseCommand):
+    help = 'Enqueue metadata extraction jobs for media files uploaded before content sniffing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-extract metadata for every file, not only those without a MIME type.')
+
+    def handle(self, *args, **options):
+        media_files = MediaFile.objects.filter(is_deleted=False)
+        if not options['all']:
+            media_files = media_files.filter(mime_type='')
+
+        queued = 0
+        for media_file in media_files.only('id', 'file_type').iterator():
+            if enqueue(media_file, 'metadata'):
+                queued += 1
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} metadata jobs; run run_media_worker to process them.'))
@@ -0,0 +1,52 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from albums.models import MediaFile
+from albums.thumbnails import generate_renditions
+
+
+class Command(BaseCommand):
+    help = 'Generate missing image renditions for existing media files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--album', help='Only process media of this album (UUID).')
+        parser.add_argument('--force', action='store_true', help='Regenerate existing renditions.')
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        media_files = MediaFile.objects.filter(file_type='image', is_deleted=False)
+        if options['album']:
+            try:
+                album_id = uuid.UUID(options['album'])
+            except ValueError:
+                raise CommandError(f'Invalid album UUID: {options["album"]!r}')
+            media_files = media_files.filter(album_id=album_id)
+        media_ids = list(media_files.values_list('id', flat=True))
+
+        created = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(self._process, media_id, options['force']): media_id
+                for media_id in media_ids
+            }
+            for future in as_completed(futures):
+                try:
+                    created += future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {len(media_ids)} files, created {created} renditions, {failed} failed.'
+        ))
+
+    def _process(self, media_id, force):
+        close_old_connections()
+        try:
+            media_file = MediaFile.objects.get(id=media_id)
+            return len(generate_renditions(media_file, force=force))
+        finally:
+            connection.close()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from albums.retention import import_archive
+
+
+class Command(BaseCommand):
+    help = 'Load archived activity log entries back into the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = 0
+        for path in options['paths']:
+            try:
+                count = import_archive(path, batch_size=options['batch_size'])
+            except OSError as exc:
+                raise CommandError(f'Cannot read {path}: {exc}')
+            self.stdout.write(f'{path}: {count} entries')
+            total += count
+        self.stdout.write(self.style.SUCCESS(f'Imported {total} entries.'))
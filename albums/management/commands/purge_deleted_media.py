@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from albums.blobs import delete_unreferenced_blobs, purge_deleted_media
+
+
+class Command(BaseCommand):
+    help = 'Remove media deleted long ago and the stored blobs no file refers to any more.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'MEDIA_PURGE_AFTER_DAYS', 30),
+                            help='Purge files deleted more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        purged = purge_deleted_media(cutoff, batch_size=options['batch_size'])
+        blobs, freed = delete_unreferenced_blobs()
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {purged} media files, deleted {blobs} blobs ({filesizeformat(freed)}).'
+        ))
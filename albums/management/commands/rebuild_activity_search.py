@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from albums.search import fts_available, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recreate the activity log full-text index (SQLite) from the current rows.'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError(
+                'The full-text index needs SQLite 3.34 or newer; other backends and older SQLite '
+                'versions search without it.'
+            )
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} activity log entries.'))
@@ -0,0 +1,21 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from albums.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-album daily statistics from the raw activity log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--album', help='Rebuild only this album (UUID).')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            album_id = uuid.UUID(options['album']) if options['album'] else None
+        except ValueError:
+            raise CommandError(f'Invalid album UUID: {options["album"]!r}')
+        rows = rebuild_stats(album_id=album_id, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} statistics rows.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from albums.feed import refresh_ranking
+
+
+class Command(BaseCommand):
+    help = 'Recompute the ranking of public albums shown in the discovery feed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = refresh_ranking(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Ranked {rows} public albums.'))
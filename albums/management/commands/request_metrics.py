@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from albums.instrumentation import TIMINGS, collect_snapshots, merge_snapshots, summarize
+
+
+class Command(BaseCommand):
+    help = 'Show per-view request timings published by the web processes to the cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the merged histograms as JSON.')
+        parser.add_argument('--limit', type=int, default=20, help='Number of views to show.')
+
+    def handle(self, *args, **options):
+        # Этот процесс сам запросов не обслуживает — берём только опубликованные снимки
+        merged = merge_snapshots(collect_snapshots(include_current=False))
+        if options['json']:
+            self.stdout.write(json.dumps(merged, indent=2))
+            return
+        if not merged['views']:
+            self.stdout.write('No metrics published yet (is the cache shared with the web processes?).')
+            return
+
+        columns = ['count', 'errors', *(f'{name}_avg_ms' for name in TIMINGS),
+                   'total_p95_ms', 'queries_avg', 'queries_max', 'bytes_avg']
+        rows = summarize(merged)[:options['limit']]
+        width = max(len(row['view']) for row in rows)
+        self.stdout.write(f'{len(merged["processes"])} process(es)')
+        self.stdout.write(' '.join(['view'.ljust(width), *(column.rjust(13) for column in columns)]))
+        for row in rows:
+            self.stdout.write(' '.join([row['view'].ljust(width), *(str(row[column]).rjust(13) for column in columns)]))
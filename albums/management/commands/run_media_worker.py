@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from albums.jobs import claim_jobs, complete_job, release_stale_jobs, run_job
+
+
+def _init_worker():
+    # Под spawn дочерний процесс стартует «с нуля», под fork наследует
+    # открытые соединения родителя — их нельзя использовать совместно.
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Process queued media jobs (renditions, metadata, ...) in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'MEDIA_JOB_WORKERS', 2))
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no due jobs are left instead of polling.')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        processed = failed = 0
+
+        started = False
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            while True:
+                release_stale_jobs()
+                job_ids = claim_jobs(limit=workers * 2)
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                if not started:
+                    # Пул запускает процессы при первом submit; соединение, открытое
+                    # claim_jobs, закрываем до fork, чтобы потомки его не унаследовали
+                    connections.close_all()
+                    started = True
+                futures = {pool.submit(run_job, job_id): job_id for job_id in job_ids}
+                for future in as_completed(futures):
+                    job_id = futures[future]
+                    try:
+                        error, permanent = future.result() or (None, False)
+                    except Exception as exc:
+                        # Процесс-воркер упал (например, нехватка памяти)
+                        error, permanent = repr(exc), False
+                    job = complete_job(job_id, error, permanent=permanent)
+                    processed += 1
+                    if job is None:
+                        # Задание удалено вместе с файлом, пока воркер его выполнял
+                        continue
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'Job {job.id} ({job.kind}) failed, status={job.status}')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs, {failed} failed.'))
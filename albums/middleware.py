@@ -1,17 +1,92 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.contrib.auth.signals import user_logged_out
 from django.dispatch import receiver
+from .instrumentation import collect, install_db_wrappers, metrics_enabled, registry, server_timing
 from .utils import log_activity
 
 class ActivityLoggingMiddleware:
+    """
+    Measure every request: database, template and logging time, query
+    count and response size.  The numbers go to the ``Server-Timing``
+    header and to the per-view histograms of ``albums.instrumentation``.
+    Works in both the WSGI and the ASGI handler without a thread hop.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        response = self.get_response(request)
+        if self.async_mode:
+            return self.__acall__(request)
+        if not metrics_enabled():
+            return self.get_response(request)
+
+        install_db_wrappers()
+        with collect() as metrics:
+            response = self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not metrics_enabled():
+            return await self.get_response(request)
+
+        # Обёртка БД ставится на соединения потоков ORM при их создании
+        with collect() as metrics:
+            response = await self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        if getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', True):
+            response['Server-Timing'] = server_timing(metrics)
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else '<unresolved>'
+        total = metrics.elapsed()
+
+        def record(size):
+            registry.record(view_name, total, metrics.timings, metrics.queries, size, response.status_code)
+            registry.maybe_publish()
+
+        if not response.streaming:
+            record(len(response.content))
+        elif response.has_header('Content-Length'):
+            record(int(response['Content-Length']))
+        else:
+            # Размер потокового ответа известен только после отдачи последнего куска
+            response.streaming_content = _counting(response, record)
         return response
 
+
+def _counting(response, done):
+    content = response.streaming_content
+    if response.is_async:
+        async def counted():
+            size = 0
+            try:
+                async for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+            finally:
+                done(size)
+    else:
+        def counted():
+            size = 0
+            try:
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+            finally:
+                done(size)
+    return counted()
+
 # Логирование входа пользователя
 @receiver(user_logged_out)
 def log_user_logout(sender, request, user, **kwargs):
     """Log user logout event."""
-    log_activity(request, 'logout', user=user)
\ No newline at end of file
+    log_activity(request, 'logout', user=user)
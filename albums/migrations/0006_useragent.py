@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0005_activitylog_content_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('string', models.TextField()),
+                ('browser_family', models.CharField(blank=True, max_length=100)),
+                ('browser_version', models.CharField(blank=True, max_length=50)),
+                ('os_family', models.CharField(blank=True, max_length=100)),
+                ('os_version', models.CharField(blank=True, max_length=50)),
+                ('device_family', models.CharField(blank=True, max_length=100)),
+                ('device_brand', models.CharField(blank=True, max_length=50)),
+                ('device_model', models.CharField(blank=True, max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
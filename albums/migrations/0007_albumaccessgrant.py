@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0006_useragent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumAccessGrant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(db_index=True, max_length=40)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access_grants', to='albums.album')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('album', 'session_key'), name='unique_album_session_grant')],
+            },
+        ),
+    ]
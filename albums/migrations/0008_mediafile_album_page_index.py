@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0007_albumaccessgrant'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(fields=['album', 'is_deleted', 'uploaded_at'], name='albums_medi_album_i_c4b266_idx'),
+        ),
+    ]
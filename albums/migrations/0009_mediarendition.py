@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:07
+
+import albums.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0008_mediafile_album_page_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=10)),
+                ('file', models.FileField(upload_to=albums.models.rendition_upload_to)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('media_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='albums.mediafile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('media_file', 'width', 'format'), name='unique_media_rendition')],
+            },
+        ),
+    ]
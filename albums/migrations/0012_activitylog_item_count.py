@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0011_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitylog',
+            name='item_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:12
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0012_activitylog_item_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='duration',
+            field=models.FloatField(blank=True, help_text='Длительность видео в секундах', null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='mime_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='taken_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(models.F('album'), models.F('is_deleted'), django.db.models.functions.comparison.Coalesce('taken_at', 'uploaded_at'), name='albums_media_album_taken_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0013_mediafile_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('media_views', models.PositiveIntegerField(default=0)),
+                ('unique_ips', models.PositiveIntegerField(default=0)),
+                ('uploads', models.PositiveIntegerField(default=0)),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='albums.album')),
+                ('media_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='albums.mediafile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('media_file__isnull', True)), fields=('album', 'date'), name='unique_album_daily_stats'), models.UniqueConstraint(condition=models.Q(('media_file__isnull', False)), fields=('album', 'media_file', 'date'), name='unique_media_daily_stats')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AlbumDailyVisitor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('ip_address', models.GenericIPAddressField()),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='albums.album')),
+                ('media_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='albums.mediafile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('media_file__isnull', True)), fields=('album', 'date', 'ip_address'), name='unique_album_daily_visitor'), models.UniqueConstraint(condition=models.Q(('media_file__isnull', False)), fields=('album', 'media_file', 'date', 'ip_address'), name='unique_media_daily_visitor')],
+            },
+        ),
+    ]
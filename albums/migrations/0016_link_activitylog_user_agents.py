@@ -0,0 +1,95 @@
+import hashlib
+
+from django.db import migrations
+
+UA_FIELDS = (
+    'browser_family',
+    'browser_version',
+    'os_family',
+    'os_version',
+    'device_family',
+    'device_brand',
+    'device_model',
+)
+BATCH_SIZE = 500
+
+
+def _hash(user_agent_string):
+    return hashlib.sha256(user_agent_string.encode('utf-8', 'replace')).hexdigest()
+
+
+def _log_batches(ActivityLog, fields, **filters):
+    """Log rows as ``values_list`` tuples (pk first), in pk order, ``BATCH_SIZE`` at a time."""
+    rows = ActivityLog.objects.filter(**filters).order_by('pk').values_list('pk', *fields)
+    last = None
+    while True:
+        batch = list((rows if last is None else rows.filter(pk__gt=last))[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1][0]
+
+
+def link_user_agents(apps, schema_editor):
+    """Create one UserAgent per distinct string and point the log rows at it."""
+    ActivityLog = apps.get_model('albums', 'ActivityLog')
+    UserAgent = apps.get_model('albums', 'UserAgent')
+
+    # Поля уже разобраны при записи журнала — берём их из первой строки,
+    # а не запускаем парсер повторно
+    # Только строки без ссылки: прерванную миграцию можно запустить снова
+    unlinked = ActivityLog.objects.filter(user_agent_ref__isnull=True)
+    parsed = {}
+    for row in unlinked.values('user_agent', *UA_FIELDS).order_by().distinct().iterator():
+        parsed.setdefault(row.pop('user_agent'), row)
+
+    ids = {}
+    strings = list(parsed)
+    for start in range(0, len(strings), BATCH_SIZE):
+        chunk = strings[start:start + BATCH_SIZE]
+        UserAgent.objects.bulk_create(
+            [UserAgent(hash=_hash(string), string=string, **parsed[string]) for string in chunk],
+            ignore_conflicts=True,
+        )
+        by_hash = dict(UserAgent.objects.filter(hash__in=[_hash(string) for string in chunk]).values_list('hash', 'id'))
+        ids.update((string, by_hash[_hash(string)]) for string in chunk)
+
+    # Колонка user_agent не индексирована: вместо UPDATE на каждую строку UA
+    # проходим журнал пачками по pk и сопоставляем строки в памяти
+    for batch in _log_batches(ActivityLog, ['user_agent'], user_agent_ref__isnull=True):
+        ActivityLog.objects.bulk_update(
+            [ActivityLog(pk=pk, user_agent_ref_id=ids[string]) for pk, string in batch],
+            ['user_agent_ref'],
+        )
+
+
+def unlink_user_agents(apps, schema_editor):
+    ActivityLog = apps.get_model('albums', 'ActivityLog')
+    UserAgent = apps.get_model('albums', 'UserAgent')
+
+    values = {}
+    for batch in _log_batches(ActivityLog, ['user_agent_ref_id'], user_agent_ref__isnull=False):
+        missing = {ref_id for _, ref_id in batch} - values.keys()
+        values.update(
+            (row.pop('id'), row)
+            for row in UserAgent.objects.filter(id__in=missing).values('id', 'string', *UA_FIELDS)
+        )
+        entries = []
+        for pk, ref_id in batch:
+            fields = values[ref_id]
+            entries.append(ActivityLog(pk=pk, user_agent=fields['string'], **{name: fields[name] for name in UA_FIELDS}))
+        ActivityLog.objects.bulk_update(entries, ['user_agent', *UA_FIELDS])
+
+
+class Migration(migrations.Migration):
+    # Каждая пачка фиксируется отдельно, чтобы не держать блокировку на весь журнал;
+    # уже связанные строки пропускаются, поэтому после сбоя миграция продолжается
+    atomic = False
+
+    dependencies = [
+        ('albums', '0015_activitylog_user_agent_ref'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_user_agents, unlink_user_agents),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0016_link_activitylog_user_agents'),
+    ]
+
+    operations = [
+        # Значение по умолчанию нужно только для отката: колонка вернётся NOT NULL
+        migrations.AlterField(
+            model_name='activitylog',
+            name='user_agent',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='activitylog',
+            old_name='user_agent_ref',
+            new_name='user_agent',
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='browser_family',
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='browser_version',
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='device_brand',
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='device_family',
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='device_model',
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='os_family',
+        ),
+        migrations.RemoveField(
+            model_name='activitylog',
+            name='os_version',
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from albums.search import create_search_index, fts_available, rebuild_search_index
+
+    create_search_index(schema_editor)
+    # На SQLite старше 3.34 индекс не создаётся, поиск идёт через icontains
+    if fts_available(schema_editor.connection):
+        # Документы для уже существующих строк журнала
+        rebuild_search_index()
+
+
+def drop_search_index(apps, schema_editor):
+    from albums.search import drop_search_index
+
+    drop_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0017_remove_activitylog_user_agent_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0018_activitylog_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['owner', 'is_deleted', 'created_at'], name='albums_albu_owner_i_13b910_idx'),
+        ),
+    ]
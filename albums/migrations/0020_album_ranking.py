@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('albums', '0019_album_owner_list_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumRanking',
+            fields=[
+                ('album', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='albums.album')),
+                ('rank', models.PositiveIntegerField(unique=True)),
+                ('score', models.FloatField(default=0)),
+                ('recent_views', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.urls import reverse
 from django.utils import timezone
+import os
 import uuid
 
 class UserProfile(models.Model):
@@ -21,23 +25,290 @@ class Album(models.Model):
     is_deleted = models.BooleanField(default=False, db_index=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Список альбомов владельца, новые первыми, с курсорной пагинацией
+            models.Index(fields=['owner', 'is_deleted', 'created_at']),
+        ]
+
     def __str__(self):
         return self.title
 
+class Blob(models.Model):
+    """
+    File contents stored once under their SHA-256 (see ``albums.blobs``).
+
+    ``ref_count`` is the number of MediaFile rows pointing at the blob,
+    soft-deleted ones included; the bytes are removed only at zero.
+    """
+    hash = models.CharField(max_length=64, unique=True)
+    file = models.FileField()
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.hash
+
 class MediaFile(models.Model):
     FILE_TYPES = (
         ('image', 'Image'),
         ('video', 'Video'),
     )
+    PROCESSING_STATUSES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='media_files')
     file = models.FileField(upload_to='media/')
+    # Новые файлы хранятся в Blob; file указывает на тот же путь в хранилище
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='media_files')
+    original_name = models.CharField(max_length=255, blank=True)
     file_type = models.CharField(max_length=10, choices=FILE_TYPES)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     description = models.TextField(blank=True)
     is_deleted = models.BooleanField(default=False, db_index=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_STATUSES, default='ready')
+
+    # Метаданные, извлечённые из заголовка файла при загрузке
+    mime_type = models.CharField(max_length=100, blank=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text='Длительность видео в секундах')
+    taken_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Курсорная пагинация альбома по (uploaded_at, id)
+            models.Index(fields=['album', 'is_deleted', 'uploaded_at']),
+            # Сортировка по дате съёмки (файлы без EXIF — по дате загрузки)
+            models.Index(
+                F('album'), F('is_deleted'), Coalesce('taken_at', 'uploaded_at'),
+                name='albums_media_album_taken_idx',
+            ),
+        ]
+
+    def _srcset(self, image_format):
+        # Использует prefetch_related('renditions'), чтобы не делать запрос на карточку
+        renditions = sorted(
+            (r for r in self.renditions.all() if r.format == image_format),
+            key=lambda r: r.width,
+        )
+        return ', '.join(f'{r.url} {r.width}w' for r in renditions)
+
+    @property
+    def webp_srcset(self):
+        return self._srcset('webp')
+
+    @property
+    def jpeg_srcset(self):
+        return self._srcset('jpeg')
+
+    @property
+    def preview_url(self):
+        """Smallest JPEG rendition, falling back to the original upload."""
+        jpegs = [r for r in self.renditions.all() if r.format == 'jpeg']
+        if jpegs:
+            return min(jpegs, key=lambda r: r.width).url
+        return self.content_url
+
+    @property
+    def display_name(self):
+        """Name the file was uploaded under (blob paths are hashes)."""
+        return self.original_name or os.path.basename(self.file.name)
+
+    @property
+    def content_url(self):
+        """Access-checked URL of the original file."""
+        return reverse('media_file_content', args=[self.album_id, self.id])
+
+def rendition_upload_to(instance, filename):
+    # Превью хранятся рядом с оригиналом: media/renditions/<имя>
+    return f'media/renditions/{filename}'
+
+class MediaRendition(models.Model):
+    """Downscaled copy of an image MediaFile used in album grids."""
+    FORMATS = (
+        ('webp', 'WebP'),
+        ('jpeg', 'JPEG'),
+    )
+
+    media_file = models.ForeignKey(MediaFile, on_delete=models.CASCADE, related_name='renditions')
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    format = models.CharField(max_length=10, choices=FORMATS)
+    file = models.FileField(upload_to=rendition_upload_to)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['media_file', 'width', 'format'], name='unique_media_rendition'),
+        ]
+
+    @property
+    def url(self):
+        return reverse('media_rendition_content', args=[self.media_file.album_id, self.media_file_id, self.id])
+
+class MediaJob(models.Model):
+    """Background processing task for a MediaFile, executed by run_media_worker."""
+    STATUSES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    media_file = models.ForeignKey(MediaFile, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=30)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+        constraints = [
+            # Не более одной активной задачи каждого вида на файл
+            models.UniqueConstraint(
+                fields=['media_file', 'kind'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_media_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} ({self.status})'
+
+class ChunkedUpload(models.Model):
+    """Resumable upload of a large file, received in ordered chunks."""
+    STATUSES = (
+        ('uploading', 'Uploading'),
+        ('finalizing', 'Finalizing'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='chunked_uploads')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    # Имя файла в хранилище: чанки пишутся сразу в итоговое место
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True, help_text='Ожидаемый SHA-256 (hex)')
+    status = models.CharField(max_length=10, choices=STATUSES, default='uploading')
+    media_file = models.ForeignKey(MediaFile, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class AlbumAccessGrant(models.Model):
+    """Session that was granted view access to a password-protected album."""
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='access_grants')
+    session_key = models.CharField(max_length=40, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['album', 'session_key'], name='unique_album_session_grant'),
+        ]
+
+class AlbumDailyStats(models.Model):
+    """
+    Daily counters rolled up from ActivityLog.
+
+    Rows with an empty ``media_file`` hold album totals: ``views`` counts
+    album page views, ``media_views`` views of any file in the album.
+    Rows with ``media_file`` set count views of that file in ``views``.
+    """
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='daily_stats')
+    media_file = models.ForeignKey(MediaFile, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_stats')
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    media_views = models.PositiveIntegerField(default=0)
+    unique_ips = models.PositiveIntegerField(default=0)
+    uploads = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['album', 'date'],
+                condition=models.Q(media_file__isnull=True),
+                name='unique_album_daily_stats',
+            ),
+            models.UniqueConstraint(
+                fields=['album', 'media_file', 'date'],
+                condition=models.Q(media_file__isnull=False),
+                name='unique_media_daily_stats',
+            ),
+        ]
+
+class AlbumDailyVisitor(models.Model):
+    """IP address seen on a given day, used to maintain ``AlbumDailyStats.unique_ips``."""
+    album = models.ForeignKey(Album, on_delete=models.CASCADE)
+    media_file = models.ForeignKey(MediaFile, on_delete=models.CASCADE, null=True, blank=True)
+    date = models.DateField()
+    ip_address = models.GenericIPAddressField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['album', 'date', 'ip_address'],
+                condition=models.Q(media_file__isnull=True),
+                name='unique_album_daily_visitor',
+            ),
+            models.UniqueConstraint(
+                fields=['album', 'media_file', 'date', 'ip_address'],
+                condition=models.Q(media_file__isnull=False),
+                name='unique_media_daily_visitor',
+            ),
+        ]
+
+class AlbumRanking(models.Model):
+    """
+    Position of a public album in the discovery feed.
+
+    The table is rebuilt as a whole by ``albums.feed.refresh_ranking``
+    (``refresh_album_feed`` command); requests only read it.
+    """
+    album = models.OneToOneField(Album, on_delete=models.CASCADE, primary_key=True, related_name='ranking')
+    rank = models.PositiveIntegerField(unique=True)
+    score = models.FloatField(default=0)
+    # Просмотры альбома и его файлов за окно ранжирования, без затухания
+    recent_views = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'#{self.rank} {self.album_id}'
+
+class UserAgent(models.Model):
+    """Pre-parsed user-agent string, keyed by the SHA-256 of the raw string."""
+    hash = models.CharField(max_length=64, unique=True)
+    string = models.TextField()
+    browser_family = models.CharField(max_length=100, blank=True)
+    browser_version = models.CharField(max_length=50, blank=True)
+    os_family = models.CharField(max_length=100, blank=True)
+    os_version = models.CharField(max_length=50, blank=True)
+    device_family = models.CharField(max_length=100, blank=True)
+    device_brand = models.CharField(max_length=50, blank=True)
+    device_model = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.string[:100]
 
 class ActivityLog(models.Model):
     ACTION_TYPES = (
@@ -59,7 +330,8 @@ class ActivityLog(models.Model):
     action = models.CharField(max_length=20, choices=ACTION_TYPES)
     timestamp = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField()
-    user_agent = models.TextField()
+    # Строка User-Agent и разобранные поля хранятся один раз в UserAgent
+    user_agent = models.ForeignKey(UserAgent, on_delete=models.PROTECT, null=True, blank=True, related_name='activity_logs')
     referrer = models.URLField(blank=True, null=True)
     album = models.ForeignKey(Album, on_delete=models.SET_NULL, null=True, blank=True)
     media_file = models.ForeignKey(MediaFile, on_delete=models.SET_NULL, null=True, blank=True)
@@ -69,15 +341,8 @@ class ActivityLog(models.Model):
     object_id = models.UUIDField(null=True, blank=True)
     content_object = GenericForeignKey('content_type', 'object_id')
     content_url = models.URLField(blank=True, null=True, help_text='URL на контент (альбом или файл)')
-    
-    # Дополнительная техническая информация
-    browser_family = models.CharField(max_length=100, blank=True)
-    browser_version = models.CharField(max_length=50, blank=True)
-    os_family = models.CharField(max_length=100, blank=True)
-    os_version = models.CharField(max_length=50, blank=True)
-    device_family = models.CharField(max_length=100, blank=True)
-    device_brand = models.CharField(max_length=50, blank=True)
-    device_model = models.CharField(max_length=50, blank=True)
+    # Количество объектов в событии (например, файлов в пакетной загрузке)
+    item_count = models.PositiveIntegerField(default=1)
     
     class Meta:
         indexes = [
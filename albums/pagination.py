@@ -0,0 +1,145 @@
+"""
+Keyset (cursor) pagination for album media.
+
+Pages are ordered by ``(sort key, id)``; the cursor encodes the last row
+of the previous page, so fetching any page costs one indexed range scan
+no matter how deep into the album it is.  Two orderings are available:
+``'uploaded'`` (upload time) and ``'taken'`` (EXIF capture time, falling
+back to upload time for files without it).
+
+Album lists use the same cursors over ``(created_at, id)``, newest first.
+The public feed is ordered by the precomputed unique ``rank``, so its
+cursor is simply the last rank shown.
+"""
+import base64
+import uuid
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+
+SORT_KEYS = {
+    'uploaded': F('uploaded_at'),
+    'taken': Coalesce('taken_at', 'uploaded_at'),
+}
+DEFAULT_SORT = 'uploaded'
+
+
+def get_media_page_size():
+    return getattr(settings, 'MEDIA_PAGE_SIZE', 30)
+
+
+def get_album_page_size():
+    return getattr(settings, 'ALBUM_LIST_PAGE_SIZE', 24)
+
+
+def _encode(sort_key, pk):
+    raw = f'{sort_key.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def encode_cursor(media_file):
+    return _encode(media_file.sort_key, media_file.id)
+
+
+def encode_album_cursor(album):
+    return _encode(album.created_at, album.id)
+
+
+def decode_cursor(cursor):
+    """Return ``(sort_key, id)`` or raise ``ValueError`` for a malformed cursor."""
+    # binascii.Error и UnicodeDecodeError — подклассы ValueError
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_key, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        timestamp = parse_datetime(sort_key)
+        pk = uuid.UUID(pk)
+    except TypeError as exc:
+        raise ValueError('Invalid cursor') from exc
+    if timestamp is None:
+        raise ValueError('Invalid cursor')
+    return timestamp, pk
+
+
+def _page_queryset(queryset, cursor, page_size, sort):
+    if sort not in SORT_KEYS:
+        raise ValueError(f'Unknown sort: {sort!r}')
+    queryset = queryset.annotate(sort_key=SORT_KEYS[sort]).order_by('sort_key', 'id')
+    if cursor:
+        sort_key, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(sort_key__gt=sort_key) | Q(sort_key=sort_key, id__gt=pk)
+        )
+    # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+    return queryset[:page_size + 1]
+
+
+def paginate_media(queryset, cursor=None, page_size=None, sort=DEFAULT_SORT):
+    """
+    Return ``(media_files, next_cursor)`` for the page after ``cursor``.
+
+    ``next_cursor`` is ``None`` on the last page.
+    """
+    page_size = page_size or get_media_page_size()
+    media_files = list(_page_queryset(queryset, cursor, page_size, sort))
+    return _split_page(media_files, page_size, encode_cursor)
+
+
+async def apaginate_media(queryset, cursor=None, page_size=None, sort=DEFAULT_SORT):
+    page_size = page_size or get_media_page_size()
+    media_files = [media_file async for media_file in _page_queryset(queryset, cursor, page_size, sort)]
+    return _split_page(media_files, page_size, encode_cursor)
+
+
+def _album_page_queryset(queryset, cursor, page_size):
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+    return queryset[:page_size + 1]
+
+
+def paginate_albums(queryset, cursor=None, page_size=None):
+    """Return ``(albums, next_cursor)``, newest albums first."""
+    page_size = page_size or get_album_page_size()
+    albums = list(_album_page_queryset(queryset, cursor, page_size))
+    return _split_page(albums, page_size, encode_album_cursor)
+
+
+async def apaginate_albums(queryset, cursor=None, page_size=None):
+    page_size = page_size or get_album_page_size()
+    albums = [album async for album in _album_page_queryset(queryset, cursor, page_size)]
+    return _split_page(albums, page_size, encode_album_cursor)
+
+
+def _split_page(items, page_size, encode):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode(items[-1])
+    return items, next_cursor
+
+
+def decode_rank_cursor(cursor):
+    """Return the rank in a feed cursor or raise ``ValueError``."""
+    rank = int(cursor)
+    if rank < 1:
+        raise ValueError('Invalid cursor')
+    return rank
+
+
+def _ranked_page_queryset(queryset, cursor, page_size):
+    queryset = queryset.order_by('ranking__rank')
+    if cursor:
+        queryset = queryset.filter(ranking__rank__gt=decode_rank_cursor(cursor))
+    return queryset[:page_size + 1]
+
+
+async def apaginate_ranked(queryset, cursor=None, page_size=None):
+    """Return ``(albums, next_cursor)`` of an Album queryset in feed order."""
+    page_size = page_size or get_album_page_size()
+    albums = [album async for album in _ranked_page_queryset(queryset, cursor, page_size)]
+    return _split_page(albums, page_size, lambda album: str(album.ranking.rank))
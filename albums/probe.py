@@ -0,0 +1,298 @@
+"""
+Content-based file type detection and cheap metadata extraction.
+
+Only file headers are read: the type comes from the magic bytes in the
+first ``SNIFF_SIZE`` bytes, image size and EXIF from Pillow's lazy header
+parsing, and video duration/size from the MP4/QuickTime box tree (walked
+with seeks, so ``mdat`` is never read) or the AVI main header.
+"""
+import os
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError, features
+
+SNIFF_SIZE = 8 * 1024
+
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'}
+MP4_BRANDS = {
+    b'isom', b'iso2', b'iso3', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'avc1',
+    b'M4V ', b'M4VH', b'M4VP', b'dash', b'MSNV',
+}
+THREE_GP_BRANDS = {b'3gp4', b'3gp5', b'3gp6', b'3gp7', b'3g2a'}
+# Бренды ftyp, которые принимаются; остальные файлы ISO-BMFF отклоняются
+FTYP_TYPES = {
+    **{brand: ('image', 'image/heic') for brand in HEIF_BRANDS},
+    b'avif': ('image', 'image/avif'),
+    b'avis': ('image', 'image/avif'),
+    b'qt  ': ('video', 'video/quicktime'),
+    **{brand: ('video', 'video/mp4') for brand in MP4_BRANDS},
+    **{brand: ('video', 'video/3gpp') for brand in THREE_GP_BRANDS},
+}
+# Размеры заголовка DIB: BITMAPCOREHEADER, OS/2 v2, BITMAPINFOHEADER … BITMAPV5HEADER
+BMP_DIB_HEADER_SIZES = {12, 16, 40, 52, 56, 64, 108, 124}
+QUICKTIME_ATOMS = {b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+
+EXIF_IFD = 0x8769
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_OFFSET_TIME_ORIGINAL = 0x9011
+
+# Кодеки, которые в сборке Pillow могут отсутствовать
+PILLOW_CODEC_FEATURES = {'image/webp': 'webp', 'image/avif': 'avif'}
+
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=dt_timezone.utc)
+MAX_BOXES = 512
+
+
+def _ftyp_type(header):
+    """Type for the major brand or, failing that, the first known compatible brand."""
+    box_size = struct.unpack('>I', header[:4])[0]
+    end = min(box_size, len(header)) if box_size >= 16 else 12
+    brands = [header[8:12]] + [header[pos:pos + 4] for pos in range(16, end - 3, 4)]
+    for brand in brands:
+        if brand in FTYP_TYPES:
+            return FTYP_TYPES[brand]
+    return '', ''
+
+
+def _is_bmp(header, size):
+    if header[:2] != b'BM' or len(header) < 18:
+        return False
+    file_size, _, pixel_offset, dib_size = struct.unpack('<IIII', header[2:18])
+    if dib_size not in BMP_DIB_HEADER_SIZES or pixel_offset < 14 + dib_size:
+        return False
+    if size is None:
+        return file_size >= pixel_offset
+    return file_size == size and pixel_offset < size
+
+
+def sniff(header, size=None):
+    """
+    Return ``(file_type, mime_type)`` for the leading bytes of a file, or
+    ``('', '')``.  ``size`` (the full file size) tightens the BMP check.
+    """
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image', 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image', 'image/png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image', 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image', 'image/webp'
+    if header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+        return 'video', 'video/x-msvideo'
+    if header[4:8] == b'ftyp' and len(header) >= 12:
+        return _ftyp_type(header)
+    if header[4:8] in QUICKTIME_ATOMS:
+        return 'video', 'video/quicktime'
+    if header.startswith(b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'):
+        return 'video', 'video/x-ms-wmv'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video', 'video/webm' if b'webm' in header[:64] else 'video/x-matroska'
+    if _is_bmp(header, size):
+        return 'image', 'image/bmp'
+    return '', ''
+
+
+def _read_header(fileobj):
+    fileobj.seek(0)
+    header = fileobj.read(SNIFF_SIZE)
+    fileobj.seek(0)
+    return header
+
+
+def _file_size(fileobj):
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+def _iter_boxes(fileobj, start, end):
+    """Yield ``(type, payload_start, box_end)`` for ISO-BMFF boxes in a range."""
+    pos = start
+    for _ in range(MAX_BOXES):
+        if pos + 8 > end:
+            return
+        fileobj.seek(pos)
+        header = fileobj.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', fileobj.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            return
+        yield kind, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _find_box(fileobj, start, end, kind):
+    for box_kind, payload, box_end in _iter_boxes(fileobj, start, end):
+        if box_kind == kind:
+            return payload, box_end
+    return None
+
+
+def _probe_mp4(fileobj, size):
+    meta = {}
+    moov = _find_box(fileobj, 0, size, b'moov')
+    if moov is None:
+        return meta
+
+    mvhd = _find_box(fileobj, *moov, b'mvhd')
+    if mvhd is not None:
+        fileobj.seek(mvhd[0])
+        version = fileobj.read(4)[0]
+        if version == 1:
+            created, _, timescale, duration = struct.unpack('>QQIQ', fileobj.read(28))
+        else:
+            created, _, timescale, duration = struct.unpack('>IIII', fileobj.read(16))
+        if timescale:
+            meta['duration'] = duration / timescale
+        if created:
+            meta['taken_at'] = MP4_EPOCH + timedelta(seconds=created)
+
+    for kind, payload, box_end in _iter_boxes(fileobj, *moov):
+        if kind != b'trak':
+            continue
+        tkhd = _find_box(fileobj, payload, box_end, b'tkhd')
+        if tkhd is None:
+            continue
+        fileobj.seek(tkhd[0])
+        version = fileobj.read(4)[0]
+        # Ширина и высота — последние 8 байт tkhd в формате 16.16
+        fileobj.seek(tkhd[0] + (88 if version == 1 else 76))
+        width, height = struct.unpack('>II', fileobj.read(8))
+        if width and height:
+            meta['width'], meta['height'] = width >> 16, height >> 16
+            break
+    return meta
+
+
+def _probe_heif(fileobj, size):
+    meta_box = _find_box(fileobj, 0, size, b'meta')
+    if meta_box is None:
+        return {}
+    # meta — FullBox: после заголовка идут 4 байта version/flags
+    iprp = _find_box(fileobj, meta_box[0] + 4, meta_box[1], b'iprp')
+    ipco = iprp and _find_box(fileobj, *iprp, b'ipco')
+    if not ipco:
+        return {}
+    best = (0, 0)
+    for kind, payload, _ in _iter_boxes(fileobj, *ipco):
+        if kind == b'ispe':
+            fileobj.seek(payload + 4)
+            width, height = struct.unpack('>II', fileobj.read(8))
+            if width * height > best[0] * best[1]:
+                best = (width, height)
+    return {'width': best[0], 'height': best[1]} if best[0] else {}
+
+
+def _probe_avi(header):
+    pos = header.find(b'avih')
+    if pos < 0 or len(header) < pos + 48:
+        return {}
+    usec_per_frame, _, _, _, total_frames, _, _, _, width, height = struct.unpack(
+        '<10I', header[pos + 8:pos + 48]
+    )
+    meta = {'width': width, 'height': height}
+    if usec_per_frame and total_frames:
+        meta['duration'] = usec_per_frame * total_frames / 1_000_000
+    return meta
+
+
+def _parse_exif_datetime(value, offset=None):
+    try:
+        taken_at = datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    if offset:
+        try:
+            return datetime.strptime(f'{taken_at:%Y-%m-%d %H:%M:%S}{offset}', '%Y-%m-%d %H:%M:%S%z')
+        except ValueError:
+            pass
+    return timezone.make_aware(taken_at)
+
+
+def _probe_image(fileobj):
+    meta = {}
+    try:
+        # Image.open читает только заголовок; пиксели не декодируются.
+        # getexif() не годится: у PNG без eXIf в заголовке он вызывает load()
+        with Image.open(fileobj) as image:
+            width, height = image.size
+            exif = Image.Exif()
+            if image.info.get('exif'):
+                exif.load(image.info['exif'])
+    except (UnidentifiedImageError, OSError, SyntaxError, struct.error):
+        return meta
+
+    if exif.get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+        width, height = height, width
+    meta['width'], meta['height'] = width, height
+
+    exif_ifd = exif.get_ifd(EXIF_IFD)
+    taken_at = _parse_exif_datetime(
+        exif_ifd.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME) or '',
+        exif_ifd.get(EXIF_OFFSET_TIME_ORIGINAL),
+    )
+    if taken_at:
+        meta['taken_at'] = taken_at
+    return meta
+
+
+def pillow_can_decode(mime_type):
+    """Whether this Pillow build opens ``mime_type`` (HEIC needs a plugin)."""
+    Image.init()
+    if mime_type not in Image.MIME.values():
+        return False
+    feature = PILLOW_CODEC_FEATURES.get(mime_type)
+    return feature is None or features.check(feature)
+
+
+def probe_file(fileobj):
+    """
+    Inspect an open binary file and return a dict with ``file_type``,
+    ``mime_type``, ``file_size`` and, when available, ``width``,
+    ``height``, ``duration`` and ``taken_at``.
+    """
+    header = _read_header(fileobj)
+    size = _file_size(fileobj)
+    file_type, mime_type = sniff(header, size)
+    result = {'file_type': file_type, 'mime_type': mime_type, 'file_size': size}
+
+    try:
+        if mime_type in ('video/mp4', 'video/3gpp', 'video/quicktime'):
+            result.update(_probe_mp4(fileobj, size))
+        elif mime_type in ('image/heic', 'image/avif'):
+            result.update(_probe_heif(fileobj, size))
+        elif mime_type == 'video/x-msvideo':
+            result.update(_probe_avi(header))
+        elif file_type == 'image':
+            result.update(_probe_image(fileobj))
+    except (struct.error, IndexError, OverflowError, ValueError):
+        # Повреждённый заголовок: тип известен, метаданных нет
+        pass
+    finally:
+        fileobj.seek(0)
+    return result
+
+
+def apply_probe(media_file, result):
+    """Copy probe results onto a (possibly unsaved) MediaFile."""
+    media_file.file_type = result['file_type']
+    media_file.mime_type = result['mime_type']
+    media_file.file_size = result['file_size']
+    media_file.width = result.get('width')
+    media_file.height = result.get('height')
+    media_file.duration = result.get('duration')
+    media_file.taken_at = result.get('taken_at')
+    return media_file
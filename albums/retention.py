@@ -0,0 +1,247 @@
+"""
+Retention and archival of ActivityLog rows.
+
+Rows older than the retention period of their action
+(``ACTIVITY_LOG_RETENTION_DAYS``) are written to compressed JSON-lines
+archives under ``ACTIVITY_LOG_ARCHIVE_DIR`` and then deleted, one batch
+per transaction.  Archives are partitioned by month of the entries they
+hold (``2024/05/activity-2024-05-<run>.jsonl.gz``), so the files double
+as a time-partitioned cold store.  A batch is deleted only after it has
+been flushed to disk.  ``import_archive`` loads an archive back for
+investigation.
+
+Daily statistics (``AlbumDailyStats``) are not touched: they keep the
+history the raw rows no longer have, so do not run
+``rebuild_album_stats`` over a period that has been archived.
+"""
+import gzip
+import io
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ActivityLog, Album, MediaFile
+from .uacache import get_user_agent_cache
+
+DEFAULT_RETENTION_DAYS = {'default': 365}
+
+COMPRESSIONS = {
+    'gzip': '.jsonl.gz',
+    'zstd': '.jsonl.zst',
+    'none': '.jsonl',
+}
+
+# Колонки таблицы (attname: user_id, album_id, ...), которые попадают в архив;
+# вместе с ними сохраняется строка User-Agent, а не только id измерения
+ARCHIVE_FIELDS = [field.attname for field in ActivityLog._meta.concrete_fields]
+ARCHIVE_EXTRA = {'user_agent_string': F('user_agent__string')}
+
+
+def get_retention_days():
+    return {**DEFAULT_RETENTION_DAYS, **getattr(settings, 'ACTIVITY_LOG_RETENTION_DAYS', {})}
+
+
+def get_archive_dir():
+    return Path(getattr(settings, 'ACTIVITY_LOG_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def get_cutoffs(now=None):
+    """
+    Return ``{action: cutoff}`` for every action type; ``None`` as the
+    retention keeps the action forever.
+    """
+    now = now or timezone.now()
+    retention = get_retention_days()
+    cutoffs = {}
+    for action, _ in ActivityLog.ACTION_TYPES:
+        days = retention.get(action, retention['default'])
+        cutoffs[action] = None if days is None else now - timedelta(days=days)
+    return cutoffs
+
+
+def serialize_entry(values):
+    """One archive line for a dict of ActivityLog column values."""
+    return json.dumps(values, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def deserialize_entry(line):
+    """Unsaved ActivityLog for an archive line."""
+    values = json.loads(line)
+    entry = ActivityLog(**{
+        field.attname: field.to_python(values[field.attname])
+        for field in ActivityLog._meta.concrete_fields
+        if field.attname in values
+    })
+    if values.get('user_agent_string') is not None:
+        # id в архиве мог устареть — строка надёжнее
+        entry.user_agent_id = get_user_agent_cache().get_id(values['user_agent_string'])
+    return entry
+
+
+def open_archive(path, mode, compression=None):
+    """Open an archive for text I/O; the compression defaults to the file suffix."""
+    path = Path(path)
+    if compression is None:
+        compression = next(
+            (name for name, suffix in COMPRESSIONS.items() if path.name.endswith(suffix)), 'none'
+        )
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as exc:
+            raise ImproperlyConfigured('zstd archives require the zstandard package') from exc
+        raw = open(path, mode + 'b')
+        if mode in ('a', 'w'):
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    if compression == 'none':
+        return open(path, mode, encoding='utf-8')
+    raise ImproperlyConfigured(f'Unknown archive compression: {compression!r}')
+
+
+class ArchiveWriter:
+    """Month-partitioned archive files of one archival run."""
+
+    def __init__(self, directory, compression, run_id):
+        if compression not in COMPRESSIONS:
+            raise ImproperlyConfigured(f'Unknown archive compression: {compression!r}')
+        self.directory = Path(directory)
+        self.compression = compression
+        self.run_id = run_id
+        self.files = {}
+        self.paths = []
+
+    def _file(self, timestamp):
+        month = timezone.localtime(timestamp).strftime('%Y-%m')
+        if month not in self.files:
+            folder = self.directory / month[:4] / month[5:]
+            folder.mkdir(parents=True, exist_ok=True)
+            path = folder / f'activity-{month}-{self.run_id}{COMPRESSIONS[self.compression]}'
+            self.files[month] = open_archive(path, 'a', self.compression)
+            self.paths.append(path)
+        return self.files[month]
+
+    def write(self, rows):
+        for values in rows:
+            self._file(values['timestamp']).write(serialize_entry(values) + '\n')
+
+    def sync(self):
+        """Make everything written so far durable before its rows are deleted."""
+        for stream in self.files.values():
+            # flush() доходит до компрессора (sync flush у gzip и zstd)
+            stream.flush()
+            os.fsync(stream.buffer.fileno())
+
+    def close(self):
+        for stream in self.files.values():
+            stream.close()
+        self.files = {}
+
+
+def expired_entries(now=None):
+    """Queryset of ActivityLog rows past their retention period."""
+    condition = Q()
+    for action, cutoff in get_cutoffs(now).items():
+        if cutoff is not None:
+            condition |= Q(action=action, timestamp__lt=cutoff)
+    if not condition:
+        return ActivityLog.objects.none()
+    return ActivityLog.objects.filter(condition)
+
+
+def archive_expired(now=None, batch_size=1000, compression=None, directory=None, dry_run=False):
+    """
+    Move expired ActivityLog rows into archive files.
+
+    Rows are read with keyset pagination on ``(timestamp, id)`` per action
+    (served by the ``(action, timestamp)`` index) and deleted in
+    ``batch_size`` chunks, each in its own transaction.  Returns
+    ``(archived_count, archive_paths)``.
+    """
+    compression = compression or getattr(settings, 'ACTIVITY_LOG_ARCHIVE_COMPRESSION', 'gzip')
+    directory = directory or get_archive_dir()
+    now = now or timezone.now()
+
+    if dry_run:
+        return expired_entries(now).count(), []
+
+    writer = ArchiveWriter(directory, compression, now.strftime('%Y%m%dT%H%M%S'))
+    archived = 0
+    try:
+        for action, cutoff in get_cutoffs(now).items():
+            if cutoff is None:
+                continue
+            rows = ActivityLog.objects.filter(action=action, timestamp__lt=cutoff).order_by('timestamp', 'id')
+            last = None
+            while True:
+                page = rows
+                if last is not None:
+                    page = rows.filter(Q(timestamp__gt=last[0]) | Q(timestamp=last[0], id__gt=last[1]))
+                batch = list(page.values(*ARCHIVE_FIELDS, **ARCHIVE_EXTRA)[:batch_size])
+                if not batch:
+                    break
+                writer.write(batch)
+                writer.sync()
+                with transaction.atomic():
+                    ActivityLog.objects.filter(id__in=[values['id'] for values in batch]).delete()
+                archived += len(batch)
+                last = (batch[-1]['timestamp'], batch[-1]['id'])
+    finally:
+        writer.close()
+    return archived, writer.paths
+
+
+def _existing(model, ids):
+    ids = {pk for pk in ids if pk is not None}
+    return set(model.objects.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+
+
+def _import_batch(batch):
+    # Связанные объекты могли быть удалены после архивации: ссылки на них обнуляются
+    related = {
+        'user_id': _existing(User, [entry.user_id for entry in batch]),
+        'album_id': _existing(Album, [entry.album_id for entry in batch]),
+        'media_file_id': _existing(MediaFile, [entry.media_file_id for entry in batch]),
+        'content_type_id': _existing(ContentType, [entry.content_type_id for entry in batch]),
+    }
+    for entry in batch:
+        for attname, existing in related.items():
+            if getattr(entry, attname) not in existing:
+                setattr(entry, attname, None)
+    ActivityLog.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def import_archive(path, batch_size=1000):
+    """
+    Load an archive back into ActivityLog (rows already present are skipped).
+    Imported rows do not update the daily statistics.  Returns the number
+    of lines read.
+    """
+    count = 0
+    batch = []
+    with open_archive(path, 'r') as stream:
+        for line in stream:
+            if not line.strip():
+                continue
+            batch.append(deserialize_entry(line))
+            count += 1
+            if len(batch) >= batch_size:
+                _import_batch(batch)
+                batch = []
+    if batch:
+        _import_batch(batch)
+    return count
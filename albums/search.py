@@ -0,0 +1,255 @@
+"""
+Search backend for the ActivityLog admin.
+
+On SQLite the free-text columns of every log row (action, IP, URL,
+referrer) get a document in an FTS5 table with the trigram tokenizer:
+substring matching, like the old ``icontains``, but from an index.
+Triggers on ``albums_activitylog`` keep it current for every write path,
+including ``bulk_create`` from the log sink and the retention deletes;
+the FTS rowid comes from a small mapping table, so removing a row is a
+rowid lookup rather than a scan of the index.  Usernames, album titles
+and user agents live in small tables, which are searched directly and
+joined through the indexed foreign keys.  The triggers deliberately do
+not read those tables: SQLite refuses to rebuild a table that a trigger
+elsewhere refers to, which would break later migrations of ``auth_user``
+and friends.
+
+A migration that rebuilds ``albums_activitylog`` itself on SQLite (e.g.
+``AlterField``) drops the triggers; ``rebuild_activity_search``
+recreates them together with the documents.  The trigram tokenizer needs
+SQLite 3.34; with an older library, or before the index has been built,
+the own columns are searched with ``icontains`` as on other backends.
+
+On PostgreSQL the same columns are searched with ``icontains`` backed by
+``pg_trgm`` GIN indexes.  Terms that look like an IP address or equal an
+existing username take exact-match paths on the regular indexes first.
+"""
+import ipaddress
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+
+from .models import Album, UserAgent
+
+FTS_TABLE = 'albums_activitylog_fts'
+FTS_MAP_TABLE = 'albums_activitylog_fts_map'
+# Триграммный токенизатор не находит термы короче трёх символов
+FTS_MIN_TERM_LENGTH = 3
+# Токенизатор trigram появился в SQLite 3.34.0
+FTS_MIN_SQLITE_VERSION = (3, 34)
+
+# Текст документа для строки журнала ``{row}`` (NEW в триггерах); только
+# собственные колонки — другие таблицы в триггерах не упоминаются
+DOCUMENT_SQL = (
+    "{row}.action || ' ' || {row}.ip_address"
+    " || ' ' || coalesce({row}.content_url, '') || ' ' || coalesce({row}.referrer, '')"
+)
+
+SQLITE_SCHEMA = [
+    f"CREATE TABLE IF NOT EXISTS {FTS_MAP_TABLE} (id INTEGER PRIMARY KEY, log_id char(32) NOT NULL UNIQUE)",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(body, tokenize='trigram')",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS albums_activitylog_fts_insert AFTER INSERT ON albums_activitylog BEGIN
+        INSERT INTO {FTS_MAP_TABLE} (log_id) VALUES (NEW.id);
+        INSERT INTO {FTS_TABLE} (rowid, body)
+        VALUES ((SELECT id FROM {FTS_MAP_TABLE} WHERE log_id = NEW.id), {DOCUMENT_SQL.format(row='NEW')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS albums_activitylog_fts_update
+    AFTER UPDATE OF action, ip_address, content_url, referrer ON albums_activitylog BEGIN
+        UPDATE {FTS_TABLE} SET body = {DOCUMENT_SQL.format(row='NEW')}
+        WHERE rowid = (SELECT id FROM {FTS_MAP_TABLE} WHERE log_id = NEW.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS albums_activitylog_fts_delete AFTER DELETE ON albums_activitylog BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT id FROM {FTS_MAP_TABLE} WHERE log_id = OLD.id);
+        DELETE FROM {FTS_MAP_TABLE} WHERE log_id = OLD.id;
+    END
+    """,
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS albums_activitylog_fts_insert',
+    'DROP TRIGGER IF EXISTS albums_activitylog_fts_update',
+    'DROP TRIGGER IF EXISTS albums_activitylog_fts_delete',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+    f'DROP TABLE IF EXISTS {FTS_MAP_TABLE}',
+]
+
+# icontains в PostgreSQL сравнивает UPPER(col::text), поэтому индексы по выражению
+POSTGRES_SCHEMA = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS albums_activitylog_url_trgm ON albums_activitylog USING gin (UPPER(content_url::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS albums_useragent_string_trgm ON albums_useragent USING gin (UPPER(string::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS albums_album_title_trgm ON albums_album USING gin (UPPER(title::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS auth_user_username_trgm ON auth_user USING gin (UPPER(username::text) gin_trgm_ops)',
+]
+
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS albums_activitylog_url_trgm',
+    'DROP INDEX IF EXISTS albums_useragent_string_trgm',
+    'DROP INDEX IF EXISTS albums_album_title_trgm',
+    'DROP INDEX IF EXISTS auth_user_username_trgm',
+]
+
+
+def create_search_index(schema_editor):
+    """Create the vendor's search structures (called from a migration)."""
+    statements = {'sqlite': SQLITE_SCHEMA, 'postgresql': POSTGRES_SCHEMA}.get(schema_editor.connection.vendor, [])
+    if schema_editor.connection.vendor == 'sqlite' and not fts_available(schema_editor.connection):
+        statements = []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(schema_editor):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def fts_available(connection=connection):
+    """Whether the SQLite library can build the trigram FTS5 index."""
+    return (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= FTS_MIN_SQLITE_VERSION
+    )
+
+
+def fts_index_exists():
+    """The index is missing if it was skipped at migration time (old SQLite) and never rebuilt."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def rebuild_search_index():
+    """
+    Recreate the FTS table, its triggers and every document from the
+    current rows; returns the number of indexed rows.
+    """
+    if not fts_available():
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for statement in SQLITE_DROP + SQLITE_SCHEMA:
+            cursor.execute(statement)
+        cursor.execute(f'INSERT INTO {FTS_MAP_TABLE} (log_id) SELECT id FROM albums_activitylog')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, body) '
+            f'SELECT m.id, {DOCUMENT_SQL.format(row="l")} '
+            f'FROM {FTS_MAP_TABLE} m JOIN albums_activitylog l ON l.id = m.log_id'
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_MAP_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def _fts_query(term):
+    # Терм — строка в кавычках: операторы FTS5 в запросе не работают
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def _parse_ip(term):
+    try:
+        return str(ipaddress.ip_address(term))
+    except ValueError:
+        return None
+
+
+def _own_columns_filter(term):
+    if len(term) >= FTS_MIN_TERM_LENGTH and fts_available() and fts_index_exists():
+        return Q(id__in=RawSQL(
+            f'SELECT m.log_id FROM {FTS_TABLE} f JOIN {FTS_MAP_TABLE} m ON m.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s',
+            [_fts_query(term)],
+        ))
+    return (
+        Q(action__icontains=term)
+        | Q(ip_address__icontains=term)
+        | Q(content_url__icontains=term)
+        | Q(referrer__icontains=term)
+    )
+
+
+def _term_filter(term):
+    """
+    Match one search term: the log's own columns through the full-text
+    index, related rows through subqueries on their (small) tables.
+    """
+    return (
+        _own_columns_filter(term)
+        | Q(user__in=User.objects.filter(username__icontains=term))
+        | Q(album__in=Album.objects.filter(title__icontains=term))
+        | Q(user_agent__in=UserAgent.objects.filter(
+            Q(string__icontains=term)
+            | Q(browser_family__icontains=term)
+            | Q(os_family__icontains=term)
+            | Q(device_family__icontains=term)
+            | Q(device_brand__icontains=term)
+            | Q(device_model__icontains=term)
+        ))
+    )
+
+
+def search_activity(queryset, search_term):
+    """Filter an ActivityLog queryset by an admin search string."""
+    search_term = search_term.strip()
+    if not search_term:
+        return queryset
+
+    ip = _parse_ip(search_term)
+    if ip is not None:
+        return queryset.filter(ip_address=ip)
+
+    user_id = User.objects.filter(username=search_term).values_list('id', flat=True).first()
+    if user_id is not None:
+        return queryset.filter(user_id=user_id)
+
+    for term in search_term.split():
+        queryset = queryset.filter(_term_filter(term))
+    return queryset
+
+
+def estimate_row_count(model):
+    """
+    Cheap estimate of a table's size, or ``None`` if the backend has none:
+    ``pg_class.reltuples`` on PostgreSQL, the rowid span on SQLite (exact
+    for an append-only table, an overestimate after deletes).
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT max(rowid) - min(rowid) + 1 FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for very large tables: the unfiltered count is estimated,
+    a filtered count stops at ``ACTIVITY_LOG_ADMIN_COUNT_LIMIT`` rows.
+    """
+
+    def _count_limit(self):
+        return getattr(settings, 'ACTIVITY_LOG_ADMIN_COUNT_LIMIT', 10000)
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = self._count_limit()
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
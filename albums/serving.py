@@ -0,0 +1,138 @@
+"""
+Access-checked serving of stored media files.
+
+Supports conditional GETs (ETag / Last-Modified) and single byte ranges,
+which browsers use to seek in videos.  With ``MEDIA_SENDFILE_BACKEND``
+set, only headers are produced and the front-end server sends the bytes:
+
+* ``'nginx'``  — ``X-Accel-Redirect: <MEDIA_ACCEL_REDIRECT_PREFIX><quoted name>``,
+  e.g. ``location /protected-media/ { internal; alias /srv/app/media/; }``
+* ``'apache'`` — ``X-Sendfile: <absolute path>`` (mod_xsendfile)
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single-range header.
+
+    Returns ``None`` when the header should be ignored (absent, malformed or
+    multi-range) and raises ``ValueError`` when the range is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N — последние N байт
+        length = int(last)
+        if length == 0:
+            raise ValueError('Unsatisfiable range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def _range_still_valid(request, etag, mtime):
+    # If-Range: диапазон отдаём, только если файл не изменился
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def _stream(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = source.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def serve_file(request, field_file, public=False, content_type=None):
+    """
+    Return a response with the contents of ``field_file``.  Pass
+    ``content_type`` when the stored name has no usable extension (blobs);
+    otherwise it is guessed from the name.
+    """
+    try:
+        path = field_file.path
+        stat = os.stat(path)
+    except (ValueError, FileNotFoundError):
+        raise Http404('File not found')
+
+    etag = file_etag(stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _build_response(request, field_file, path, stat, etag, content_type)
+
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(stat.st_mtime))
+    response['Accept-Ranges'] = 'bytes'
+    if public:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'MEDIA_PUBLIC_MAX_AGE', 86400))
+    else:
+        patch_cache_control(response, private=True, max_age=getattr(settings, 'MEDIA_PRIVATE_MAX_AGE', 3600))
+    return response
+
+
+def _build_response(request, field_file, path, stat, etag, content_type=None):
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    backend = getattr(settings, 'MEDIA_SENDFILE_BACKEND', None)
+
+    if backend == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        # Заголовок — URI: пробелы, «#», «?» и кириллица в имени кодируются
+        response['X-Accel-Redirect'] = prefix + quote(field_file.name)
+        return response
+    if backend == 'apache':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if _range_still_valid(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(_stream(path, start, length), status=206, content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -1,9 +1,53 @@
 from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
-from .utils import log_activity
+from .access import bump_access_version
+from .blobs import release_blob
+from .cache import bump_album_version
+from .feed import bump_feed_version
+from .models import Album, MediaFile, MediaRendition
+from .utils import clear_content_type_ids, log_activity, register_session_grants
 
 
 @receiver(user_logged_in)
 def log_user_login(sender, request, user, **kwargs):
     """Log user login event."""
     log_activity(request, 'login', user=user)
+    # login() меняет ключ сессии — переносим выданные доступы к альбомам
+    if request.session.session_key:
+        register_session_grants(request.session.session_key, request.session.keys())
+
+
+@receiver([post_save, post_delete], sender=Album)
+def invalidate_album_cache(sender, instance, **kwargs):
+    """Drop cached grid pages, access decisions and feed pages when the album itself changes."""
+    bump_album_version(instance.id)
+    bump_access_version(instance.id)
+    bump_feed_version()
+
+
+@receiver([post_save, post_delete], sender=MediaFile)
+def invalidate_album_cache_for_media(sender, instance, **kwargs):
+    """Drop cached grid pages when media is uploaded, edited or deleted."""
+    bump_album_version(instance.album_id)
+
+
+@receiver(post_delete, sender=MediaFile)
+def release_media_blob(sender, instance, **kwargs):
+    """The bytes stay until purge_deleted_media finds the blob unreferenced."""
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+
+
+@receiver([post_save, post_delete], sender=MediaRendition)
+def invalidate_album_cache_for_rendition(sender, instance, **kwargs):
+    """New renditions change the srcset of a card."""
+    album_id = MediaFile.objects.filter(id=instance.media_file_id).values_list('album_id', flat=True).first()
+    if album_id:
+        bump_album_version(album_id)
+
+
+@receiver(post_migrate)
+def reset_content_type_ids(sender, **kwargs):
+    """Content types may have been created or renumbered by the migration."""
+    clear_content_type_ids()
@@ -0,0 +1,227 @@
+"""
+Incremental maintenance of ``AlbumDailyStats`` from ActivityLog entries.
+
+The log sinks call ``record_entries`` with every batch they write, so the
+rollup stays current without anyone querying the raw log.
+``rebuild_stats`` recomputes it from ActivityLog (``rebuild_album_stats``
+management command) after a schema change or a bug.
+"""
+import ipaddress
+import logging
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from django.utils.ipv6 import clean_ipv6_address
+
+from .models import ActivityLog, AlbumDailyStats, AlbumDailyVisitor
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('views', 'media_views', 'uploads')
+TOTALS = {name: Coalesce(Sum(name), 0) for name in COUNTERS}
+
+
+def stats_enabled():
+    return getattr(settings, 'ACTIVITY_STATS_ENABLED', True)
+
+
+def normalize_ip(ip):
+    """
+    The form the ``ip_address`` column stores, so keys built in memory
+    match the rows read back (``2001:DB8:0::1`` is kept as ``2001:db8::1``).
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    if address.version == 6:
+        # Как GenericIPAddressField: IPv4-mapped адрес остаётся в точечной записи
+        return clean_ipv6_address(address.compressed)
+    return address.compressed
+
+
+def _collect(entries):
+    deltas = defaultdict(Counter)
+    visitors = set()
+    for entry in entries:
+        if not entry.album_id:
+            continue
+        day = timezone.localdate(entry.timestamp)
+        ip = normalize_ip(entry.ip_address)
+        album_key = (entry.album_id, None, day)
+        if entry.action == 'album_view':
+            deltas[album_key]['views'] += 1
+            visitors.add((*album_key, ip))
+        elif entry.action == 'media_view' and entry.media_file_id:
+            media_key = (entry.album_id, entry.media_file_id, day)
+            deltas[album_key]['media_views'] += 1
+            deltas[media_key]['views'] += 1
+            visitors.add((*album_key, ip))
+            visitors.add((*media_key, ip))
+        elif entry.action == 'media_upload':
+            deltas[album_key]['uploads'] += entry.item_count
+    return deltas, visitors
+
+
+def _visitor_count(album_id, media_id, day):
+    """Subquery counting the stored visitors of one stats row."""
+    visitors = AlbumDailyVisitor.objects.filter(
+        album_id=album_id, media_file_id=media_id, date=day,
+    ).order_by().values('album').annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(visitors, output_field=IntegerField()), 0)
+
+
+def record_entries(entries):
+    """Apply a batch of freshly written ActivityLog entries to the rollup."""
+    if not stats_enabled():
+        return
+    deltas, visitors = _collect(entries)
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        AlbumDailyVisitor.objects.bulk_create(
+            [
+                AlbumDailyVisitor(album_id=album_id, media_file_id=media_id, date=day, ip_address=ip)
+                for album_id, media_id, day, ip in visitors
+            ],
+            ignore_conflicts=True,
+        )
+        AlbumDailyStats.objects.bulk_create(
+            [
+                AlbumDailyStats(album_id=album_id, media_file_id=media_id, date=day)
+                for album_id, media_id, day in deltas
+            ],
+            ignore_conflicts=True,
+        )
+        visited = {(album_id, media_id, day) for album_id, media_id, day, _ in visitors}
+        for (album_id, media_id, day), delta in deltas.items():
+            changes = {name: F(name) + delta[name] for name in COUNTERS if delta[name]}
+            if (album_id, media_id, day) in visited:
+                # Пересчёт по сохранённым строкам, а не «новые в этой пачке»:
+                # параллельные пачки с тем же IP не посчитают его дважды
+                changes['unique_ips'] = _visitor_count(album_id, media_id, day)
+            AlbumDailyStats.objects.filter(
+                album_id=album_id,
+                media_file_id=media_id,
+                date=day,
+            ).update(**changes)
+
+
+def safe_record_entries(entries):
+    """``record_entries`` for the log sinks: a rollup failure must not lose the log."""
+    try:
+        record_entries(entries)
+    except Exception:
+        logger.exception('Failed to update album statistics for %d entries', len(entries))
+
+
+def album_totals_subquery(field):
+    """Subquery summing an album-level counter, for annotating Album querysets."""
+    totals = AlbumDailyStats.objects.filter(
+        album=OuterRef('pk'), media_file__isnull=True,
+    ).values('album').annotate(total=Sum(field)).values('total')
+    return Coalesce(Subquery(totals, output_field=IntegerField()), 0)
+
+
+def _totals_queryset(**filters):
+    return AlbumDailyStats.objects.filter(media_file__isnull=True, **filters)
+
+
+def album_totals(album_id):
+    """All-time album counters from the rollup (one aggregate query)."""
+    return _totals_queryset(album_id=album_id).aggregate(**TOTALS)
+
+
+def owner_totals(user):
+    """Counters summed over all albums of ``user``."""
+    return _totals_queryset(album__owner=user).aggregate(**TOTALS)
+
+
+async def aalbum_totals(album_id):
+    return await _totals_queryset(album_id=album_id).aaggregate(**TOTALS)
+
+
+async def aowner_totals(user):
+    return await _totals_queryset(album__owner=user).aaggregate(**TOTALS)
+
+
+async def aalbums_totals(user, album_ids):
+    """``{album_id: counters}`` for those of ``album_ids`` owned by ``user`` that have stats."""
+    rows = _totals_queryset(album__owner=user, album_id__in=album_ids).values('album_id').annotate(**TOTALS)
+    return {row.pop('album_id'): row async for row in rows}
+
+
+def rebuild_stats(album_id=None, chunk_size=5000):
+    """Recompute the rollup (for one album or all) from ActivityLog."""
+    logs = ActivityLog.objects.filter(album__isnull=False)
+    stats = AlbumDailyStats.objects.all()
+    visitors = AlbumDailyVisitor.objects.all()
+    if album_id:
+        logs = logs.filter(album_id=album_id)
+        stats = stats.filter(album_id=album_id)
+        visitors = visitors.filter(album_id=album_id)
+    logs = logs.annotate(day=TruncDate('timestamp'))
+
+    rows = defaultdict(Counter)
+    album_views = logs.filter(action='album_view').values('album_id', 'day').annotate(n=Count('id'))
+    for row in album_views.iterator():
+        rows[(row['album_id'], None, row['day'])]['views'] += row['n']
+
+    media_views = logs.filter(action='media_view', media_file__isnull=False)
+    for row in media_views.values('album_id', 'media_file_id', 'day').annotate(n=Count('id')).iterator():
+        rows[(row['album_id'], None, row['day'])]['media_views'] += row['n']
+        rows[(row['album_id'], row['media_file_id'], row['day'])]['views'] += row['n']
+
+    uploads = logs.filter(action='media_upload').values('album_id', 'day').annotate(n=Sum('item_count'))
+    for row in uploads.iterator():
+        rows[(row['album_id'], None, row['day'])]['uploads'] += row['n']
+
+    viewed = logs.filter(action__in=['album_view', 'media_view'])
+    with transaction.atomic():
+        stats.delete()
+        visitors.delete()
+
+        batch = []
+        seen = set()
+        seen_day = None
+        unique = Counter()
+        rows_by_day = viewed.values('album_id', 'media_file_id', 'action', 'day', 'ip_address').distinct().order_by('day')
+        for row in rows_by_day.iterator():
+            # Ключи посетителей содержат день: множество держим только для текущего дня
+            if row['day'] != seen_day:
+                seen.clear()
+                seen_day = row['day']
+            ip = normalize_ip(row['ip_address'])
+            keys = [(row['album_id'], None, row['day'])]
+            if row['action'] == 'media_view' and row['media_file_id']:
+                keys.append((row['album_id'], row['media_file_id'], row['day']))
+            for key in keys:
+                if (*key, ip) in seen:
+                    continue
+                seen.add((*key, ip))
+                unique[key] += 1
+                batch.append(AlbumDailyVisitor(
+                    album_id=key[0], media_file_id=key[1], date=key[2], ip_address=ip,
+                ))
+            if len(batch) >= chunk_size:
+                AlbumDailyVisitor.objects.bulk_create(batch)
+                batch = []
+        AlbumDailyVisitor.objects.bulk_create(batch)
+
+        AlbumDailyStats.objects.bulk_create(
+            [
+                AlbumDailyStats(
+                    album_id=album_id, media_file_id=media_id, date=day,
+                    unique_ips=unique[(album_id, media_id, day)],
+                    **{name: counters[name] for name in COUNTERS},
+                )
+                for (album_id, media_id, day), counters in rows.items()
+            ],
+            batch_size=chunk_size,
+        )
+    return len(rows)
@@ -1,3 +1,1756 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, PngImagePlugin
+
+from .access import check_album_access
+from .benchmark import find_regressions
+from .blobs import blob_name
+from .cache import get_cache
+from .export import EXPORT_COLUMNS, export_stream, filter_logs
+from .feed import refresh_ranking
+from .instrumentation import registry
+from .listing import annotate_album_cards
+from .logsink import QueuedLogSink, SyncLogSink, get_log_sink
+from .jobs import claim_jobs, complete_job, enqueue, jobs_for, release_stale_jobs, run_job
+from .middleware import ActivityLoggingMiddleware
+from .models import (
+    ActivityLog, Album, AlbumAccessGrant, AlbumDailyStats, AlbumDailyVisitor, AlbumRanking, Blob, ChunkedUpload,
+    MediaFile, MediaJob, MediaRendition, UserAgent,
+)
+from .pagination import paginate_media
+from .probe import MP4_EPOCH, pillow_can_decode, probe_file, sniff
+from .retention import archive_expired, import_archive
+from .search import FTS_TABLE, create_search_index, fts_available, search_activity
+from .serving import parse_range
+from .stats import rebuild_stats, record_entries
+from .thumbnails import generate_renditions
+from .uacache import UserAgentCache, get_user_agent_cache, parse_user_agent_string, user_agent_hash
+from .utils import clear_content_type_ids, log_activity
+
+
+@override_settings(ACTIVITY_LOG_SINK='sync')
+class AlbumsTestCase(TestCase):
+    """
+    Base for database tests: activity entries are saved inside the test
+    transaction and every test starts with empty process-wide caches.
+    """
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        # Кэш хранит id строк UserAgent, которые откатываются вместе с тестом
+        get_user_agent_cache().clear()
+        clear_content_type_ids()
+
+
+class RecordingSink(QueuedLogSink):
+    """Queued sink whose worker waits for ``release`` and records batches instead of saving."""
+
+    def __init__(self, **kwargs):
+        self.release = threading.Event()
+        self.batches = []
+        super().__init__(**kwargs)
+
+    def _run(self):
+        self.release.wait()
+        super()._run()
+
+    def _write_batch(self, batch):
+        self.batches.append(batch)
+        self._count('written', len(batch))
+        self._count('flushes')
+        self._done(len(batch))
+
+
+class QueuedLogSinkTests(SimpleTestCase):
+    """Batching, flush and the overflow policies of the queued sink."""
+
+    def make_sink(self, **kwargs):
+        sink = RecordingSink(**kwargs)
+        self.addCleanup(sink.shutdown, timeout=5)
+        self.addCleanup(sink.release.set)
+        return sink
+
+    def test_flush_writes_everything_in_batches(self):
+        sink = self.make_sink(batch_size=2, flush_interval_ms=50)
+        for _ in range(5):
+            sink.write(ActivityLog(action='login', ip_address='10.0.0.1'))
+        sink.release.set()
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual([len(batch) for batch in sink.batches], [2, 2, 1])
+        self.assertEqual((sink.stats['enqueued'], sink.stats['written']), (5, 5))
+
+    def test_drop_policy_discards_new_entries(self):
+        sink = self.make_sink(queue_size=2, overflow='drop')
+        for _ in range(3):
+            sink.write(ActivityLog(action='login', ip_address='10.0.0.1'))
+        self.assertEqual((sink.stats['enqueued'], sink.stats['dropped']), (2, 1))
+        sink.release.set()
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(sink.stats['written'], 2)
+
+    def test_block_policy_waits_for_a_slot(self):
+        sink = self.make_sink(queue_size=1, overflow='block')
+        sink.write(ActivityLog(action='login', ip_address='10.0.0.1'))
+        writer = threading.Thread(target=sink.write, args=[ActivityLog(action='logout', ip_address='10.0.0.1')])
+        writer.start()
+        writer.join(timeout=0.2)
+        self.assertTrue(writer.is_alive())
+        self.assertEqual(sink.stats['blocked'], 1)
+
+        sink.release.set()
+        writer.join(timeout=5)
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(sink.stats['written'], 2)
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            QueuedLogSink(overflow='spill')
+
+
+class SyncLogSinkTests(AlbumsTestCase):
+    """The sink is chosen by ACTIVITY_LOG_SINK and rebuilt when it changes."""
+
+    def test_log_activity_saves_on_the_calling_thread(self):
+        self.assertIsInstance(get_log_sink(), SyncLogSink)
+        entry = log_activity(RequestFactory().get('/'), 'login')
+        self.assertTrue(ActivityLog.objects.filter(pk=entry.pk, action='login').exists())
+
+    @override_settings(ACTIVITY_LOG_SINK='queued')
+    def test_sink_follows_the_setting(self):
+        self.assertIsInstance(get_log_sink(), QueuedLogSink)
+
+
+def use_temporary_media_root(test):
+    """Point MEDIA_ROOT at a directory removed after ``test``."""
+    media_root = tempfile.TemporaryDirectory()
+    test.addCleanup(media_root.cleanup)
+    media_settings = override_settings(MEDIA_ROOT=media_root.name)
+    media_settings.enable()
+    test.addCleanup(media_settings.disable)
+
+
+def image_bytes(size, image_format='JPEG', color='navy'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def ftyp(major, *compatible):
+    return box(b'ftyp', major + b'\0\0\0\0' + b''.join(compatible))
+
+
+def bmp_header(file_size, dib_size=40, pixel_offset=54):
+    return b'BM' + struct.pack('<IIII', file_size, 0, pixel_offset, dib_size) + bytes(36)
+
+
+class UserAgentCacheTests(AlbumsTestCase):
+    """LRU eviction, hit/miss counters and the UserAgent dimension rows."""
+
+    firefox = 'Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0'
+    chrome = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36'
+    safari = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1'
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = UserAgentCache(maxsize=2)
+        cache.get(self.firefox)
+        cache.get(self.chrome)
+        cache.get(self.firefox)
+        # Chrome использовался давнее всех и вытесняется
+        cache.get(self.safari)
+        cache.get(self.firefox)
+        cache.get(self.chrome)
+        info = cache.info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (2, 4, 2))
+
+    def test_hit_returns_a_copy_of_the_parsed_fields(self):
+        cache = UserAgentCache()
+        first = cache.get(self.firefox)
+        first['browser_family'] = 'changed'
+        self.assertEqual(cache.get(self.firefox)['browser_family'], 'Firefox')
+
+    def test_stats_can_be_disabled(self):
+        cache = UserAgentCache(track_stats=False)
+        cache.get(self.firefox)
+        cache.get(self.firefox)
+        info = cache.info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (0, 0, 1))
+
+    def test_rows_survive_a_new_instance(self):
+        user_agent_id = UserAgentCache().get_id(self.firefox)
+        self.assertEqual(UserAgent.objects.get(hash=user_agent_hash(self.firefox)).id, user_agent_id)
+
+        cache = UserAgentCache()
+        with mock.patch('albums.uacache.parse_user_agent_string') as parse:
+            info = cache.get(self.firefox)
+        parse.assert_not_called()
+        self.assertEqual((info['id'], info['browser_family']), (user_agent_id, 'Firefox'))
+        self.assertEqual(cache.info()['db_hits'], 1)
+
+    def test_row_saved_by_a_concurrent_request(self):
+        def parse_while_another_request_saves(user_agent_string):
+            info = parse_user_agent_string(user_agent_string)
+            UserAgent.objects.create(hash=user_agent_hash(user_agent_string), string=user_agent_string, **info)
+            return info
+
+        cache = UserAgentCache()
+        with mock.patch('albums.uacache.parse_user_agent_string', side_effect=parse_while_another_request_saves):
+            info = cache.get(self.chrome)
+        self.assertEqual(info['browser_family'], 'Chrome')
+        self.assertEqual(info['id'], UserAgent.objects.get().id)
+
+    def test_deleted_row_is_discarded(self):
+        cache = get_user_agent_cache()
+        first_id = cache.get_id(self.firefox)
+        UserAgent.objects.filter(id=first_id).delete()
+        self.assertNotEqual(cache.get_id(self.firefox), first_id)
+
+    def test_log_activity_stores_parsed_fields(self):
+        entry = log_activity(RequestFactory(HTTP_USER_AGENT=self.safari).get('/'), 'login')
+        entry = ActivityLog.objects.select_related('user_agent').get(pk=entry.pk)
+        self.assertEqual((entry.user_agent.os_family, entry.user_agent.device_brand), ('iOS', 'Apple'))
+        self.assertEqual(entry.user_agent.string, self.safari)
+
+
+class AlbumAccessGrantTests(AlbumsTestCase):
+    """View-password grants are recorded per session and revoked without a session scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.guest = User.objects.create_user('guest', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, view_password='letmein')
+
+    def enter_password(self, client):
+        response = client.post(reverse('album_access', args=[self.album.id]), {'password': 'letmein'})
+        self.assertRedirects(response, reverse('album_detail', args=[self.album.id]), fetch_redirect_response=False)
+
+    def test_password_records_a_grant(self):
+        self.enter_password(self.client)
+        self.assertTrue(AlbumAccessGrant.objects.filter(
+            album=self.album, session_key=self.client.session.session_key,
+        ).exists())
+
+    def test_login_moves_grants_to_the_new_session_key(self):
+        self.enter_password(self.client)
+        anonymous_key = self.client.session.session_key
+        self.client.post(reverse('login'), {'username': 'guest', 'password': 'secret'})
+        session_key = self.client.session.session_key
+        self.assertNotEqual(session_key, anonymous_key)
+        self.assertTrue(AlbumAccessGrant.objects.filter(album=self.album, session_key=session_key).exists())
+
+    def test_password_change_revokes_other_sessions(self):
+        self.enter_password(self.client)
+        guest_key = self.client.session.session_key
+
+        owner = self.client_class()
+        owner.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        owner.post(reverse('edit_album', args=[self.album.id]), {'title': 'Album', 'view_password': 'changed'})
+        self.assertFalse(Session.objects.filter(session_key=guest_key).exists())
+        self.assertFalse(AlbumAccessGrant.objects.filter(album=self.album).exists())
+
+    def test_backfill_from_existing_sessions(self):
+        session = SessionStore()
+        session[f'album_view_{self.album.id}'] = True
+        # Ключ удалённого альбома пропускается
+        session['album_access_00000000-0000-0000-0000-000000000000'] = True
+        session.create()
+        AlbumAccessGrant.objects.create(album=self.album, session_key='expired-session')
+
+        call_command('backfill_album_access', '--prune', stdout=io.StringIO())
+        self.assertEqual(
+            list(AlbumAccessGrant.objects.values_list('session_key', flat=True)),
+            [session.session_key],
+        )
+
+
+@override_settings(MEDIA_PAGE_SIZE=2)
+class MediaPaginationTests(AlbumsTestCase):
+    """Album media is served in keyset pages ordered by (uploaded_at, id)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+        MediaFile.objects.bulk_create(
+            MediaFile(album=cls.album, file=f'media/{i}.jpg', file_type='image') for i in range(5)
+        )
+        # Одинаковое время загрузки у нескольких файлов: порядок решает id
+        now = timezone.now()
+        media = list(MediaFile.objects.order_by('id'))
+        for index, media_file in enumerate(media):
+            media_file.uploaded_at = now + timedelta(seconds=index // 2)
+        MediaFile.objects.bulk_update(media, ['uploaded_at'])
+        cls.expected = [
+            media_file.id for media_file in sorted(media, key=lambda media_file: (media_file.uploaded_at, media_file.id))
+        ]
+
+    def test_pages_cover_every_file_once(self):
+        seen = []
+        cursor = None
+        while True:
+            media_files, cursor = paginate_media(self.album.media_files.all(), cursor=cursor)
+            seen += [media_file.id for media_file in media_files]
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_album_detail_renders_the_first_page(self):
+        response = self.client.get(reverse('album_detail', args=[self.album.id]))
+        self.assertEqual([media_file.id for media_file in response.context['media_files']], self.expected[:2])
+        self.assertIsNotNone(response.context['next_cursor'])
+
+    def test_media_page_endpoint_continues_from_the_cursor(self):
+        first = self.client.get(reverse('album_detail', args=[self.album.id]))
+        response = self.client.get(
+            reverse('album_media_page', args=[self.album.id]), {'cursor': first.context['next_cursor']},
+        )
+        data = response.json()
+        self.assertIn(str(self.expected[2]), data['html'])
+        self.assertNotIn(str(self.expected[1]), data['html'])
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_malformed_cursor_is_not_found(self):
+        response = self.client.get(reverse('album_media_page', args=[self.album.id]), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_protected_album_page_is_forbidden(self):
+        album = Album.objects.create(title='Private', owner=self.owner, view_password='letmein')
+        response = self.client.get(reverse('album_media_page', args=[album.id]))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(MEDIA_RENDITION_WIDTHS=(320, 1024), MEDIA_RENDITION_FORMATS=('webp', 'jpeg'))
+class RenditionTests(AlbumsTestCase):
+    """Renditions are downscaled per configured width and format and feed the srcset."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+
+    def add_image(self, size):
+        media_file = MediaFile(album=self.album, file_type='image')
+        media_file.file.save('photo.jpg', ContentFile(image_bytes(size)), save=False)
+        media_file.save()
+        return media_file
+
+    def test_one_rendition_per_width_and_format(self):
+        media_file = self.add_image((2000, 1000))
+        generate_renditions(media_file)
+        self.assertEqual(
+            sorted(media_file.renditions.values_list('width', 'height', 'format')),
+            [(320, 160, 'jpeg'), (320, 160, 'webp'), (1024, 512, 'jpeg'), (1024, 512, 'webp')],
+        )
+        rendition = media_file.renditions.get(width=320, format='webp')
+        with rendition.file.open('rb') as stored, Image.open(stored) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+
+    def test_small_images_are_not_upscaled(self):
+        media_file = self.add_image((200, 100))
+        generate_renditions(media_file)
+        self.assertEqual(sorted(media_file.renditions.values_list('width', 'format')), [(200, 'jpeg'), (200, 'webp')])
+
+    def test_generation_is_idempotent_unless_forced(self):
+        media_file = self.add_image((640, 480))
+        self.assertEqual(len(generate_renditions(media_file)), 2)
+        self.assertEqual(generate_renditions(media_file), [])
+        self.assertEqual(len(generate_renditions(media_file, force=True)), 2)
+        self.assertEqual(MediaRendition.objects.filter(media_file=media_file).count(), 2)
+
+    def test_srcset_lists_widths_in_ascending_order(self):
+        media_file = self.add_image((2000, 1000))
+        generate_renditions(media_file)
+        media_file = MediaFile.objects.prefetch_related('renditions').get(pk=media_file.pk)
+        small, large = [media_file.renditions.get(width=width, format='webp') for width in (320, 1024)]
+        self.assertEqual(media_file.webp_srcset, f'{small.url} 320w, {large.url} 1024w')
+        self.assertEqual(media_file.preview_url, media_file.renditions.get(width=320, format='jpeg').url)
+
+        response = self.client.get(reverse('album_detail', args=[self.album.id]))
+        self.assertContains(response, f'<source type="image/webp" srcset="{media_file.webp_srcset}"')
+
+    def test_preview_falls_back_to_the_original(self):
+        media_file = self.add_image((640, 480))
+        self.assertEqual(media_file.preview_url, media_file.content_url)
+        self.assertEqual(media_file.jpeg_srcset, '')
+
+    def test_command_rejects_a_malformed_album_id(self):
+        with self.assertRaisesMessage(CommandError, "Invalid album UUID: 'nope'"):
+            call_command('generate_renditions', album='nope', stdout=io.StringIO())
+
+
+class InlineExecutor:
+    """Stands in for ProcessPoolExecutor: runs submitted calls in the test process."""
+
+    def __init__(self, events, **kwargs):
+        self.events = events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, func, *args):
+        self.events.append('submit')
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+@override_settings(MEDIA_JOB_MAX_ATTEMPTS=2, MEDIA_JOB_RETRY_BACKOFF=30)
+class MediaJobTests(AlbumsTestCase):
+    """Claiming, retries and completion of queued media jobs."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=owner)
+        cls.media_file = MediaFile.objects.create(album=cls.album, file='media/photo.jpg', file_type='image')
+
+    def test_one_active_job_per_kind(self):
+        self.assertIsNotNone(enqueue(self.media_file, 'renditions'))
+        self.assertIsNone(enqueue(self.media_file, 'renditions'))
+        self.assertEqual(MediaFile.objects.get().processing_status, 'pending')
+
+    def test_job_is_claimed_once(self):
+        job = enqueue(self.media_file, 'renditions')
+        self.assertEqual(claim_jobs(limit=10), [job.id])
+        self.assertEqual(claim_jobs(limit=10), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('running', 1))
+        self.assertEqual(MediaFile.objects.get().processing_status, 'processing')
+
+    def test_successful_job_marks_the_file_ready(self):
+        job = enqueue(self.media_file, 'renditions')
+        claim_jobs(limit=10)
+        self.assertEqual(complete_job(job.id).status, 'done')
+        self.assertEqual(MediaFile.objects.get().processing_status, 'ready')
+
+    def test_failed_attempt_is_rescheduled(self):
+        job = enqueue(self.media_file, 'renditions')
+        claim_jobs(limit=10)
+        job = complete_job(job.id, error='boom')
+        self.assertEqual((job.status, job.last_error), ('pending', 'boom'))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=20))
+        self.assertEqual(MediaFile.objects.get().processing_status, 'processing')
+
+    def test_job_fails_after_the_last_attempt(self):
+        job = enqueue(self.media_file, 'renditions')
+        MediaJob.objects.filter(id=job.id).update(attempts=2)
+        with self.assertLogs('albums.jobs', 'ERROR'):
+            self.assertEqual(complete_job(job.id, error='boom').status, 'failed')
+        self.assertEqual(MediaFile.objects.get().processing_status, 'failed')
+
+    def test_deleted_job_is_ignored(self):
+        job = enqueue(self.media_file, 'renditions')
+        self.media_file.delete()
+        self.assertIsNone(complete_job(job.id))
+
+    def test_undecodable_image_fails_without_retries(self):
+        use_temporary_media_root(self)
+        media_file = MediaFile(album=self.album, file_type='image', mime_type='image/jpeg')
+        media_file.file.save('broken.jpg', ContentFile(b'not really a jpeg'), save=False)
+        media_file.save()
+        job = enqueue(media_file, 'renditions')
+        claim_jobs(limit=10)
+
+        # run_job закрывает соединения, как в процессе-воркере
+        with mock.patch('albums.jobs.connections'):
+            error, permanent = run_job(job.id)
+        self.assertTrue(permanent)
+        self.assertIn('UnidentifiedImageError', error)
+        with self.assertLogs('albums.jobs', 'ERROR'):
+            job = complete_job(job.id, error, permanent=permanent)
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+
+    @override_settings(MEDIA_JOB_STALE_TIMEOUT=60)
+    def test_stale_running_job_is_released(self):
+        job = enqueue(self.media_file, 'renditions')
+        claim_jobs(limit=10)
+        MediaJob.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(release_stale_jobs(), 1)
+        self.assertEqual(claim_jobs(limit=10), [job.id])
+
+    def test_worker_closes_connections_right_before_the_pool_forks(self):
+        use_temporary_media_root(self)
+        media_file = MediaFile(album=self.album, file_type='image')
+        media_file.file.save('photo.jpg', ContentFile(image_bytes((64, 64))), save=False)
+        media_file.save()
+        enqueue(media_file, 'renditions')
+
+        events = []
+        connections = mock.Mock()
+        connections.close_all.side_effect = lambda: events.append('close')
+        with mock.patch('albums.management.commands.run_media_worker.ProcessPoolExecutor',
+                        lambda **kwargs: InlineExecutor(events, **kwargs)), \
+                mock.patch('albums.management.commands.run_media_worker.connections', connections), \
+                mock.patch('albums.jobs.connections'):
+            call_command('run_media_worker', '--once', stdout=io.StringIO(), stderr=io.StringIO())
+
+        # Пул создаёт процессы при первом submit — до него соединение уже закрыто
+        self.assertEqual(events, ['close', 'submit'])
+        self.assertEqual(MediaJob.objects.get(media_file=media_file).status, 'done')
+        self.assertEqual(media_file.renditions.count(), 2)
+
+
+class ChunkedUploadTests(AlbumsTestCase):
+    """Chunks must arrive at the server's offset; an interrupted upload resumes from there."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        self.content = image_bytes((8, 8), color='red')
+
+    def start(self, **payload):
+        response = self.client.post(
+            reverse('chunked_upload_start', args=[self.album.id]),
+            {'filename': 'photo.jpg', 'size': len(self.content), **payload},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()['upload_id']
+
+    def send(self, upload_id, offset, data):
+        return self.client.patch(
+            reverse('chunked_upload_detail', args=[self.album.id, upload_id]),
+            data, content_type='application/octet-stream', headers={'Upload-Offset': str(offset)},
+        )
+
+    def finalize(self, upload_id, **data):
+        return self.client.post(reverse('chunked_upload_finalize', args=[self.album.id, upload_id]), data)
+
+    def test_resume_after_interruption(self):
+        upload_id = self.start()
+        half = len(self.content) // 2
+        self.assertEqual(self.send(upload_id, 0, self.content[:half]).json()['offset'], half)
+
+        # Клиент не знает, дошёл ли чанк, и повторяет его — сервер называет своё смещение
+        response = self.send(upload_id, 0, self.content[:half])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, half))
+        state = self.client.get(reverse('chunked_upload_detail', args=[self.album.id, upload_id])).json()
+        self.assertEqual(state['offset'], half)
+
+        self.send(upload_id, half, self.content[half:])
+        response = self.finalize(upload_id, sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(response.status_code, 200)
+        media_file = MediaFile.objects.get(id=response.json()['media_id'])
+        with media_file.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertEqual(media_file.file_type, 'image')
+
+    def test_chunk_beyond_declared_size(self):
+        upload_id = self.start()
+        response = self.send(upload_id, 0, self.content + b'x')
+        self.assertEqual((response.status_code, response.json()['offset']), (400, 0))
+
+    def test_incomplete_upload_is_not_finalized(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.content[:10])
+        self.assertEqual(self.finalize(upload_id).status_code, 409)
+        self.assertFalse(MediaFile.objects.exists())
+        # Загрузку можно продолжить и завершить
+        self.assertEqual(ChunkedUpload.objects.get().status, 'uploading')
+        self.send(upload_id, 10, self.content[10:])
+        self.assertEqual(self.finalize(upload_id).status_code, 200)
+
+    def test_checksum_mismatch(self):
+        upload_id = self.start(sha256='0' * 64)
+        self.send(upload_id, 0, self.content)
+        response = self.finalize(upload_id)
+        self.assertEqual((response.status_code, response.json()['status']), (400, 'failed'))
+        self.assertFalse(MediaFile.objects.exists())
+
+    def test_repeated_finalize_returns_the_same_file(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.content)
+        first = self.finalize(upload_id).json()
+        second = self.finalize(upload_id).json()
+        self.assertEqual(first['media_id'], second['media_id'])
+        self.assertEqual(MediaFile.objects.count(), 1)
+
+    def test_finalize_in_progress_is_rejected(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.content)
+        # Другой запрос уже захватил загрузку
+        ChunkedUpload.objects.filter(id=upload_id).update(status='finalizing')
+        self.assertEqual(self.finalize(upload_id).status_code, 409)
+        self.assertFalse(MediaFile.objects.exists())
+
+    def test_failed_finalize_can_be_retried(self):
+        upload_id = self.start()
+        self.send(upload_id, 0, self.content)
+        with mock.patch.object(MediaFile, 'save', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                self.finalize(upload_id)
+        self.assertEqual(ChunkedUpload.objects.get().status, 'uploading')
+        self.assertEqual(self.finalize(upload_id).status_code, 200)
+        self.assertEqual(MediaFile.objects.count(), 1)
+
+
+class BatchUploadTests(AlbumsTestCase):
+    """A batch costs the same number of queries however many files it has."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        self.contents = {'clip.mp4': ftyp(b'isom') + box(b'mdat', bytes(16)), 'notes.txt': b'plain text'}
+
+    def upload(self, names):
+        files = [SimpleUploadedFile(name, self.contents.get(name, image_bytes((8, 8)))) for name in names]
+        return self.client.post(
+            reverse('upload_media_batch', args=[self.album.id]), {'files': files, 'description': 'Trip'},
+        )
+
+    def stored_files(self):
+        return os.listdir(default_storage.path('media')) if default_storage.exists('media') else []
+
+    def test_files_jobs_and_log_entry(self):
+        response = self.upload(['a.jpg', 'b.png', 'clip.mp4'])
+        self.assertRedirects(response, reverse('album_detail', args=[self.album.id]), fetch_redirect_response=False)
+        self.assertEqual(
+            sorted(MediaFile.objects.values_list('file_type', 'processing_status', 'description')),
+            [('image', 'pending', 'Trip'), ('image', 'pending', 'Trip'), ('video', 'ready', 'Trip')],
+        )
+        self.assertEqual(MediaJob.objects.filter(kind='renditions').count(), 2)
+        entry = ActivityLog.objects.get(action='media_upload')
+        self.assertEqual(entry.item_count, 3)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        with CaptureQueriesContext(connection) as small:
+            self.upload(['a.jpg', 'b.jpg'])
+        with CaptureQueriesContext(connection) as large:
+            self.upload(['c.jpg', 'd.jpg', 'e.jpg', 'f.jpg', 'g.jpg'])
+        self.assertEqual(len(large), len(small))
+
+    def test_unsupported_file_rejects_the_batch(self):
+        response = self.upload(['a.jpg', 'notes.txt'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('notes.txt', str(response.context['form'].errors['files']))
+        self.assertFalse(MediaFile.objects.exists())
+
+    @override_settings(BATCH_UPLOAD_MAX_FILES=2)
+    def test_batch_size_limit(self):
+        response = self.upload(['a.jpg', 'b.jpg', 'c.jpg'])
+        self.assertTrue(response.context['form'].errors['files'])
+        self.assertEqual(self.stored_files(), [])
+
+    def test_failed_insert_removes_written_files(self):
+        with mock.patch('albums.views.enqueue_bulk', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                self.upload(['a.jpg', 'b.jpg'])
+        self.assertFalse(MediaFile.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        # Конец за пределами файла обрезается, суффикс длиннее файла — весь файл
+        self.assertEqual(parse_range('bytes=990-2000', 1000), (990, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_ignored_headers(self):
+        for header in (None, '', 'bytes=0-1,5-6', 'items=0-1', 'bytes=-', 'bytes=a-b'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=500-100', 'bytes=-0'):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_range(header, 1000)
+
+
+class ServeMediaTests(AlbumsTestCase):
+    """media_file_content checks access and answers Range and conditional requests."""
+
+    content = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.public = Album.objects.create(title='Public', owner=cls.owner, is_public=True)
+        cls.private = Album.objects.create(title='Private', owner=cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        name = default_storage.save('media/clip.mp4', ContentFile(self.content))
+        self.media_file = MediaFile.objects.create(album=self.public, file=name, file_type='video')
+        self.url = reverse('media_file_content', args=[self.public.id, self.media_file.id])
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_and_partial_content(self):
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response['Accept-Ranges']), (200, 'bytes'))
+        self.assertEqual(self.body(response), self.content)
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 10-19/1024', '10'))
+        self.assertEqual(self.body(response), self.content[10:20])
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=-4'})
+        self.assertEqual(self.body(response), self.content[-4:])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=5000-'})
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+
+    def test_multi_range_gets_whole_file(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=0-1,4-5'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+        # Файл изменился с тех пор, как клиент получил первую часть: отдаём целиком
+        response = self.client.get(self.url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+
+    def test_private_album_requires_access(self):
+        name = default_storage.save('media/secret.mp4', ContentFile(b'secret'))
+        media_file = MediaFile.objects.create(album=self.private, file=name, file_type='video')
+        url = reverse('media_file_content', args=[self.private.id, media_file.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='nginx', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect_path_is_percent_encoded(self):
+        name = 'media/летний клип #1.mp4'
+        with open(default_storage.path(name), 'wb') as stored:
+            stored.write(self.content)
+        media_file = MediaFile.objects.create(album=self.public, file=name, file_type='video')
+        response = self.client.get(reverse('media_file_content', args=[self.public.id, media_file.id]))
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/protected-media/media/%D0%BB%D0%B5%D1%82%D0%BD%D0%B8%D0%B9%20%D0%BA%D0%BB%D0%B8%D0%BF%20%231.mp4',
+        )
+        self.assertEqual(response.content, b'')
+
+
+class ProbeTests(SimpleTestCase):
+    """Uploads are classified by magic bytes; unknown containers are rejected."""
+
+    def test_images(self):
+        self.assertEqual(sniff(image_bytes((8, 8))), ('image', 'image/jpeg'))
+        buffer = io.BytesIO()
+        Image.new('RGB', (3, 2)).save(buffer, 'PNG')
+        self.assertEqual(sniff(buffer.getvalue()), ('image', 'image/png'))
+        self.assertEqual(sniff(b'GIF89a' + bytes(10)), ('image', 'image/gif'))
+        self.assertEqual(sniff(b'RIFF\0\0\0\0WEBPVP8 '), ('image', 'image/webp'))
+
+    def test_ftyp_brands(self):
+        self.assertEqual(sniff(ftyp(b'isom', b'isom', b'avc1')), ('video', 'video/mp4'))
+        self.assertEqual(sniff(ftyp(b'heic', b'mif1')), ('image', 'image/heic'))
+        self.assertEqual(sniff(ftyp(b'qt  ')), ('video', 'video/quicktime'))
+        # Неизвестный основной бренд, но совместимый из списка
+        self.assertEqual(sniff(ftyp(b'XAVC', b'mp42')), ('video', 'video/mp4'))
+        self.assertEqual(sniff(ftyp(b'M4A ', b'M4A ', b'isoZ')), ('', ''))
+        self.assertEqual(sniff(ftyp(b'evil')), ('', ''))
+        self.assertEqual(sniff(b'\0\0\0\x20ftyp'), ('', ''))
+
+    def test_bmp_header_is_validated(self):
+        self.assertEqual(sniff(bmp_header(1000), size=1000), ('image', 'image/bmp'))
+        self.assertEqual(sniff(bmp_header(1000)), ('image', 'image/bmp'))
+        self.assertEqual(sniff(bmp_header(1000), size=999), ('', ''))
+        self.assertEqual(sniff(bmp_header(1000, dib_size=7)), ('', ''))
+        self.assertEqual(sniff(bmp_header(1000, pixel_offset=20)), ('', ''))
+        self.assertEqual(sniff(b'BMP is not a bitmap, just text' * 4), ('', ''))
+
+    def test_unknown_bytes(self):
+        self.assertEqual(probe_file(io.BytesIO(b'#!/bin/sh\nrm -rf /\n'))['file_type'], '')
+
+    def test_image_metadata(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (30, 20)).save(buffer, 'PNG')
+        result = probe_file(buffer)
+        self.assertEqual((result['width'], result['height'], result['file_size']), (30, 20, len(buffer.getvalue())))
+        self.assertEqual(buffer.tell(), 0)
+
+    def test_mp4_metadata_from_boxes(self):
+        created = 3786825600  # 2024-01-01 по эпохе MP4
+        mvhd = box(b'mvhd', bytes(4) + struct.pack('>IIII', created, created, 1000, 5500) + bytes(80))
+        tkhd = box(b'tkhd', bytes(76) + struct.pack('>II', 640 << 16, 480 << 16))
+        data = ftyp(b'isom') + box(b'moov', mvhd + box(b'trak', tkhd)) + box(b'mdat', bytes(64))
+        result = probe_file(io.BytesIO(data))
+        self.assertEqual((result['file_type'], result['mime_type']), ('video', 'video/mp4'))
+        self.assertEqual((result['width'], result['height'], result['duration']), (640, 480, 5.5))
+        self.assertEqual(result['taken_at'], MP4_EPOCH + timedelta(seconds=created))
+
+    def test_exif_orientation_and_capture_time(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif.get_ifd(0x8769)[0x9003] = '2024:05:01 12:30:00'
+        exif.get_ifd(0x8769)[0x9011] = '+03:00'
+        buffer = io.BytesIO()
+        Image.new('RGB', (30, 20)).save(buffer, 'JPEG', exif=exif)
+        result = probe_file(buffer)
+        # Orientation 6 — снимок повёрнут: ширина и высота меняются местами
+        self.assertEqual((result['width'], result['height']), (20, 30))
+        self.assertEqual(result['taken_at'], timezone.make_aware(datetime(2024, 5, 1, 9, 30), dt_timezone.utc))
+
+    def test_png_pixels_are_never_decoded(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (30, 20)).save(buffer, 'PNG')
+        with mock.patch.object(PngImagePlugin.PngImageFile, 'load', side_effect=AssertionError('pixels decoded')):
+            result = probe_file(buffer)
+        self.assertEqual((result['width'], result['height']), (30, 20))
+
+    def test_name_does_not_decide_the_type(self):
+        upload = SimpleUploadedFile('my.jpg.mov', ftyp(b'qt  ') + box(b'mdat', bytes(16)))
+        self.assertEqual(probe_file(upload)['file_type'], 'video')
+
+    def test_renditions_only_for_formats_pillow_decodes(self):
+        self.assertTrue(pillow_can_decode('image/jpeg'))
+        self.assertFalse(pillow_can_decode('image/heic'))
+        heic = MediaFile(file_type='image', mime_type='image/heic')
+        self.assertEqual(jobs_for(heic), [])
+        self.assertEqual(jobs_for(MediaFile(file_type='image', mime_type='image/png')), ['renditions'])
+
+
+class OwnerControlsTests(AlbumsTestCase):
+    """The media grid is cached for every viewer, so it must not carry owner controls."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+        cls.media_file = MediaFile.objects.create(album=cls.album, file='media/photo.jpg', file_type='image')
+
+    def setUp(self):
+        super().setUp()
+        self.delete_url = reverse('delete_media', args=[self.album.id, self.media_file.id])
+
+    def test_visitor_gets_no_delete_urls(self):
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        self.assertContains(self.client.get(reverse('album_detail', args=[self.album.id])), self.delete_url)
+        page = self.client.get(reverse('album_media_page', args=[self.album.id])).json()
+        self.assertEqual(page['owner_actions'], {str(self.media_file.id): self.delete_url})
+
+        # Сетка уже в кэше после запроса владельца
+        User.objects.create_user('visitor', password='secret')
+        visitor = self.client_class()
+        visitor.post(reverse('login'), {'username': 'visitor', 'password': 'secret'})
+        for client in (visitor, self.client_class()):
+            response = client.get(reverse('album_detail', args=[self.album.id]))
+            self.assertContains(response, f'data-media-id="{self.media_file.id}"')
+            self.assertNotContains(response, '/delete/')
+            page = client.get(reverse('album_media_page', args=[self.album.id])).json()
+            self.assertNotIn('owner_actions', page)
+            self.assertNotIn('/delete/', page['html'])
+
+
+class GridCacheTests(AlbumsTestCase):
+    """Grid pages are rendered once per album version."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+        MediaFile.objects.create(album=cls.album, file='media/first.jpg', file_type='image', description='first')
+
+    def media_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('album_detail', args=[self.album.id]))
+        # Страница сетки — выборка файлов с LIMIT
+        return response, [
+            query['sql'] for query in queries if 'albums_mediafile' in query['sql'] and 'LIMIT' in query['sql']
+        ]
+
+    def test_repeat_view_is_served_from_cache(self):
+        response, queries = self.media_queries()
+        self.assertTrue(queries)
+        response, queries = self.media_queries()
+        self.assertEqual(queries, [])
+        self.assertContains(response, 'first')
+
+    def test_media_changes_invalidate_the_album(self):
+        self.media_queries()
+        MediaFile.objects.create(album=self.album, file='media/second.jpg', file_type='image', description='second')
+        response, queries = self.media_queries()
+        self.assertTrue(queries)
+        self.assertContains(response, 'second')
+
+    def test_other_albums_stay_cached(self):
+        self.media_queries()
+        other = Album.objects.create(title='Other', owner=self.owner, is_public=True)
+        MediaFile.objects.create(album=other, file='media/other.jpg', file_type='image')
+        self.assertEqual(self.media_queries()[1], [])
+
+
+class ConditionalResponseTests(AlbumsTestCase):
+    """Unchanged album pages are revalidated with 304; every view is still logged."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+        MediaFile.objects.create(album=cls.album, file='media/photo.jpg', file_type='image')
+        cls.url = reverse('album_detail', args=[cls.album.id])
+
+    def test_unchanged_album_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(ActivityLog.objects.filter(action='album_view', album=self.album).count(), 2)
+
+    def test_new_media_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        MediaFile.objects.create(album=self.album, file='media/second.jpg', file_type='image')
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_viewer_and_the_page(self):
+        anonymous = self.client.get(self.url)['ETag']
+        self.assertNotEqual(self.client.get(self.url, {'sort': 'taken'})['ETag'], anonymous)
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        response = self.client.get(self.url, headers={'If-None-Match': anonymous})
+        self.assertEqual(response.status_code, 200)
+
+    def test_protected_album_is_private(self):
+        album = Album.objects.create(title='Private', owner=self.owner, view_password='letmein')
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        response = self.client.get(reverse('album_detail', args=[album.id]))
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_album_list_revalidation(self):
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        etag = self.client.get(reverse('album_list'))['ETag']
+        self.assertEqual(self.client.get(reverse('album_list'), headers={'If-None-Match': etag}).status_code, 304)
+        Album.objects.create(title='Another', owner=self.owner)
+        self.assertEqual(self.client.get(reverse('album_list'), headers={'If-None-Match': etag}).status_code, 200)
+
+
+@override_settings(ACTIVITY_STATS_ENABLED=True)
+class OwnerCountersTests(AlbumsTestCase):
+    """View counters change on every visit, so they stay out of the owner's validators."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+        cls.other = Album.objects.create(title='Other', owner=User.objects.create_user('other'), is_public=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+
+    def test_owner_revalidates_after_visits(self):
+        for url in (reverse('album_detail', args=[self.album.id]), reverse('album_list')):
+            etag = self.client.get(url)['ETag']
+            self.client_class().get(reverse('album_detail', args=[self.album.id]))
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_album_stats(self):
+        self.client.get(reverse('album_detail', args=[self.album.id]))
+        self.client_class().get(reverse('album_detail', args=[self.album.id]))
+        self.client_class().get(reverse('album_detail', args=[self.other.id]))
+
+        url = reverse('album_stats')
+        response = self.client.get(url, {'album': [self.album.id, self.other.id]})
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertEqual(response.json(), {
+            'albums': {str(self.album.id): {'views': 2, 'media_views': 0, 'uploads': 0}},
+        })
+        self.assertEqual(self.client.get(url, {'album': 'nope'}).status_code, 404)
+
+
+@override_settings(ACTIVITY_STATS_ENABLED=True)
+class StatsRollupTests(AlbumsTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.album = Album.objects.create(title='Album', owner=User.objects.create_user('owner'))
+        cls.media_file = MediaFile.objects.create(album=cls.album, file='media/photo.jpg', file_type='image')
+
+    def view(self, ip, days_ago=0, **kwargs):
+        kwargs.setdefault('action', 'album_view')
+        return ActivityLog.objects.create(
+            album=self.album, ip_address=ip, timestamp=timezone.now() - timedelta(days=days_ago), **kwargs,
+        )
+
+    def unique_ips(self):
+        return sorted(
+            AlbumDailyStats.objects.filter(album=self.album, media_file__isnull=True).values_list('unique_ips', flat=True)
+        )
+
+    def test_counters(self):
+        record_entries([
+            self.view('10.0.0.1'),
+            self.view('10.0.0.1', action='media_view', media_file=self.media_file),
+            self.view('10.0.0.2', action='media_upload', item_count=3),
+        ])
+        album_row = AlbumDailyStats.objects.get(album=self.album, media_file__isnull=True)
+        self.assertEqual((album_row.views, album_row.media_views, album_row.uploads, album_row.unique_ips), (1, 1, 3, 1))
+        media_row = AlbumDailyStats.objects.get(media_file=self.media_file)
+        self.assertEqual((media_row.views, media_row.unique_ips), (1, 1))
+
+    def test_ip_spellings_count_once(self):
+        record_entries([self.view('2001:DB8:0::1')])
+        record_entries([self.view('2001:db8::1'), self.view('10.0.0.1')])
+        record_entries([self.view('10.0.0.1', days_ago=1)])
+        self.assertEqual(self.unique_ips(), [1, 2])
+        self.assertEqual(AlbumDailyStats.objects.get(album=self.album, date=timezone.localdate()).views, 3)
+
+        rebuild_stats(self.album.id)
+        self.assertEqual(self.unique_ips(), [1, 2])
+        self.assertEqual(AlbumDailyVisitor.objects.filter(album=self.album).count(), 3)
+
+    def test_unique_ips_are_counted_from_stored_visitors(self):
+        record_entries([self.view('10.0.0.1')])
+        # Параллельная пачка уже сохранила этого посетителя, но ещё не обновила счётчик
+        AlbumDailyVisitor.objects.create(album=self.album, date=timezone.localdate(), ip_address='10.0.0.2')
+        record_entries([self.view('10.0.0.2')])
+        self.assertEqual(self.unique_ips(), [2])
+        record_entries([self.view('10.0.0.2')])
+        self.assertEqual(self.unique_ips(), [2])
+
+    def test_rebuild_command(self):
+        self.view('10.0.0.1')
+        self.view('10.0.0.2')
+        out = io.StringIO()
+        call_command('rebuild_album_stats', album=str(self.album.id), stdout=out)
+        self.assertIn('Rebuilt 1 statistics rows', out.getvalue())
+        self.assertEqual(self.unique_ips(), [2])
+        with self.assertRaises(CommandError):
+            call_command('rebuild_album_stats', album='not-a-uuid')
+
+
+@override_settings(ACTIVITY_LOG_RETENTION_DAYS={'default': 30, 'login': None})
+class RetentionTests(AlbumsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.album = Album.objects.create(title='Album', owner=User.objects.create_user('owner'))
+        self.now = timezone.now()
+        user_agent_id = get_user_agent_cache().get_id('Mozilla/5.0 (X11; Linux x86_64)')
+        self.old = [
+            ActivityLog.objects.create(
+                action='album_view', album=self.album, ip_address='10.0.0.1', user_agent_id=user_agent_id,
+                timestamp=self.now - timedelta(days=days),
+            )
+            for days in (40, 70, 100)
+        ]
+        ActivityLog.objects.create(action='album_view', ip_address='10.0.0.2', timestamp=self.now - timedelta(days=1))
+        ActivityLog.objects.create(action='login', ip_address='10.0.0.3', timestamp=self.now - timedelta(days=1000))
+
+    def test_dry_run_only_counts(self):
+        self.assertEqual(archive_expired(self.now, dry_run=True, directory=self.directory), (3, []))
+        self.assertEqual(ActivityLog.objects.count(), 5)
+
+    def test_archive_and_import(self):
+        archived, paths = archive_expired(self.now, batch_size=2, compression='gzip', directory=self.directory)
+        self.assertEqual(archived, 3)
+        # Один файл на каждый месяц архивированных записей
+        months = {timezone.localtime(entry.timestamp).strftime('%Y-%m') for entry in self.old}
+        self.assertEqual(len(paths), len(months))
+        self.assertEqual(sorted(ActivityLog.objects.values_list('action', flat=True)), ['album_view', 'login'])
+
+        self.album.delete()
+        get_user_agent_cache().clear()
+        self.assertEqual(sum(import_archive(path) for path in paths), 3)
+        restored = ActivityLog.objects.filter(pk__in=[entry.pk for entry in self.old]).select_related('user_agent')
+        self.assertEqual(len(restored), 3)
+        for entry in restored:
+            self.assertIsNone(entry.album_id)
+            self.assertEqual(entry.user_agent.string, 'Mozilla/5.0 (X11; Linux x86_64)')
+            self.assertEqual(entry.ip_address, '10.0.0.1')
+        # Повторный импорт ничего не дублирует
+        self.assertEqual(sum(import_archive(path) for path in paths), 3)
+        self.assertEqual(ActivityLog.objects.count(), 5)
+
+
+class SearchActivityTests(AlbumsTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice')
+        album = Album.objects.create(title='Wedding photos', owner=cls.alice)
+        cls.holiday = ActivityLog.objects.create(
+            action='album_view', ip_address='10.1.2.3', content_url='https://example.com/albums/holiday/',
+        )
+        cls.referred = ActivityLog.objects.create(
+            action='media_view', ip_address='10.9.9.9', referrer='https://search.example.org/?q=cats',
+        )
+        cls.login = ActivityLog.objects.create(action='login', ip_address='10.0.0.1', user=cls.alice)
+        cls.wedding = ActivityLog.objects.create(action='album_view', ip_address='10.0.0.2', album=album)
+
+    def search(self, term):
+        with CaptureQueriesContext(connection) as captured:
+            found = set(search_activity(ActivityLog.objects.all(), term))
+        return found, any(FTS_TABLE in query['sql'] for query in captured)
+
+    def test_full_text_and_fallback_agree(self):
+        cases = {
+            'holiday': {self.holiday},
+            'CATS': {self.referred},
+            'media_view example.org': {self.referred},
+            'wedd': {self.wedding},
+            'example': {self.holiday, self.referred},
+        }
+        for term, expected in cases.items():
+            with self.subTest(term=term):
+                found, used_index = self.search(term)
+                self.assertEqual(found, expected)
+                self.assertTrue(used_index)
+                with mock.patch('albums.search.fts_available', return_value=False):
+                    found, used_index = self.search(term)
+                self.assertEqual(found, expected)
+                self.assertFalse(used_index)
+
+    def test_short_terms_and_exact_paths(self):
+        self.assertEqual(self.search('10.1.2.3'), ({self.holiday}, False))
+        self.assertEqual(self.search('alice'), ({self.login}, False))
+        self.assertEqual(self.search('q='), ({self.referred}, False))
+        self.assertEqual(self.search('  '), ({self.holiday, self.referred, self.login, self.wedding}, False))
+
+    def test_old_sqlite_has_no_index(self):
+        old = SimpleNamespace(vendor='sqlite', Database=SimpleNamespace(sqlite_version_info=(3, 31, 1)))
+        self.assertFalse(fts_available(old))
+        schema_editor = mock.Mock(connection=old)
+        create_search_index(schema_editor)
+        schema_editor.execute.assert_not_called()
+
+
+class ExportActivityTests(AlbumsTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice')
+        cls.album = Album.objects.create(title='Album', owner=cls.alice)
+        now = timezone.now()
+        cls.first = ActivityLog.objects.create(
+            action='album_view', ip_address='10.0.0.1', album=cls.album, user=cls.alice,
+            referrer='https://example.com/?a=1,b="2"', timestamp=now - timedelta(minutes=2),
+        )
+        cls.second = ActivityLog.objects.create(
+            action='media_view', ip_address='10.0.0.2', album=cls.album, timestamp=now - timedelta(minutes=1),
+        )
+        ActivityLog.objects.create(action='login', ip_address='10.0.0.3', timestamp=now)
+
+    def read_csv(self, data):
+        return list(csv.DictReader(io.StringIO(data)))
+
+    def test_csv_stream(self):
+        chunks = list(export_stream(filter_logs(album=self.album.id), 'csv', chunk_size=1))
+        self.assertEqual(next(csv.reader([chunks[0].decode()])), EXPORT_COLUMNS)
+        rows = self.read_csv(b''.join(chunks).decode())
+        self.assertEqual([row['id'] for row in rows], [str(self.first.id), str(self.second.id)])
+        self.assertEqual(rows[0]['username'], 'alice')
+        self.assertEqual(rows[0]['referrer'], 'https://example.com/?a=1,b="2"')
+        self.assertEqual(rows[1]['username'], '')
+
+        compressed = b''.join(export_stream(filter_logs(album=self.album.id), 'csv', compress=True))
+        self.assertEqual(gzip.decompress(compressed), b''.join(chunks))
+
+    def test_command_writes_to_stdout(self):
+        stdout = io.StringIO()
+        call_command('export_activity_log', album=str(self.album.id), action=['media_view'], stdout=stdout)
+        self.assertEqual([row['id'] for row in self.read_csv(stdout.getvalue())], [str(self.second.id)])
+
+        stdout = io.StringIO()
+        call_command('export_activity_log', '--format', 'jsonl', stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 3)
+
+    def test_command_errors(self):
+        with self.assertRaisesMessage(CommandError, 'Invalid album UUID'):
+            call_command('export_activity_log', album='not-a-uuid', stdout=io.StringIO())
+        with self.assertRaisesMessage(CommandError, 'Invalid date'):
+            call_command('export_activity_log', since='yesterday', stdout=io.StringIO())
+        with self.assertRaisesMessage(CommandError, 'use --output'):
+            call_command('export_activity_log', gzip=True, stdout=io.StringIO())
+
+    def test_command_writes_gzip_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'export.csv.gz')
+        call_command('export_activity_log', output=path, gzip=True, stderr=io.StringIO())
+        with gzip.open(path, 'rt', newline='') as stream:
+            self.assertEqual(len(list(csv.DictReader(stream))), 3)
+
+
+@override_settings(ACTIVITY_STATS_ENABLED=False)
+class LogActivityQueriesTests(AlbumsTestCase):
+    """Once the UA row and content types are known, logging costs one INSERT."""
+
+    user_agent = 'Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+        cls.media_file = MediaFile.objects.create(album=cls.album, file='media/photo.jpg', file_type='image')
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory(HTTP_USER_AGENT=self.user_agent)
+
+    def warm_up(self):
+        log_activity(self.factory.get('/'), 'album_view', album=self.album)
+        log_activity(self.factory.get('/'), 'media_view', album=self.album, media_file=self.media_file)
+
+    def test_album_view_is_a_single_insert(self):
+        self.warm_up()
+        with self.assertNumQueries(1):
+            log_activity(self.factory.get('/'), 'album_view', user=self.owner, album=self.album)
+
+    def test_media_view_does_not_fetch_album(self):
+        self.warm_up()
+        media_file = MediaFile.objects.get(pk=self.media_file.pk)
+        request = self.factory.get('/')
+        with self.assertNumQueries(1):
+            entry = log_activity(request, 'media_view', media_file=media_file)
+        self.assertEqual(
+            entry.content_url,
+            request.build_absolute_uri(reverse('view_media', args=[self.album.id, media_file.id])),
+        )
+
+    def test_content_types_are_resolved_once(self):
+        request = self.factory.get('/')
+        entry = log_activity(request, 'media_view', album=self.album, media_file=self.media_file)
+        self.assertEqual(entry.content_type_id, ContentType.objects.get_for_model(MediaFile).id)
+        with self.assertNumQueries(1):
+            entry = log_activity(request, 'album_edit', user=self.owner, album=self.album)
+        self.assertEqual(entry.content_type_id, ContentType.objects.get_for_model(Album).id)
+
+    def test_view_media_queries(self):
+        self.warm_up()
+        url = reverse('view_media', args=[self.album.id, self.media_file.id])
+        # Альбом, файл и запись журнала
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_USER_AGENT=self.user_agent)
+        self.assertRedirects(
+            response,
+            reverse('media_file_content', args=[self.album.id, self.media_file.id]),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(ActivityLog.objects.filter(action='media_view').count(), 2)
+
+
+class ViewQueryScalingTests(AlbumsTestCase):
+    """Album pages must not issue a query per media file."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+
+    def add_media(self, count):
+        MediaFile.objects.bulk_create(
+            MediaFile(album=self.album, file=f'media/{i}.jpg', file_type='image') for i in range(count)
+        )
+
+    def count_queries(self, url):
+        # Первый запрос создаёт строку UA и посетителя в статистике
+        self.client.get(url)
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(captured)
+
+    def assert_constant_queries(self, url):
+        self.add_media(2)
+        few = self.count_queries(url)
+        self.add_media(30)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_album_detail(self):
+        self.assert_constant_queries(reverse('album_detail', args=[self.album.id]))
+
+    def test_album_media_page(self):
+        self.assert_constant_queries(reverse('album_media_page', args=[self.album.id]))
+
+    def test_album_list(self):
+        self.assert_constant_queries(reverse('album_list'))
+
+
+class FindRegressionsTests(SimpleTestCase):
+    baseline = {'results': [
+        {'scale': 'small', 'name': 'album_detail', 'queries': 5, 'queries_cold': 7, 'time_ms': 10.0},
+    ]}
+
+    def current(self, **changes):
+        return {'results': [{**self.baseline['results'][0], **changes}]}
+
+    def test_unchanged(self):
+        self.assertEqual(find_regressions(self.current(), self.baseline), [])
+
+    def test_extra_query(self):
+        regressions = find_regressions(self.current(queries=6), self.baseline)
+        self.assertEqual(regressions, ['[small] album_detail: queries 5 -> 6'])
+        self.assertEqual(find_regressions(self.current(queries=6), self.baseline, max_query_increase=1), [])
+
+    def test_time_needs_ratio_and_delta(self):
+        self.assertEqual(find_regressions(self.current(time_ms=14.0), self.baseline), [])
+        self.assertEqual(find_regressions(self.current(time_ms=16.0), self.baseline, min_time_delta_ms=10), [])
+        self.assertEqual(len(find_regressions(self.current(time_ms=16.0), self.baseline)), 1)
+
+
+@override_settings(REQUEST_METRICS_PUBLISH_INTERVAL=3600)
+class RequestMetricsTests(AlbumsTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret', is_staff=True)
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, is_public=True)
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_server_timing_and_histogram(self):
+        url = reverse('album_detail', args=[self.album.id])
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'db', 'template', 'log', 'total'})
+        self.assertIn(f'desc="{len(captured)} queries"', timing['db'])
+
+        stats = registry.snapshot()['views']['album_detail']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['queries']['sum'], len(captured))
+        self.assertEqual(stats['bytes']['sum'], len(response.content))
+        self.assertGreater(stats['template']['sum'], 0)
+        self.assertEqual(sum(stats['total']['buckets']), 1)
+
+    def test_streaming_size_is_recorded_when_consumed(self):
+        request = RequestFactory().get('/')
+        middleware = ActivityLoggingMiddleware(lambda request: StreamingHttpResponse([b'abc', b'defg']))
+        response = middleware(request)
+        self.assertNotIn('<unresolved>', registry.snapshot()['views'])
+        self.assertEqual(b''.join(response.streaming_content), b'abcdefg')
+        self.assertEqual(registry.snapshot()['views']['<unresolved>']['bytes']['sum'], 7)
+
+    def test_endpoint_is_staff_only(self):
+        url = reverse('request_metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        self.client.get(reverse('album_list'))
+        views = {row['view']: row for row in self.client.get(url).json()['views']}
+        self.assertEqual(views['album_list']['count'], 1)
+
+
+class AsyncViewTests(AlbumsTestCase):
+    """The read-heavy views run natively under ASGI (no sync ORM access on the event loop)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, view_password='letmein')
+        cls.media_file = MediaFile.objects.create(album=cls.album, file='media/photo.jpg', file_type='image')
+
+    async def test_owner_views(self):
+        await self.async_client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        response = await self.async_client.get(reverse('album_list'))
+        self.assertContains(response, 'Album')
+        response = await self.async_client.get(reverse('album_detail', args=[self.album.id]))
+        self.assertContains(response, reverse('upload_media', args=[self.album.id]))
+        # Запросы из потоков ORM попадают в метрики запроса
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+        self.assertEqual(await ActivityLog.objects.filter(action='album_view').acount(), 2)
+
+    async def test_password_grants_access(self):
+        detail = reverse('album_detail', args=[self.album.id])
+        access = reverse('album_access', args=[self.album.id])
+        self.assertRedirects(await self.async_client.get(detail), access, fetch_redirect_response=False)
+
+        response = await self.async_client.post(access, {'password': 'wrong'})
+        self.assertContains(response, 'Неверный пароль')
+        response = await self.async_client.post(access, {'password': 'letmein'})
+        self.assertRedirects(response, detail, fetch_redirect_response=False)
+        self.assertTrue(await AlbumAccessGrant.objects.filter(album=self.album).aexists())
+
+        response = await self.async_client.get(detail)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, reverse('upload_media', args=[self.album.id]))
+        response = await self.async_client.get(reverse('view_media', args=[self.album.id, self.media_file.id]))
+        self.assertRedirects(
+            response,
+            reverse('media_file_content', args=[self.album.id, self.media_file.id]),
+            fetch_redirect_response=False,
+        )
+
+
+class AccessDecisionTests(AlbumsTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.album = Album.objects.create(title='Album', owner=cls.owner, view_password='letmein')
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def request(self, session_key=None, user=None):
+        request = self.factory.get('/')
+        request.session = SessionStore(session_key)
+        request.user = user or AnonymousUser()
+        return request
+
+    def granted_session(self):
+        session = SessionStore()
+        session[f'album_view_{self.album.id}'] = True
+        session.create()
+        return session.session_key
+
+    def test_owner_is_not_loaded(self):
+        album = Album.objects.get(pk=self.album.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(check_album_access(self.request(user=self.owner), album))
+
+    def test_session_decision_is_cached(self):
+        session_key = self.granted_session()
+        with self.assertNumQueries(1):
+            self.assertTrue(check_album_access(self.request(session_key), self.album))
+        with self.assertNumQueries(0):
+            self.assertTrue(check_album_access(self.request(session_key), self.album))
+        with self.assertNumQueries(1):
+            self.assertFalse(check_album_access(self.request('x' * 32), self.album))
+
+    def test_edit_album_invalidates_cached_decisions(self):
+        visitor = self.client_class()
+        access = reverse('album_access', args=[self.album.id])
+        detail = reverse('album_detail', args=[self.album.id])
+        visitor.post(access, {'password': 'letmein'})
+        self.assertEqual(visitor.get(detail).status_code, 200)
+
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+        self.client.post(reverse('edit_album', args=[self.album.id]), {
+            'title': 'Album', 'description': '', 'view_password': 'changed',
+        })
+        self.assertRedirects(visitor.get(detail), access, fetch_redirect_response=False)
+
+    def test_grant_replaces_cached_denial(self):
+        visitor = self.client_class()
+        access = reverse('album_access', args=[self.album.id])
+        detail = reverse('album_detail', args=[self.album.id])
+        visitor.post(access, {'password': 'letmein'})
+        # Доступ выдан в другой сессии — текущая получает отказ, и он кэшируется
+        session = visitor.session
+        session.pop(f'album_view_{self.album.id}')
+        session.save()
+        get_cache().clear()
+        self.assertRedirects(visitor.get(detail), access, fetch_redirect_response=False)
+        visitor.post(access, {'password': 'letmein'})
+        self.assertEqual(visitor.get(detail).status_code, 200)
+
+
+@override_settings(ALBUM_LIST_PAGE_SIZE=2)
+class AlbumListTests(AlbumsTestCase):
+    """Album cards are annotated in one query and paginated by cursor."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.albums = [Album.objects.create(title=f'Album {i}', owner=cls.owner) for i in range(3)]
+
+    def setUp(self):
+        super().setUp()
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+
+    def test_annotations(self):
+        album = self.albums[0]
+        MediaFile.objects.create(album=album, file='media/a.jpg', file_type='image', file_size=100)
+        cover = MediaFile.objects.create(album=album, file='media/b.jpg', file_type='image', file_size=50)
+        MediaFile.objects.create(album=album, file='media/c.jpg', file_type='image', file_size=7, is_deleted=True)
+        MediaRendition.objects.create(media_file=cover, width=1024, height=768, format='jpeg', file='r/big.jpg')
+        small = MediaRendition.objects.create(media_file=cover, width=320, height=240, format='jpeg', file='r/small.jpg')
+
+        with self.assertNumQueries(1):
+            cards = {card.id: card for card in annotate_album_cards(Album.objects.filter(owner=self.owner))}
+        card = cards[album.id]
+        self.assertEqual((card.media_count, card.total_bytes), (2, 150))
+        self.assertEqual((card.cover_id, card.cover_rendition_id), (cover.id, small.id))
+        empty = cards[self.albums[1].id]
+        self.assertEqual((empty.media_count, empty.total_bytes, empty.cover_id), (0, 0, None))
+
+    def test_cursor_pages(self):
+        response = self.client.get(reverse('album_list'))
+        first = [album.id for album in response.context['albums']]
+        self.assertEqual(first, [self.albums[2].id, self.albums[1].id])
+        response = self.client.get(reverse('album_list'), {'cursor': response.context['next_cursor']})
+        self.assertEqual([album.id for album in response.context['albums']], [self.albums[0].id])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('album_list'), {'cursor': 'garbage'}).status_code, 404)
+
+
+@override_settings(ALBUM_LIST_PAGE_SIZE=2)
+class PublicFeedTests(AlbumsTestCase):
+    """The feed reads the precomputed ranking and shows only albums anyone may open."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.quiet = Album.objects.create(title='Quiet', owner=cls.owner, is_public=True)
+        cls.popular = Album.objects.create(title='Popular', owner=cls.owner, is_public=True)
+        cls.old_hit = Album.objects.create(title='Old hit', owner=cls.owner, is_public=True)
+        Album.objects.create(title='Private', owner=cls.owner)
+        Album.objects.create(title='Locked', owner=cls.owner, is_public=True, view_password='secret')
+        today = timezone.localdate()
+        AlbumDailyStats.objects.create(album=cls.popular, date=today, views=5, media_views=5)
+        AlbumDailyStats.objects.create(album=cls.old_hit, date=today - timedelta(days=9), views=50)
+
+    def test_ranking(self):
+        self.assertEqual(refresh_ranking(), 3)
+        ranking = list(AlbumRanking.objects.order_by('rank').values_list('album_id', 'recent_views'))
+        self.assertEqual(ranking, [(self.popular.id, 10), (self.old_hit.id, 50), (self.quiet.id, 0)])
+
+    def test_feed_pages(self):
+        refresh_ranking()
+        response = self.client.get(reverse('public_feed'))
+        self.assertEqual([album['title'] for album in response.context['albums']], ['Popular', 'Old hit'])
+        response = self.client.get(reverse('public_feed'), {'cursor': response.context['next_cursor']})
+        self.assertEqual([album['title'] for album in response.context['albums']], ['Quiet'])
+        self.assertEqual(self.client.get(reverse('public_feed'), {'cursor': 'x'}).status_code, 404)
+
+    def test_cached_until_album_changes(self):
+        refresh_ranking()
+        url = reverse('public_feed')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        self.popular.is_public = False
+        self.popular.save()
+        response = self.client.get(url)
+        self.assertEqual([album['title'] for album in response.context['albums']], ['Old hit', 'Quiet'])
+
+    def test_search(self):
+        refresh_ranking()
+        response = self.client.get(reverse('public_feed'), {'q': 'hit'})
+        self.assertEqual([album['title'] for album in response.context['albums']], ['Old hit'])
+
+
+class BlobStorageTests(AlbumsTestCase):
+    """Identical uploads share one stored blob; bytes go when the last reference is purged."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='secret')
+        cls.first = Album.objects.create(title='First', owner=cls.owner)
+        cls.second = Album.objects.create(title='Second', owner=cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        self.client.post(reverse('login'), {'username': 'owner', 'password': 'secret'})
+
+    def upload(self, album, name, content):
+        self.client.post(reverse('upload_media', args=[album.id]), {
+            'file': SimpleUploadedFile(name, content, content_type='image/jpeg'), 'description': '',
+        })
+        return MediaFile.objects.filter(album=album).latest('uploaded_at')
+
+    def test_duplicate_upload_is_stored_once(self):
+        content = image_bytes((8, 8), color='red')
+        digest = hashlib.sha256(content).hexdigest()
+        first = self.upload(self.first, 'a.jpg', content)
+        second = self.upload(self.second, 'copy.jpg', content)
+
+        blob = Blob.objects.get()
+        self.assertEqual((blob.hash, blob.ref_count, blob.size), (digest, 2, len(content)))
+        self.assertEqual(first.file.name, blob_name(digest))
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual((first.display_name, second.display_name), ('a.jpg', 'copy.jpg'))
+        self.assertEqual(os.listdir(os.path.dirname(default_storage.path(blob.file.name))), [digest])
+
+    def test_blob_served_with_media_type(self):
+        content = image_bytes((8, 8), color='red')
+        self.upload(self.first, 'a.jpg', content)
+        media_file = self.upload(self.second, 'copy.jpg', content)
+        response = self.client.get(reverse('media_file_content', args=[self.second.id, media_file.id]))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+        rendition = MediaRendition.objects.create(
+            media_file=media_file, width=8, height=8, format='webp',
+            file=default_storage.save('renditions/no-extension', ContentFile(b'RIFF')),
+        )
+        response = self.client.get(reverse('media_rendition_content', args=[self.second.id, media_file.id, rendition.id]))
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    def test_failed_upload_leaves_no_bytes(self):
+        stored = image_bytes((8, 8), color='red')
+        self.upload(self.first, 'a.jpg', stored)
+        stored_path = default_storage.path(blob_name(hashlib.sha256(stored).hexdigest()))
+        new = image_bytes((8, 8), color='blue')
+        new_path = default_storage.path(blob_name(hashlib.sha256(new).hexdigest()))
+
+        with mock.patch.object(MediaFile, 'save', side_effect=DatabaseError('disk full')):
+            for content in (new, stored):
+                with self.assertRaises(DatabaseError):
+                    self.upload(self.second, 'b.jpg', content)
+        with mock.patch('albums.views.enqueue_bulk', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('upload_media_batch', args=[self.second.id]), {'files': [
+                    SimpleUploadedFile('1.jpg', stored, content_type='image/jpeg'),
+                    SimpleUploadedFile('2.jpg', new, content_type='image/jpeg'),
+                ]})
+
+        # Новые байты удалены вместе с откатом, уже хранившиеся остались
+        self.assertFalse(os.path.exists(new_path))
+        self.assertTrue(os.path.exists(stored_path))
+        self.assertEqual(list(Blob.objects.values_list('ref_count', flat=True)), [1])
+        self.assertFalse(MediaFile.objects.filter(album=self.second).exists())
+
+    def test_batch_upload_deduplicates(self):
+        red, blue = image_bytes((8, 8), color='red'), image_bytes((8, 8), color='blue')
+        self.upload(self.first, 'a.jpg', red)
+        self.client.post(reverse('upload_media_batch', args=[self.second.id]), {'files': [
+            SimpleUploadedFile('1.jpg', red, content_type='image/jpeg'),
+            SimpleUploadedFile('2.jpg', blue, content_type='image/jpeg'),
+            SimpleUploadedFile('3.jpg', blue, content_type='image/jpeg'),
+        ]})
+        counts = dict(Blob.objects.values_list('hash', 'ref_count'))
+        self.assertEqual(counts, {hashlib.sha256(red).hexdigest(): 2, hashlib.sha256(blue).hexdigest(): 2})
+
+    def test_bytes_deleted_with_last_reference(self):
+        content = image_bytes((8, 8), color='green')
+        first = self.upload(self.first, 'a.jpg', content)
+        second = self.upload(self.second, 'a.jpg', content)
+        path = default_storage.path(first.file.name)
+        long_ago = timezone.now() - timedelta(days=60)
+
+        MediaFile.objects.filter(pk=first.pk).update(is_deleted=True, deleted_at=long_ago)
+        call_command('purge_deleted_media', stdout=io.StringIO())
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        MediaFile.objects.filter(pk=second.pk).update(is_deleted=True, deleted_at=timezone.now())
+        call_command('purge_deleted_media', stdout=io.StringIO())
+        self.assertTrue(os.path.exists(path))
+
+        Album.objects.filter(pk=self.second.pk).update(is_deleted=True, deleted_at=long_ago)
+        call_command('purge_deleted_media', stdout=io.StringIO())
+        self.assertFalse(MediaFile.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class UserAgentMigrationTests(TransactionTestCase):
+    """Moving user-agent data into UserAgent rows (0015-0017), forward, resumed and backward."""
+
+    before = [('albums', '0014_albumdailystats')]
+    linked = [('albums', '0016_link_activitylog_user_agents')]
+    after = [('albums', '0017_remove_activitylog_user_agent_fields')]
+    firefox = 'Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0'
+    curl = 'curl/8.5.0'
+
+    def setUp(self):
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes('albums'))
+        self.apps = self.migrate(self.before)
+        ActivityLog = self.apps.get_model('albums', 'ActivityLog')
+        for user_agent, browser in ((self.firefox, 'Firefox'), (self.curl, 'curl'), (self.firefox, 'Firefox')):
+            ActivityLog.objects.create(
+                action='login', ip_address='10.0.0.1', user_agent=user_agent, browser_family=browser,
+            )
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_forward_and_backward(self):
+        apps = self.migrate(self.after)
+        UserAgent = apps.get_model('albums', 'UserAgent')
+        self.assertEqual(
+            sorted(UserAgent.objects.values_list('string', 'browser_family')),
+            [(self.firefox, 'Firefox'), (self.curl, 'curl')],
+        )
+        self.assertEqual(
+            sorted(apps.get_model('albums', 'ActivityLog').objects.values_list('user_agent__string', flat=True)),
+            [self.firefox, self.firefox, self.curl],
+        )
+
+        apps = self.migrate(self.before)
+        self.assertEqual(
+            sorted(apps.get_model('albums', 'ActivityLog').objects.values_list('user_agent', 'browser_family')),
+            [(self.firefox, 'Firefox'), (self.firefox, 'Firefox'), (self.curl, 'curl')],
+        )
+
+    def test_interrupted_link_resumes(self):
+        apps = self.migrate([('albums', '0015_activitylog_user_agent_ref')])
+        UserAgent = apps.get_model('albums', 'UserAgent')
+        ActivityLog = apps.get_model('albums', 'ActivityLog')
+        # Первая пачка уже связана до сбоя
+        done = UserAgent.objects.create(hash=user_agent_hash(self.curl), string=self.curl, browser_family='curl')
+        ActivityLog.objects.filter(user_agent=self.curl).update(user_agent_ref=done)
+
+        apps = self.migrate(self.linked)
+        ActivityLog = apps.get_model('albums', 'ActivityLog')
+        self.assertFalse(ActivityLog.objects.filter(user_agent_ref__isnull=True).exists())
+        self.assertEqual(apps.get_model('albums', 'UserAgent').objects.count(), 2)
+        self.assertEqual(ActivityLog.objects.get(user_agent=self.curl).user_agent_ref_id, done.id)
@@ -0,0 +1,110 @@
+"""
+Generation of downscaled image renditions for album grids.
+
+Each image ``MediaFile`` gets one ``MediaRendition`` per configured width
+and format (``MEDIA_RENDITION_WIDTHS`` x ``MEDIA_RENDITION_FORMATS``).
+Generation runs as a ``renditions`` job (see ``albums.jobs``), so the
+request never waits for Pillow.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .models import MediaRendition
+
+PIL_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+
+
+def get_rendition_widths():
+    return tuple(getattr(settings, 'MEDIA_RENDITION_WIDTHS', (320, 1024)))
+
+
+def get_rendition_formats():
+    return tuple(getattr(settings, 'MEDIA_RENDITION_FORMATS', ('webp', 'jpeg')))
+
+
+def _target_widths(original_width):
+    # Не увеличиваем изображение; самую маленькую копию делаем всегда
+    widths = sorted(get_rendition_widths())
+    targets = [w for w in widths if w < original_width]
+    if not targets and widths:
+        targets = [min(widths[0], original_width)]
+    return targets
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image_format == 'webp' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    image.save(
+        buffer,
+        PIL_FORMATS[image_format],
+        quality=getattr(settings, 'MEDIA_RENDITION_QUALITY', 82),
+        optimize=image_format == 'jpeg',
+    )
+    return buffer.getvalue()
+
+
+def generate_renditions(media_file, force=False):
+    """
+    Create the missing renditions of an image and return the new ones.
+
+    Existing renditions are kept unless ``force`` is set, so the function
+    is safe to run repeatedly for the same file.
+    """
+    if media_file.file_type != 'image':
+        return []
+
+    existing = {(r.width, r.format): r for r in media_file.renditions.all()}
+    if force:
+        for rendition in existing.values():
+            rendition.file.delete(save=False)
+            rendition.delete()
+        existing = {}
+
+    created = []
+    with media_file.file.open('rb') as source, Image.open(source) as image:
+        # draft() позволяет JPEG-декодеру сразу уменьшить картинку в 2-8 раз
+        largest = max(get_rendition_widths(), default=0)
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+
+        wanted = [
+            (width, image_format)
+            for width in _target_widths(image.width)
+            for image_format in get_rendition_formats()
+            if (width, image_format) not in existing
+        ]
+        if not wanted:
+            return []
+
+        stem = os.path.splitext(os.path.basename(media_file.file.name))[0]
+        for width in sorted({width for width, _ in wanted}, reverse=True):
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            for image_format in get_rendition_formats():
+                if (width, image_format) not in wanted:
+                    continue
+                rendition = MediaRendition(
+                    media_file=media_file,
+                    width=width,
+                    height=height,
+                    format=image_format,
+                )
+                extension = 'jpg' if image_format == 'jpeg' else image_format
+                rendition.file.save(
+                    f'{stem}-{media_file.id.hex[:8]}-{width}w.{extension}',
+                    ContentFile(_encode(resized, image_format)),
+                    save=False,
+                )
+                rendition.save()
+                created.append(rendition)
+    return created
@@ -0,0 +1,175 @@
+"""
+Memoized lookup of ``UserAgent`` dimension rows.
+
+``user_agents.parse`` runs a long regex cascade, while real traffic only
+carries a few hundred distinct UA strings.  Every string is parsed once
+and stored in the ``UserAgent`` table that ``ActivityLog`` references;
+``UserAgentCache`` keeps the rows of recently seen strings in a bounded
+LRU so ``log_activity`` resolves the foreign key without a query.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import user_agents
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+USER_AGENT_FIELDS = (
+    'browser_family',
+    'browser_version',
+    'os_family',
+    'os_version',
+    'device_family',
+    'device_brand',
+    'device_model',
+)
+
+
+def user_agent_hash(user_agent_string):
+    return hashlib.sha256(user_agent_string.encode('utf-8', 'replace')).hexdigest()
+
+
+def parse_user_agent_string(user_agent_string):
+    """Run the full ``user_agents`` parser and return the seven fields."""
+    ua = user_agents.parse(user_agent_string)
+    # Некоторые свойства могут быть None — приводим их к пустой строке,
+    # чтобы избежать ошибок NOT NULL при сохранении в БД.
+    def _safe(attr):
+        return (attr or '')
+
+    return {
+        'browser_family': _safe(getattr(ua.browser, 'family', '')),
+        'browser_version': _safe(getattr(ua.browser, 'version_string', '')),
+        'os_family': _safe(getattr(ua.os, 'family', '')),
+        'os_version': _safe(getattr(ua.os, 'version_string', '')),
+        'device_family': _safe(getattr(ua.device, 'family', '')),
+        'device_brand': _safe(getattr(ua.device, 'brand', '')),
+        'device_model': _safe(getattr(ua.device, 'model', '')),
+    }
+
+
+class UserAgentCache:
+    """
+    Thread-safe LRU keyed on the raw string; values are dicts with the
+    ``UserAgent`` row ``id`` and the seven parsed fields.
+    """
+
+    def __init__(self, maxsize=1024, track_stats=True):
+        self.maxsize = maxsize
+        self.track_stats = track_stats
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+
+    def _cached(self, user_agent_string):
+        with self._lock:
+            info = self._data.get(user_agent_string)
+            if info is not None:
+                self._data.move_to_end(user_agent_string)
+                if self.track_stats:
+                    self.hits += 1
+                return dict(info)
+            if self.track_stats:
+                self.misses += 1
+        return None
+
+    def get(self, user_agent_string):
+        info = self._cached(user_agent_string)
+        if info is None:
+            info = self._fetch(user_agent_string)
+        return info
+
+    def _fetch(self, user_agent_string):
+        info = self._load(user_agent_string)
+
+        if self.maxsize > 0:
+            with self._lock:
+                self._data[user_agent_string] = info
+                self._data.move_to_end(user_agent_string)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return dict(info)
+
+    def get_id(self, user_agent_string):
+        return self.get(user_agent_string)['id']
+
+    async def aget_id(self, user_agent_string):
+        # Попадание в кэш обходится без перехода в поток; промах идёт в БД
+        info = self._cached(user_agent_string)
+        if info is None:
+            info = await sync_to_async(self._fetch)(user_agent_string)
+        return info['id']
+
+    def _load(self, user_agent_string):
+        from .models import UserAgent
+
+        ua_hash = user_agent_hash(user_agent_string)
+        row = UserAgent.objects.filter(hash=ua_hash).values('id', *USER_AGENT_FIELDS).first()
+        if row is not None:
+            if self.track_stats:
+                self.db_hits += 1
+            return row
+
+        info = parse_user_agent_string(user_agent_string)
+        try:
+            with transaction.atomic():
+                user_agent = UserAgent.objects.create(hash=ua_hash, string=user_agent_string, **info)
+        except IntegrityError:
+            # Параллельный запрос уже сохранил эту строку
+            return UserAgent.objects.filter(hash=ua_hash).values('id', *USER_AGENT_FIELDS).get()
+        return {'id': user_agent.id, **info}
+
+    def discard(self, user_agent_string):
+        with self._lock:
+            self._data.pop(user_agent_string, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.db_hits = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'db_hits': self.db_hits,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_agent_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserAgentCache(
+                    maxsize=getattr(settings, 'USER_AGENT_CACHE_SIZE', 1024),
+                    track_stats=getattr(settings, 'USER_AGENT_CACHE_STATS', True),
+                )
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _cache
+    if setting.startswith('USER_AGENT_'):
+        _cache = None
+
+
+@receiver(post_delete, sender='albums.UserAgent')
+def _discard_deleted_user_agent(sender, instance, **kwargs):
+    if _cache is not None:
+        _cache.discard(instance.string)
@@ -1,8 +1,32 @@
-import user_agents
+import os
+
+from asgiref.sync import sync_to_async
+from django.urls import reverse
 from django.utils import timezone
 from django.contrib.sessions.models import Session
 from django.contrib.contenttypes.models import ContentType
-from .models import ActivityLog
+from .access import aremember_access, bump_access_version, remember_access
+from .models import Album, ActivityLog, AlbumAccessGrant, MediaFile
+from .instrumentation import timed
+from .logsink import get_log_sink
+from .uacache import get_user_agent_cache
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.heic', '.heif', '.avif'}
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.avi', '.mov', '.wmv', '.webm', '.mkv'}
+
+def guess_file_type_from_name(filename):
+    """
+    Return 'image', 'video' or '' judging by the final extension only.
+
+    Used where the content is not available yet (e.g. before a chunked
+    upload starts); stored files are classified by ``albums.probe``.
+    """
+    extension = os.path.splitext(filename.lower())[1]
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    return ''
 
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -13,61 +37,132 @@ def get_client_ip(request):
     return ip
 
 def parse_user_agent(user_agent_string):
-    ua = user_agents.parse(user_agent_string)
-    # Некоторые свойства могут быть None — приводим их к пустой строке,
-    # чтобы избежать ошибок NOT NULL при сохранении в БД.
-    def _safe(attr):
-        return (attr or '')
-
-    return {
-        'browser_family': _safe(getattr(ua.browser, 'family', '')),
-        'browser_version': _safe(getattr(ua.browser, 'version_string', '')),
-        'os_family': _safe(getattr(ua.os, 'family', '')),
-        'os_version': _safe(getattr(ua.os, 'version_string', '')),
-        'device_family': _safe(getattr(ua.device, 'family', '')),
-        'device_brand': _safe(getattr(ua.device, 'brand', '')),
-        'device_model': _safe(getattr(ua.device, 'model', '')),
-    }
-
-def log_activity(request, action, user=None, album=None, media_file=None):
-    ip = get_client_ip(request)
-    user_agent_info = parse_user_agent(request.META.get('HTTP_USER_AGENT', ''))
-    
-    # Определяем content_object для универсальной связи и URL
-    content_type = None
+    """Return the ``UserAgent`` row id and parsed fields, memoized per UA string."""
+    return get_user_agent_cache().get(user_agent_string)
+
+# id типов контента для журнала; заполняется при первом обращении и
+# сбрасывается после migrate (в тестовой базе id могут отличаться)
+_content_type_ids = {}
+
+def get_content_type_id(model):
+    """ContentType id for ``model``, looked up once per process."""
+    label = model._meta.label_lower
+    if label not in _content_type_ids:
+        _content_type_ids[label] = ContentType.objects.get_for_model(model).id
+    return _content_type_ids[label]
+
+def clear_content_type_ids():
+    _content_type_ids.clear()
+
+async def aget_content_type_id(model):
+    label = model._meta.label_lower
+    if label in _content_type_ids:
+        return _content_type_ids[label]
+    return await sync_to_async(get_content_type_id)(model)
+
+def _content_model(album, media_file):
+    # Приоритет: media_file > album
+    if media_file:
+        return MediaFile
+    if album:
+        return Album
+    return None
+
+def _make_log_entry(request, action, user, album, media_file, count, user_agent_id, content_type_id):
+    # Определяем content_object для универсальной связи и URL.
+    # Только id — без запросов к связанным объектам
     object_id = None
     content_url = None
-    
-    # Приоритет: media_file > album
     if media_file:
-        content_type = ContentType.objects.get_for_model(media_file)
         object_id = media_file.id
-        # Генерируем URL на файл
         if hasattr(request, 'build_absolute_uri'):
-            content_url = request.build_absolute_uri(f'/albums/{media_file.album.id}/media/{media_file.id}/')
+            content_url = request.build_absolute_uri(reverse('view_media', args=[media_file.album_id, media_file.id]))
     elif album:
-        content_type = ContentType.objects.get_for_model(album)
         object_id = album.id
-        # Генерируем URL на альбом
         if hasattr(request, 'build_absolute_uri'):
-            content_url = request.build_absolute_uri(f'/albums/{album.id}/')
+            content_url = request.build_absolute_uri(reverse('album_detail', args=[album.id]))
     
-    log_entry = ActivityLog(
+    return ActivityLog(
         user=user,
         action=action,
-        ip_address=ip,
-        user_agent=request.META.get('HTTP_USER_AGENT', ''),
+        ip_address=get_client_ip(request),
+        user_agent_id=user_agent_id,
         referrer=request.META.get('HTTP_REFERER', ''),
         album=album,
         media_file=media_file,
-        content_type=content_type,
+        content_type_id=content_type_id,
         object_id=object_id,
         content_url=content_url,
-        **user_agent_info
+        item_count=count,
     )
-    log_entry.save()
+
+@timed('log')
+def log_activity(request, action, user=None, album=None, media_file=None, count=1):
+    # Строка UA хранится в таблице-измерении; из кэша берётся только id
+    user_agent_id = get_user_agent_cache().get_id(request.META.get('HTTP_USER_AGENT', ''))
+    model = _content_model(album, media_file)
+    content_type_id = get_content_type_id(model) if model else None
+    
+    log_entry = _make_log_entry(request, action, user, album, media_file, count, user_agent_id, content_type_id)
+    # Запись выполняет настроенный приёмник (синхронно или фоновой пачкой)
+    get_log_sink().write(log_entry)
     return log_entry
 
+async def alog_activity(request, action, user=None, album=None, media_file=None, count=1):
+    """
+    ``log_activity`` for async views: with warm caches and the queued
+    sink nothing leaves the event loop.
+    """
+    with timed('log'):
+        user_agent_id = await get_user_agent_cache().aget_id(request.META.get('HTTP_USER_AGENT', ''))
+        model = _content_model(album, media_file)
+        content_type_id = await aget_content_type_id(model) if model else None
+        
+        log_entry = _make_log_entry(request, action, user, album, media_file, count, user_agent_id, content_type_id)
+        await get_log_sink().awrite(log_entry)
+        return log_entry
+
+ALBUM_SESSION_KEY_PREFIXES = ('album_view_', 'album_access_')
+
+def grant_album_access(request, album):
+    """
+    Mark the current session as allowed to view the album and record the
+    grant so it can be revoked without scanning every session.
+    """
+    request.session[f'album_view_{album.id}'] = True
+    if not request.session.session_key:
+        request.session.save()
+    AlbumAccessGrant.objects.bulk_create(
+        [AlbumAccessGrant(album_id=album.id, session_key=request.session.session_key)],
+        ignore_conflicts=True,
+    )
+    remember_access(request, album)
+
+async def agrant_album_access(request, album):
+    """Async version of ``grant_album_access``."""
+    await request.session.aset(f'album_view_{album.id}', True)
+    if not request.session.session_key:
+        await request.session.asave()
+    await AlbumAccessGrant.objects.abulk_create(
+        [AlbumAccessGrant(album_id=album.id, session_key=request.session.session_key)],
+        ignore_conflicts=True,
+    )
+    await aremember_access(request, album)
+
+def register_session_grants(session_key, session_data):
+    """Record grants for every album access key found in the session data."""
+    album_ids = set()
+    for key in session_data:
+        for prefix in ALBUM_SESSION_KEY_PREFIXES:
+            if key.startswith(prefix):
+                album_ids.add(key[len(prefix):])
+    if not album_ids:
+        return 0
+    existing = Album.objects.filter(id__in=album_ids).values_list('id', flat=True)
+    grants = [AlbumAccessGrant(album_id=album_id, session_key=session_key) for album_id in existing]
+    AlbumAccessGrant.objects.bulk_create(grants, ignore_conflicts=True)
+    return len(grants)
+
 def invalidate_album_sessions(album_id, exclude_session_key=None):
     """
     Invalidate all sessions that have access to an album.
@@ -77,26 +172,11 @@ def invalidate_album_sessions(album_id, exclude_session_key=None):
         album_id: UUID of the album
         exclude_session_key: Optional session key to exclude (e.g., owner's current session)
     """
-    from django.contrib.sessions.models import Session
-    import json
-    
-    session_keys_to_delete = []
-    
-    # Iterate through all active sessions
-    for session in Session.objects.all():
-        session_data = session.get_decoded()
-        
-        # Check if session has album access keys
-        view_key = f'album_view_{album_id}'
-        access_key = f'album_access_{album_id}'
-        
-        if view_key in session_data or access_key in session_data:
-            # Skip owner's session if provided
-            if exclude_session_key and session.session_key == exclude_session_key:
-                continue
-            
-            session_keys_to_delete.append(session.session_key)
-    
-    # Delete sessions
-    if session_keys_to_delete:
-        Session.objects.filter(session_key__in=session_keys_to_delete).delete()
\ No newline at end of file
+    grants = AlbumAccessGrant.objects.filter(album_id=album_id)
+    if exclude_session_key:
+        grants = grants.exclude(session_key=exclude_session_key)
+
+    Session.objects.filter(session_key__in=grants.values('session_key')).delete()
+    grants.delete()
+    # Решения, закэшированные до удаления сессий, больше не действуют
+    bump_access_version(album_id)
@@ -1,13 +1,40 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import json
+import mimetypes
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.urls import reverse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm
 from django.http import JsonResponse, Http404
+from django.views.decorators.http import require_http_methods, require_POST
+from django.template.loader import render_to_string
 from django.db.models import Q
 from django.utils import timezone
-from .models import Album, MediaFile, ActivityLog
-from .forms import AlbumForm, MediaUploadForm, AlbumAccessForm
-from .utils import log_activity, invalidate_album_sessions
+from django.utils.cache import patch_cache_control
+from .models import Album, MediaFile, MediaRendition, ActivityLog, ChunkedUpload
+from .serving import serve_file
+from .blobs import acquire_blobs, adopt_file, attach_blob, removing_on_error, uploaded_digest, write_blob
+from .chunked import ChunkError, start_upload, append_chunk, verify_upload, discard_upload, release_upload, get_max_chunk_size
+from .forms import AlbumForm, MediaUploadForm, MediaBatchUploadForm, AlbumAccessForm
+from .conditional import aalbum_list_validators, aalbum_validators, not_modified_response, set_validators
+from .access import acheck_album_access, check_album_access
+from .feed import aget_feed_page
+from .cache import aget_or_render_grid, bump_album_version, get_or_render_grid
+from .listing import annotate_album_cards, get_cover_url
+from .pagination import DEFAULT_SORT, SORT_KEYS, apaginate_albums, apaginate_media, paginate_media
+from .jobs import enqueue_media_processing, enqueue_bulk, initial_processing_status
+from .probe import apply_probe, probe_file
+from .instrumentation import collect_snapshots, merge_snapshots, summarize
+from .stats import aalbum_totals, aalbums_totals
+from .utils import agrant_album_access, alog_activity, log_activity, invalidate_album_sessions, guess_file_type_from_name
 
 def register(request):
     if request.method == 'POST':
@@ -22,11 +49,54 @@ def register(request):
         form = UserCreationForm()
     return render(request, 'registration/register.html', {'form': form})
 
+async def aget_user(request):
+    """
+    Resolve the user once for an async view and put it on ``request.user``,
+    so templates and ETags do not trigger the lazy sync lookup.
+    """
+    request.user = await request.auser()
+    return request.user
+
 @login_required
-def album_list(request):
-    albums = Album.objects.filter(owner=request.user, is_deleted=False)
-    log_activity(request, 'album_view', user=request.user)
-    return render(request, 'albums/album_list.html', {'albums': albums})
+async def album_list(request):
+    user = await aget_user(request)
+    albums = Album.objects.filter(owner=user, is_deleted=False)
+    etag, last_modified = await aalbum_list_validators(request, albums)
+    await alog_activity(request, 'album_view', user=user)
+    
+    response = not_modified_response(request, etag, last_modified)
+    if response is None:
+        # Одна страница карточек — один запрос; шаблон к БД не обращается
+        try:
+            page, next_cursor = await apaginate_albums(
+                annotate_album_cards(albums), cursor=request.GET.get('cursor'),
+            )
+        except ValueError:
+            raise Http404('Invalid cursor')
+        for album in page:
+            album.cover_url = get_cover_url(album)
+        response = render(request, 'albums/album_list.html', {
+            'albums': page,
+            'next_cursor': next_cursor,
+            'is_first_page': not request.GET.get('cursor'),
+        })
+    return set_validators(response, etag, last_modified)
+
+async def public_feed(request):
+    """Public albums ranked by recent activity; open to anonymous visitors."""
+    await aget_user(request)
+    query = request.GET.get('q', '').strip()[:100]
+    cursor = request.GET.get('cursor')
+    try:
+        page = await aget_feed_page(query, cursor)
+    except ValueError:
+        raise Http404('Invalid cursor')
+    return render(request, 'albums/public_feed.html', {
+        'albums': page['albums'],
+        'next_cursor': page['next_cursor'],
+        'query': query,
+        'is_first_page': not cursor,
+    })
 
 @login_required
 def create_album(request):
@@ -42,25 +112,125 @@ def create_album(request):
         form = AlbumForm()
     return render(request, 'albums/create_album.html', {'form': form})
 
-def album_detail(request, album_id):
-    album = get_object_or_404(Album, id=album_id, is_deleted=False)
+def get_media_sort(request):
+    sort = request.GET.get('sort', DEFAULT_SORT)
+    return sort if sort in SORT_KEYS else DEFAULT_SORT
+
+def get_visible_media(album):
+    return album.media_files.filter(is_deleted=False).prefetch_related('renditions')
+
+def get_media_page(request, album):
+    """Return the page of album media requested by the ``cursor`` parameter."""
+    try:
+        return paginate_media(get_visible_media(album), cursor=request.GET.get('cursor'), sort=get_media_sort(request))
+    except ValueError:
+        raise Http404('Invalid cursor')
+
+async def aget_media_page(request, album):
+    try:
+        return await apaginate_media(get_visible_media(album), cursor=request.GET.get('cursor'), sort=get_media_sort(request))
+    except ValueError:
+        raise Http404('Invalid cursor')
+
+def render_media_grid(album, media_files, next_cursor):
+    html = render_to_string('albums/_media_cards.html', {
+        'album': album,
+        'media_files': media_files,
+    })
+    return {
+        'html': html,
+        'next_cursor': next_cursor,
+        'count': len(media_files),
+        'media_ids': [str(media.id) for media in media_files],
+    }
+
+def get_owner_actions(album, grid):
+    """Delete URLs of the grid's media, keyed by id; rendered only for the owner."""
+    return {media_id: reverse('delete_media', args=[album.id, media_id]) for media_id in grid['media_ids']}
+
+def get_media_grid(request, album):
+    """Rendered media cards for the requested page, served from the album cache."""
+    def render_grid():
+        return render_media_grid(album, *get_media_page(request, album))
+    
+    return get_or_render_grid(album.id, get_media_sort(request), request.GET.get('cursor'), render_grid)
+
+async def aget_media_grid(request, album):
+    async def render_grid():
+        return render_media_grid(album, *await aget_media_page(request, album))
+    
+    return await aget_or_render_grid(album.id, get_media_sort(request), request.GET.get('cursor'), render_grid)
+
+async def album_detail(request, album_id):
+    album = await aget_object_or_404(Album, id=album_id, is_deleted=False)
+    user = await aget_user(request)
     
     # Проверка доступа
-    if not check_album_access(request, album):
+    if not await acheck_album_access(request, album, user):
         return redirect('album_access', album_id=album.id)
     
-    log_activity(request, 'album_view', 
-                user=request.user if request.user.is_authenticated else None, 
-                album=album)
+    is_owner = user.is_authenticated and album.owner_id == user.pk
+    etag, last_modified = await aalbum_validators(request, album)
+    
+    # Просмотр логируется и тогда, когда браузер получает 304
+    await alog_activity(request, 'album_view', 
+                        user=user if user.is_authenticated else None, 
+                        album=album)
     
-    return render(request, 'albums/album_detail.html', {
+    public = is_publicly_cacheable(album)
+    response = not_modified_response(request, etag, last_modified)
+    if response is not None:
+        return set_validators(response, etag, last_modified, public=public)
+    
+    grid = await aget_media_grid(request, album)
+    # Счётчики не входят в ETag: страница обновляет их через album_stats
+    stats = await aalbum_totals(album.id) if is_owner else None
+    response = render(request, 'albums/album_detail.html', {
         'album': album,
-        'media_files': album.media_files.filter(is_deleted=False)
+        'is_owner': is_owner,
+        'grid_html': grid['html'],
+        'has_media': grid['count'] > 0,
+        'next_cursor': grid['next_cursor'],
+        'is_first_page': not request.GET.get('cursor'),
+        'sort': get_media_sort(request),
+        'stats': stats,
+        'owner_actions': get_owner_actions(album, grid) if is_owner else None,
     })
+    return set_validators(response, etag, last_modified, public=public)
+
+@login_required
+async def album_stats(request):
+    """
+    Live view counters of the user's albums (``?album=<id>``, repeated).
+    Pages keep them out of their validators and refresh them from here.
+    """
+    user = await aget_user(request)
+    try:
+        album_ids = [uuid.UUID(value) for value in request.GET.getlist('album')[:100]]
+    except ValueError:
+        raise Http404('Invalid album id')
+    totals = await aalbums_totals(user, album_ids)
+    response = JsonResponse({'albums': {str(album_id): counters for album_id, counters in totals.items()}})
+    patch_cache_control(response, private=True, no_store=True)
+    return response
 
-def album_access(request, album_id):
+def album_media_page(request, album_id):
+    """JSON fragment with the next page of media cards for infinite scroll."""
     album = get_object_or_404(Album, id=album_id, is_deleted=False)
     
+    if not check_album_access(request, album):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    
+    grid = get_media_grid(request, album)
+    data = {'html': grid['html'], 'next_cursor': grid['next_cursor']}
+    if request.user.is_authenticated and album.owner_id == request.user.pk:
+        data['owner_actions'] = get_owner_actions(album, grid)
+    return JsonResponse(data)
+
+async def album_access(request, album_id):
+    album = await aget_object_or_404(Album, id=album_id, is_deleted=False)
+    await aget_user(request)
+    
     if request.method == 'POST':
         form = AlbumAccessForm(request.POST)
         if form.is_valid():
@@ -68,12 +238,12 @@ def album_access(request, album_id):
             
             # Проверка пароля для просмотра
             if album.view_password and album.view_password == password:
-                request.session[f'album_view_{album.id}'] = True
-                log_activity(request, 'password_view', album=album)
+                await agrant_album_access(request, album)
+                await alog_activity(request, 'password_view', album=album)
                 return redirect('album_detail', album_id=album.id)
             
             # Логирование неудачной попытки ввода пароля
-            log_activity(request, 'password_view', album=album)
+            await alog_activity(request, 'password_view', album=album)
             form.add_error('password', 'Неверный пароль')
     else:
         form = AlbumAccessForm()
@@ -83,25 +253,6 @@ def album_access(request, album_id):
         'form': form
     })
 
-def check_album_access(request, album):
-    # Владелец имеет полный доступ
-    if request.user.is_authenticated and album.owner == request.user:
-        return True
-    
-    # Публичный альбом без пароля
-    if album.is_public and not album.view_password:
-        return True
-    
-    # Проверка сессии для доступа к просмотру
-    if request.session.get(f'album_view_{album.id}'):
-        return True
-    
-    # Альбом защищён паролем просмотра - требует пароль
-    if album.view_password:
-        return False
-    
-    return False
-
 @login_required
 def upload_media(request, album_id):
     album = get_object_or_404(Album, id=album_id, owner=request.user, is_deleted=False)
@@ -112,14 +263,16 @@ def upload_media(request, album_id):
             media_file = form.save(commit=False)
             media_file.album = album
             
-            # Определение типа файла
-            file_type = media_file.file.name.lower()
-            if any(ext in file_type for ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']):
-                media_file.file_type = 'image'
-            elif any(ext in file_type for ext in ['.mp4', '.avi', '.mov', '.wmv']):
-                media_file.file_type = 'video'
+            # Тип и метаданные определены по содержимому при валидации формы
+            apply_probe(media_file, form.probe)
             
-            media_file.save()
+            # Записанный файл удаляется, если транзакция не зафиксирована
+            with removing_on_error([]) as written, transaction.atomic():
+                name = attach_blob(media_file, form.cleaned_data['file'])
+                if name:
+                    written.append(name)
+                media_file.save()
+            enqueue_media_processing(media_file)
             log_activity(request, 'media_upload', user=request.user, album=album, media_file=media_file)
             return redirect('album_detail', album_id=album.id)
     else:
@@ -127,7 +280,198 @@ def upload_media(request, album_id):
     
     return render(request, 'albums/upload_media.html', {
         'form': form,
-        'album': album
+        'album': album,
+        'chunk_size': getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+        'chunked_threshold': getattr(settings, 'CHUNKED_UPLOAD_THRESHOLD', 50 * 1024 * 1024),
+    })
+
+def save_uploaded_files(files):
+    """
+    Write the blobs of ``{digest: uploaded_file}`` concurrently; return
+    the storage names written (contents already stored are skipped).
+    """
+    workers = getattr(settings, 'BATCH_UPLOAD_WORKERS', 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write_blob, uploaded_file, digest) for digest, uploaded_file in files.items()]
+    
+    names, errors = [], []
+    for future in futures:
+        try:
+            name = future.result()
+        except Exception as exc:
+            errors.append(exc)
+        else:
+            if name:
+                names.append(name)
+    if errors:
+        # Не оставляем в хранилище часть пакета
+        for name in names:
+            default_storage.delete(name)
+        raise errors[0]
+    return names
+
+@login_required
+def upload_media_batch(request, album_id):
+    """Upload many files at once: one INSERT for files, one for jobs, one log entry."""
+    album = get_object_or_404(Album, id=album_id, owner=request.user, is_deleted=False)
+    
+    if request.method == 'POST':
+        form = MediaBatchUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            files = form.cleaned_data['files']
+            digests = [uploaded_digest(uploaded_file) for uploaded_file in files]
+            
+            with removing_on_error([]) as written, transaction.atomic():
+                # Ссылки на Blob берутся в той же транзакции, что и создание файлов
+                blobs = acquire_blobs([(digest, uploaded_file.size) for digest, uploaded_file in zip(digests, files)])
+                written.extend(save_uploaded_files(dict(zip(digests, files))))
+                media_files = []
+                for probe, digest, uploaded_file in zip(form.probes, digests, files):
+                    media_file = apply_probe(MediaFile(
+                        album=album,
+                        file=blobs[digest].file.name,
+                        blob=blobs[digest],
+                        original_name=os.path.basename(uploaded_file.name),
+                        description=form.cleaned_data['description'],
+                    ), probe)
+                    media_file.processing_status = initial_processing_status(media_file)
+                    media_files.append(media_file)
+                MediaFile.objects.bulk_create(media_files)
+                enqueue_bulk(media_files)
+            # bulk_create не отправляет post_save — сбрасываем кэш альбома сами
+            bump_album_version(album.id)
+            
+            log_activity(request, 'media_upload', user=request.user, album=album, count=len(media_files))
+            return redirect('album_detail', album_id=album.id)
+    else:
+        form = MediaBatchUploadForm()
+    
+    return render(request, 'albums/upload_media_batch.html', {
+        'form': form,
+        'album': album,
+    })
+
+def chunked_upload_state(upload):
+    return {
+        'upload_id': str(upload.id),
+        'offset': upload.offset,
+        'total_size': upload.total_size,
+        'status': upload.status,
+        'max_chunk_size': get_max_chunk_size(),
+    }
+
+@login_required
+@require_POST
+def chunked_upload_start(request, album_id):
+    """Create a resumable upload; body is JSON with filename, size and optional sha256."""
+    album = get_object_or_404(Album, id=album_id, owner=request.user, is_deleted=False)
+    
+    try:
+        payload = json.loads(request.body)
+        filename = str(payload['filename'])
+        total_size = int(payload['size'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'filename and size are required'}, status=400)
+    if total_size <= 0 or not guess_file_type_from_name(filename):
+        return JsonResponse({'error': 'Unsupported file'}, status=400)
+    
+    upload = start_upload(
+        album, request.user, filename, total_size,
+        checksum=str(payload.get('sha256', '')),
+        description=str(payload.get('description', '')),
+    )
+    return JsonResponse(chunked_upload_state(upload), status=201)
+
+@login_required
+@require_http_methods(['GET', 'PATCH', 'DELETE'])
+def chunked_upload_detail(request, album_id, upload_id):
+    """
+    GET returns the current offset (for resuming), PATCH appends the raw
+    request body at the ``Upload-Offset`` header, DELETE abandons the upload.
+    """
+    upload = get_object_or_404(
+        ChunkedUpload, id=upload_id, album_id=album_id, owner=request.user, album__is_deleted=False,
+    )
+    
+    if request.method == 'DELETE':
+        if upload.status == 'uploading':
+            discard_upload(upload)
+        return JsonResponse(chunked_upload_state(upload))
+    
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Upload-Offset and Content-Length are required'}, status=400)
+        try:
+            append_chunk(upload, offset, request, length)
+        except ChunkError as exc:
+            return JsonResponse({'error': str(exc), **chunked_upload_state(upload)}, status=exc.status)
+    
+    return JsonResponse(chunked_upload_state(upload))
+
+@login_required
+@require_POST
+def chunked_upload_finalize(request, album_id, upload_id):
+    """Verify the assembled file and turn it into a MediaFile."""
+    upload = get_object_or_404(
+        ChunkedUpload, id=upload_id, album_id=album_id, owner=request.user, album__is_deleted=False,
+    )
+    album = upload.album
+    
+    # Завершение захватывается условным UPDATE: повторный запрос (например,
+    # после таймаута клиента) не создаст второй MediaFile для той же загрузки
+    claimed = ChunkedUpload.objects.filter(id=upload.id, status='uploading').update(
+        status='finalizing', updated_at=timezone.now(),
+    )
+    if not claimed:
+        upload.refresh_from_db()
+        if upload.status == 'complete':
+            return JsonResponse({'media_id': str(upload.media_file_id), **chunked_upload_state(upload)})
+        return JsonResponse({'error': 'Upload is not in progress', **chunked_upload_state(upload)}, status=409)
+    upload.status = 'finalizing'
+    
+    try:
+        try:
+            digest = verify_upload(upload, checksum=request.POST.get('sha256', ''))
+        except ChunkError as exc:
+            if upload.status == 'finalizing':
+                release_upload(upload)
+            return JsonResponse({'error': str(exc), **chunked_upload_state(upload)}, status=exc.status)
+        
+        with default_storage.open(upload.file_name, 'rb') as stored:
+            probe = probe_file(stored)
+        if not probe['file_type']:
+            discard_upload(upload)
+            return JsonResponse({'error': 'Unsupported file', **chunked_upload_state(upload)}, status=400)
+        
+        with transaction.atomic():
+            blob = acquire_blobs([(digest, upload.total_size)])[digest]
+            media_file = apply_probe(MediaFile(
+                album=album,
+                file=blob.file.name,
+                blob=blob,
+                original_name=upload.filename,
+                description=upload.description,
+            ), probe)
+            media_file.save()
+            upload.status = 'complete'
+            upload.media_file = media_file
+            upload.save(update_fields=['status', 'media_file', 'updated_at'])
+            # Последним шагом: если перенос не удался, запись откатится, а файл останется на месте
+            adopt_file(upload.file_name, digest)
+    except Exception:
+        # Файл на месте — клиент может повторить завершение
+        release_upload(upload)
+        raise
+    enqueue_media_processing(media_file)
+    log_activity(request, 'media_upload', user=request.user, album=album, media_file=media_file)
+    
+    return JsonResponse({
+        'media_id': str(media_file.id),
+        'album_url': reverse('album_detail', args=[album.id]),
+        **chunked_upload_state(upload),
     })
 
 @login_required
@@ -175,12 +519,12 @@ def edit_album(request, album_id):
         
         form = AlbumForm(request.POST, instance=album)
         if form.is_valid():
+            # Сохранение альбома сбрасывает кэш решений о доступе (signals)
             form.save()
             log_activity(request, 'album_edit', user=request.user, album=album)
             
             # Invalidate sessions if view_password changed
-            new_album = Album.objects.get(id=album_id)
-            if old_view_password != new_album.view_password:
+            if old_view_password != album.view_password:
                 # Invalidate all other users' sessions for this album, 
                 # except the current user's session
                 invalidate_album_sessions(album_id, exclude_session_key=request.session.session_key)
@@ -198,27 +542,66 @@ def get_album_share_url(request, album):
     """Generate full share URL for album."""
     return request.build_absolute_uri(f'/albums/{album.id}/')
 
-def view_media(request, album_id, media_id):
+async def view_media(request, album_id, media_id):
     """View media file with logging."""
-    album = get_object_or_404(Album, id=album_id, is_deleted=False)
-    media_file = get_object_or_404(MediaFile, id=media_id, album=album, is_deleted=False)
+    album = await aget_object_or_404(Album, id=album_id, is_deleted=False)
+    media_file = await aget_object_or_404(MediaFile, id=media_id, album=album, is_deleted=False)
+    user = await aget_user(request)
     
     # Проверка доступа
-    if not check_album_access(request, album):
+    if not await acheck_album_access(request, album, user):
         return redirect('album_access', album_id=album.id)
     
     # Логирование просмотра фото
-    log_activity(request, 'media_view', 
-                user=request.user if request.user.is_authenticated else None, 
-                album=album, 
-                media_file=media_file)
+    await alog_activity(request, 'media_view', 
+                        user=user if user.is_authenticated else None, 
+                        album=album, 
+                        media_file=media_file)
     
-    # Редирект на файл
-    return redirect(media_file.file.url)
+    # Редирект на файл: байты отдаёт media_file_content с проверкой доступа
+    return redirect('media_file_content', album_id=album.id, media_id=media_file.id)
+
+def is_publicly_cacheable(album):
+    return album.is_public and not album.view_password
+
+def media_file_content(request, album_id, media_id):
+    """Serve the original file with Range and conditional GET support."""
+    album = get_object_or_404(Album, id=album_id, is_deleted=False)
+    media_file = get_object_or_404(MediaFile, id=media_id, album=album, is_deleted=False)
+    
+    if not check_album_access(request, album):
+        raise Http404('Media not found')
+    
+    # Файлы хранятся под хэшем без расширения: тип берём из записи
+    content_type = media_file.mime_type or mimetypes.guess_type(media_file.original_name or '')[0]
+    return serve_file(request, media_file.file, public=is_publicly_cacheable(album), content_type=content_type)
+
+def media_rendition_content(request, album_id, media_id, rendition_id):
+    """Serve a downscaled copy of an image."""
+    album = get_object_or_404(Album, id=album_id, is_deleted=False)
+    rendition = get_object_or_404(
+        MediaRendition, id=rendition_id, media_file_id=media_id,
+        media_file__album=album, media_file__is_deleted=False,
+    )
+    
+    if not check_album_access(request, album):
+        raise Http404('Media not found')
+    
+    return serve_file(
+        request, rendition.file, public=is_publicly_cacheable(album), content_type=f'image/{rendition.format}',
+    )
 
 @login_required
 def logout_view(request):
     """Logout user and log the event."""
     log_activity(request, 'logout', user=request.user)
     logout(request)
-    return redirect('home')
\ No newline at end of file
+    return redirect('home')
+
+@staff_member_required
+def request_metrics(request):
+    """Per-view request timings of all processes that published them, as JSON."""
+    merged = merge_snapshots(collect_snapshots())
+    if request.GET.get('raw'):
+        return JsonResponse(merged)
+    return JsonResponse({'processes': merged['processes'], 'views': summarize(merged)})
@@ -18,6 +18,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы время запроса включало остальные middleware
+    'albums.middleware.ActivityLoggingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -25,14 +27,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'albums.middleware.ActivityLoggingMiddleware',
 ]
 
 ROOT_URLCONF = 'photogallery.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с учётом времени рендеринга в метриках запроса
+        'BACKEND': 'albums.instrumentation.InstrumentedTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -59,4 +61,113 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 LOGIN_REDIRECT_URL = '/albums/'
-LOGOUT_REDIRECT_URL = '/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/'
+
+# Журнал активности: 'queued' — фоновая пакетная запись, 'sync' — запись в запросе
+ACTIVITY_LOG_SINK = os.environ.get('ACTIVITY_LOG_SINK', 'queued')
+ACTIVITY_LOG_QUEUE_SIZE = 10000
+ACTIVITY_LOG_BATCH_SIZE = 100
+ACTIVITY_LOG_FLUSH_INTERVAL_MS = 500
+# 'drop' — отбрасывать записи при переполнении очереди, 'block' — ждать
+ACTIVITY_LOG_OVERFLOW = 'drop'
+
+# Обновлять сводную статистику альбомов (AlbumDailyStats) при записи журнала
+ACTIVITY_STATS_ENABLED = True
+
+# Срок хранения записей журнала (в днях) по типам действий; None — хранить
+# всегда. Просроченные записи команда archive_activity_log переносит в
+# сжатые архивы (gzip, zstd при установленном zstandard, none)
+ACTIVITY_LOG_RETENTION_DAYS = {
+    'default': 365,
+    'album_view': 90,
+    'media_view': 90,
+}
+ACTIVITY_LOG_ARCHIVE_DIR = BASE_DIR / 'archive'
+ACTIVITY_LOG_ARCHIVE_COMPRESSION = 'gzip'
+
+# Админка журнала: точный подсчёт строк с фильтром останавливается на этом
+# числе, без фильтра используется оценка размера таблицы
+ACTIVITY_LOG_ADMIN_COUNT_LIMIT = 10000
+
+# Выгрузка журнала (действие админки и команда export_activity_log):
+# размер пачки при чтении и сжатие gzip для выгрузки из админки
+ACTIVITY_LOG_EXPORT_CHUNK_SIZE = 2000
+ACTIVITY_LOG_EXPORT_GZIP = True
+
+# Кэш строк таблицы UserAgent: размер LRU и сбор статистики попаданий
+USER_AGENT_CACHE_SIZE = 1024
+USER_AGENT_CACHE_STATS = True
+
+# Количество медиа-файлов на странице альбома
+MEDIA_PAGE_SIZE = 30
+
+# Количество альбомов на странице списка
+ALBUM_LIST_PAGE_SIZE = 24
+
+# Уменьшенные копии изображений для сетки альбома
+MEDIA_RENDITION_WIDTHS = (320, 1024)
+MEDIA_RENDITION_FORMATS = ('webp', 'jpeg')
+MEDIA_RENDITION_QUALITY = 82
+
+# Фоновая обработка медиа (manage.py run_media_worker)
+MEDIA_JOB_WORKERS = 2
+MEDIA_JOB_MAX_ATTEMPTS = 5
+# Задержка перед повтором: 30 с, 60 с, 120 с ... но не больше часа
+MEDIA_JOB_RETRY_BACKOFF = 30
+MEDIA_JOB_RETRY_MAX_DELAY = 3600
+# Через сколько секунд зависшая задача возвращается в очередь
+MEDIA_JOB_STALE_TIMEOUT = 600
+
+# Возобновляемая загрузка больших файлов частями
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+# Файлы больше этого размера страница загрузки отправляет частями
+CHUNKED_UPLOAD_THRESHOLD = 50 * 1024 * 1024
+
+# Пакетная загрузка: максимум файлов в запросе и потоков записи в хранилище
+BATCH_UPLOAD_MAX_FILES = 100
+BATCH_UPLOAD_WORKERS = 4
+
+# Загрузки хэшируются (SHA-256) по мере приёма, одинаковые файлы хранятся
+# один раз в media/blobs/. Байты удаляет команда purge_deleted_media, когда
+# удалённые файлы старше MEDIA_PURGE_AFTER_DAYS дней и на Blob больше нет ссылок
+FILE_UPLOAD_HANDLERS = [
+    'albums.blobs.HashingMemoryFileUploadHandler',
+    'albums.blobs.HashingTemporaryFileUploadHandler',
+]
+MEDIA_PURGE_AFTER_DAYS = 30
+
+# Отдача медиа-файлов: None — байты отдаёт Django (с поддержкой Range),
+# 'nginx' — X-Accel-Redirect на внутренний location, 'apache' — X-Sendfile
+MEDIA_SENDFILE_BACKEND = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_PUBLIC_MAX_AGE = 86400
+MEDIA_PRIVATE_MAX_AGE = 3600
+
+# Кэш отрендеренной сетки альбома. В продакшене с несколькими процессами
+# нужен общий бэкенд (Redis, Memcached или FileBasedCache).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+ALBUMS_CACHE_ALIAS = 'default'
+ALBUMS_GRID_CACHE_TIMEOUT = 3600
+# Сколько секунд кэшируется решение о доступе к альбому по паролю (сессия)
+ALBUM_ACCESS_CACHE_TIMEOUT = 60
+
+# Лента публичных альбомов. Рейтинг пересчитывает команда refresh_album_feed
+# (запускать по расписанию, например раз в 10 минут): просмотры за последние
+# FEED_RANKING_DAYS дней с затуханием вдвое за FEED_RANKING_HALF_LIFE_DAYS дней
+FEED_RANKING_DAYS = 14
+FEED_RANKING_HALF_LIFE_DAYS = 3
+FEED_CACHE_TIMEOUT = 60
+
+# Метрики запросов: заголовок Server-Timing и гистограммы по именам URL.
+# Процессы раз в REQUEST_METRICS_PUBLISH_INTERVAL секунд кладут свои
+# гистограммы в кэш альбомов; их объединяют команда request_metrics и
+# /admin/metrics/requests/ (нужен общий кэш, чтобы видеть все процессы)
+REQUEST_METRICS_ENABLED = True
+REQUEST_METRICS_SERVER_TIMING = True
+REQUEST_METRICS_PUBLISH_INTERVAL = 30
+REQUEST_METRICS_TTL = 3600
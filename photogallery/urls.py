@@ -2,11 +2,10 @@ from django.urls import path, include
 from django.contrib import admin
 from django.contrib.auth.views import LoginView
 from django.views.generic import RedirectView
-from django.conf import settings
-from django.conf.urls.static import static
 from albums import views
 
 urlpatterns = [
+    path('admin/metrics/requests/', views.request_metrics, name='request_metrics'),
     path('admin/', admin.site.urls),
     path('register/', views.register, name='register'),
     path('logout/', views.logout_view, name='logout'),
@@ -14,15 +13,24 @@ urlpatterns = [
     path('accounts/login/', LoginView.as_view(template_name='registration/login.html'), name='login'),
     path('', views.album_list, name='home'),
     path('albums/', views.album_list, name='album_list'),
+    path('albums/public/', views.public_feed, name='public_feed'),
+    path('albums/stats/', views.album_stats, name='album_stats'),
     path('albums/create/', views.create_album, name='create_album'),
     path('albums/<uuid:album_id>/', views.album_detail, name='album_detail'),
+    path('albums/<uuid:album_id>/media/page/', views.album_media_page, name='album_media_page'),
     path('albums/<uuid:album_id>/access/', views.album_access, name='album_access'),
     path('albums/<uuid:album_id>/upload/', views.upload_media, name='upload_media'),
+    path('albums/<uuid:album_id>/upload/batch/', views.upload_media_batch, name='upload_media_batch'),
+    path('albums/<uuid:album_id>/uploads/', views.chunked_upload_start, name='chunked_upload_start'),
+    path('albums/<uuid:album_id>/uploads/<uuid:upload_id>/', views.chunked_upload_detail, name='chunked_upload_detail'),
+    path('albums/<uuid:album_id>/uploads/<uuid:upload_id>/finalize/', views.chunked_upload_finalize, name='chunked_upload_finalize'),
     path('albums/<uuid:album_id>/edit/', views.edit_album, name='edit_album'),
     path('albums/<uuid:album_id>/delete/', views.delete_album, name='delete_album'),
     path('albums/<uuid:album_id>/media/<uuid:media_id>/delete/', views.delete_media, name='delete_media'),
     path('albums/<uuid:album_id>/media/<uuid:media_id>/', views.view_media, name='view_media'),
+    path('albums/<uuid:album_id>/media/<uuid:media_id>/file/', views.media_file_content, name='media_file_content'),
+    path('albums/<uuid:album_id>/media/<uuid:media_id>/renditions/<int:rendition_id>/', views.media_rendition_content, name='media_rendition_content'),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# MEDIA_URL намеренно не раздаётся через static(): файлы доступны только
+# через media_file_content, который проверяет доступ к альбому.
\ No newline at end of file
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Throughput of the gallery under WSGI and under ASGI at equal worker counts.
+
+For each server the script starts the project (by default gunicorn for
+WSGI and uvicorn for ASGI, both with ``--workers``), waits until it
+accepts connections, optionally logs in, then keeps ``--concurrency``
+keep-alive connections busy with GET requests to the given paths for
+``--duration`` seconds.  It prints requests per second and latency
+percentiles per server and can write them as JSON.
+
+Example, against a database with data already in it::
+
+    python scripts/loadtest.py --workers 4 --concurrency 64 --duration 30 \\
+        --login alice:secret --path /albums/ --path /albums/<uuid>/
+
+gunicorn and uvicorn are not project requirements; install them in the
+environment that runs the comparison.  Use the queued activity log sink
+(``ACTIVITY_LOG_SINK = 'queued'``) for numbers that resemble production.
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import shlex
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+SERVERS = {
+    'wsgi': 'gunicorn photogallery.wsgi:application --workers {workers} --bind 127.0.0.1:{port}',
+    'asgi': 'uvicorn photogallery.asgi:application --workers {workers} --host 127.0.0.1 --port {port} --no-access-log',
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server on port {port} did not start in {timeout}s')
+
+
+def _cookies(response, jar):
+    for header in response.headers.get_all('Set-Cookie') or ():
+        for name, morsel in SimpleCookie(header).items():
+            jar[name] = morsel.value
+
+
+def _cookie_header(jar):
+    return '; '.join(f'{name}={value}' for name, value in jar.items())
+
+
+def login(port, username, password):
+    """Log in through the login form; returns the session cookies."""
+    jar = {}
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', '/accounts/login/')
+    response = conn.getresponse()
+    body = response.read().decode()
+    _cookies(response, jar)
+    match = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', body)
+    if not match:
+        raise RuntimeError('No CSRF token on the login page')
+
+    form = urlencode({'username': username, 'password': password, 'csrfmiddlewaretoken': match.group(1)})
+    conn.request('POST', '/accounts/login/', body=form, headers={
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Cookie': _cookie_header(jar),
+    })
+    response = conn.getresponse()
+    response.read()
+    _cookies(response, jar)
+    conn.close()
+    if response.status != 302 or 'sessionid' not in jar:
+        raise RuntimeError(f'Login failed (HTTP {response.status})')
+    return jar
+
+
+def worker(port, paths, headers, stop_at, results, lock):
+    latencies, errors, statuses = [], 0, {}
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    index = 0
+    while time.monotonic() < stop_at:
+        path = paths[index % len(paths)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.status >= 500:
+            errors += 1
+    conn.close()
+    with lock:
+        results['latencies'].extend(latencies)
+        results['errors'] += errors
+        for status, count in statuses.items():
+            results['statuses'][status] = results['statuses'].get(status, 0) + count
+
+
+def run_load(port, paths, concurrency, duration, warmup, cookies):
+    headers = {'User-Agent': 'gallery-loadtest/1.0'}
+    if cookies:
+        headers['Cookie'] = _cookie_header(cookies)
+
+    for phase, seconds in (('warmup', warmup), ('measure', duration)):
+        results = {'latencies': [], 'errors': 0, 'statuses': {}}
+        lock = threading.Lock()
+        stop_at = time.monotonic() + seconds
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker, args=(port, paths, headers, stop_at, results, lock))
+            for _ in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(results['latencies'])
+
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))], 2) if latencies else None
+
+    return {
+        'requests': len(latencies),
+        'errors': results['errors'],
+        'statuses': {str(status): count for status, count in sorted(results['statuses'].items())},
+        'rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies), 2) if latencies else None,
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def run_server(name, command, args):
+    port = free_port()
+    argv = shlex.split(command.format(workers=args.workers, port=port))
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': args.settings}
+    # Отдельная группа процессов: останавливаем сервер вместе с его воркерами
+    process = subprocess.Popen(argv, cwd=BASE_DIR, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if args.quiet else None)
+    try:
+        wait_for_port(port)
+        cookies = login(port, *args.login.split(':', 1)) if args.login else None
+        print(f'{name}: {" ".join(argv)}', file=sys.stderr)
+        return run_load(port, args.paths, args.concurrency, args.duration, args.warmup, cookies)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--path', action='append', dest='paths', required=True,
+                        help='Path to request; repeat to rotate over several.')
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes for both servers.')
+    parser.add_argument('--concurrency', type=int, default=32, help='Simultaneous client connections.')
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds per server.')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds before each run.')
+    parser.add_argument('--login', help='username:password to request the pages as.')
+    parser.add_argument('--server', action='append', dest='servers', choices=list(SERVERS),
+                        help='Only run these servers (default: both).')
+    parser.add_argument('--wsgi-command', default=SERVERS['wsgi'])
+    parser.add_argument('--asgi-command', default=SERVERS['asgi'])
+    parser.add_argument('--settings', default=os.environ.get('DJANGO_SETTINGS_MODULE', 'photogallery.settings'))
+    parser.add_argument('--output', '-o', help='Write the results as JSON to this file.')
+    parser.add_argument('--quiet', action='store_true', help='Hide server output.')
+    args = parser.parse_args()
+
+    commands = {'wsgi': args.wsgi_command, 'asgi': args.asgi_command}
+    results = {}
+    for name in args.servers or list(SERVERS):
+        results[name] = run_server(name, commands[name], args)
+        row = results[name]
+        print(f"{name}: {row['rps']} req/s, p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms, "
+              f"p99 {row['p99_ms']} ms, {row['errors']} errors, statuses {row['statuses']}")
+
+    if len(results) == 2 and results['wsgi']['rps']:
+        print(f"asgi/wsgi throughput: {results['asgi']['rps'] / results['wsgi']['rps']:.2f}x")
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'workers': args.workers,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'paths': args.paths,
+                'results': results,
+            }, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()